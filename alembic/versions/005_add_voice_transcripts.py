@@ -0,0 +1,35 @@
+"""Add voice transcripts table
+
+Revision ID: 005_add_voice_transcripts
+Revises: 004_add_llm_response_cache
+Create Date: 2026-10-16 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '005_add_voice_transcripts'
+down_revision: Union[str, None] = '004_add_llm_response_cache'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('voice_transcripts',
+    sa.Column('file_unique_id', sa.String(length=128), nullable=False),
+    sa.Column('model', sa.String(length=100), nullable=False),
+    sa.Column('language', sa.String(length=10), nullable=False),
+    sa.Column('text', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('file_unique_id', 'model', 'language')
+    )
+    op.create_index(op.f('ix_voice_transcripts_created_at'), 'voice_transcripts', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_voice_transcripts_created_at'), table_name='voice_transcripts')
+    op.drop_table('voice_transcripts')
@@ -0,0 +1,26 @@
+"""Add transcript column to profile voice chunks
+
+Revision ID: 006_add_voice_chunk_transcript
+Revises: 005_add_voice_transcripts
+Create Date: 2026-10-16 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '006_add_voice_chunk_transcript'
+down_revision: Union[str, None] = '005_add_voice_transcripts'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('profile_voice_chunks', sa.Column('transcript', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('profile_voice_chunks', 'transcript')
@@ -0,0 +1,60 @@
+"""Add HNSW index on documents.embedding
+
+Revision ID: 007_documents_embedding_idx
+Revises: 006_add_voice_chunk_transcript
+Create Date: 2026-10-16 18:00:00.000000
+
+Проверка, что поиск AITrainerService.search_in_documents (DOCUMENTS_SEARCH_SQL) идет по индексу.
+Embedding запроса для проверки — любой существующий, ef_search как в боте (DOCUMENTS_EF_SEARCH):
+
+    BEGIN;
+    SELECT set_config('hnsw.ef_search', '40', true);
+    EXPLAIN (ANALYZE, BUFFERS)
+    SELECT content, metadata, 1 - distance AS similarity
+    FROM (
+        SELECT content, metadata,
+               embedding <=> (SELECT embedding FROM documents WHERE embedding IS NOT NULL LIMIT 1) AS distance
+        FROM documents
+        WHERE embedding IS NOT NULL
+        ORDER BY distance
+        LIMIT 5
+    ) AS nearest
+    ORDER BY distance;
+    ROLLBACK;
+
+В плане должен быть "Index Scan using documents_embedding_hnsw_idx on documents".
+"Seq Scan on documents" + "Sort" значит, что индекса нет или оператор/opclass не совпадают
+(<=> требует vector_cosine_ops). На совсем маленькой таблице планировщик может выбрать
+Seq Scan сам: для проверки — SET LOCAL enable_seqscan = off.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '007_documents_embedding_idx'
+down_revision: Union[str, None] = '006_add_voice_chunk_transcript'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Таблица documents создается вне миграций (Supabase), поэтому индекс — только если она есть.
+    # HNSW (pgvector >= 0.5.0) по косинусному расстоянию: в поиске используется оператор <=>
+    op.execute("""
+        DO $$
+        BEGIN
+            IF to_regclass('public.documents') IS NOT NULL THEN
+                CREATE INDEX IF NOT EXISTS documents_embedding_hnsw_idx
+                ON documents USING hnsw (embedding vector_cosine_ops)
+                WITH (m = 16, ef_construction = 64);
+            END IF;
+        END
+        $$;
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS documents_embedding_hnsw_idx")
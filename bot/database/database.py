@@ -1,5 +1,8 @@
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from pgvector.asyncpg import register_vector
 from bot.database.models import Base
+from typing import Any, Optional
 import os
 from dotenv import load_dotenv
 import logging
@@ -30,6 +33,21 @@ engine = create_async_engine(
     }
 )
 
+
+async def _register_vector_codec(connection) -> None:
+    """Бинарный кодек типа vector: embedding уходит в запрос параметром, а не строкой в SQL"""
+    try:
+        await register_vector(connection)
+    except ValueError as e:
+        # Расширение vector не установлено — векторный поиск работать не будет, остальное работает
+        logger.warning(f"pgvector недоступен: {e}")
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _on_connect(dbapi_connection, connection_record) -> None:
+    dbapi_connection.run_async(_register_vector_codec)
+
+
 # Создаем фабрику сессий
 AsyncSessionLocal = async_sessionmaker(
     engine,
@@ -44,4 +62,58 @@ async def init_db():
 async def get_session() -> AsyncSession:
     """Получить сессию БД"""
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+
+class LazySession:
+    """
+    Прокси над AsyncSession с ленивым созданием.
+    
+    Правила:
+    - AsyncSession создается при первом обращении к любому атрибуту
+    - Соединение из пула берется только при первом запросе/flush
+    - commit/rollback не делаются, если соединение не бралось и нет pending-изменений
+    
+    Для хендлеров и сервисов ведет себя как обычная AsyncSession.
+    """
+    
+    def __init__(self, session_factory: async_sessionmaker = AsyncSessionLocal):
+        self._session_factory = session_factory
+        self._session: Optional[AsyncSession] = None
+        self.connection_used = False  # Бралось ли соединение хотя бы раз
+    
+    @property
+    def session(self) -> AsyncSession:
+        """Настоящая AsyncSession (создается при первом обращении)"""
+        if self._session is None:
+            self._session = self._session_factory()
+            # after_begin срабатывает, когда сессия начинает транзакцию на соединении
+            event.listen(self._session.sync_session, "after_begin", self._on_begin)
+        return self._session
+    
+    def _on_begin(self, session, transaction, connection) -> None:
+        self.connection_used = True
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.session, name)
+    
+    @property
+    def has_pending_work(self) -> bool:
+        """Есть ли что коммитить/откатывать"""
+        if self._session is None:
+            return False
+        if self._session.in_transaction() and self.connection_used:
+            return True
+        return bool(self._session.new or self._session.dirty or self._session.deleted)
+    
+    async def commit(self) -> None:
+        if self.has_pending_work:
+            await self._session.commit()
+    
+    async def rollback(self) -> None:
+        if self.has_pending_work:
+            await self._session.rollback()
+    
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, Text, ForeignKey, UUID, JSON, Numeric
+from sqlalchemy import Column, String, Integer, Boolean, DateTime, Text, ForeignKey, UUID, JSON, Numeric, LargeBinary
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql import func
 import uuid
@@ -190,6 +190,7 @@ class ProfileVoiceChunk(Base):
     file_id = Column(Text, nullable=False)
     duration_seconds = Column(Integer, nullable=True)
     sequence_number = Column(Integer, default=0, index=True)  # Индекс для сортировки
+    transcript = Column(Text, nullable=True)  # Заполняется фоновой транскрибацией сразу после получения
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
@@ -239,4 +240,46 @@ class ContentPost(Base):
     
     # Relationships
     user = relationship("User", backref="content_posts")
-    idea = relationship("ContentIdea", backref="posts")
\ No newline at end of file
+    idea = relationship("ContentIdea", backref="posts")
+
+# Инфраструктурные модели
+class FSMRecord(Base):
+    """Состояние и данные FSM aiogram (персистентное хранилище)"""
+    __tablename__ = 'fsm_storage'
+    
+    key = Column(String(255), primary_key=True)  # Ключ от KeyBuilder aiogram
+    state = Column(String(255), nullable=True)
+    data = Column(LargeBinary, nullable=True)  # Компактно сериализованный dict
+    expires_at = Column(DateTime(timezone=True), nullable=True, index=True)  # Индекс для очистки истекших
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class LLMCacheEntry(Base):
+    """Кэш ответов LLM для детерминированных промптов (ключ — хэш запроса)"""
+    __tablename__ = 'llm_response_cache'
+    
+    key = Column(String(64), primary_key=True)  # sha256(model, messages, params)
+    model = Column(String(100), nullable=False)
+    response = Column(Text, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)  # Индекс для очистки истекших
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class VoiceTranscript(Base):
+    """Кэш транскрипций голосовых (ключ — file_unique_id Telegram + модель + язык)"""
+    __tablename__ = 'voice_transcripts'
+    
+    file_unique_id = Column(String(128), primary_key=True)  # Стабилен для одного и того же файла
+    model = Column(String(100), primary_key=True)
+    language = Column(String(10), primary_key=True)  # '' — автоопределение языка
+    text = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)  # Индекс для очистки старых
+
+
+class EmbeddingCacheEntry(Base):
+    """Кэш embeddings (ключ — хэш модели и нормализованного текста)"""
+    __tablename__ = 'embedding_cache'
+    
+    key = Column(String(64), primary_key=True)  # sha256(model, нормализованный текст)
+    model = Column(String(100), nullable=False)
+    embedding = Column(LargeBinary, nullable=False)  # float32 (array('f').tobytes())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)  # Индекс для очистки старых
@@ -0,0 +1,72 @@
+"""
+Unit of work для кода с долгими внешними вызовами (OpenAI, Whisper, Fal.ai).
+
+Шаблон: короткая транзакция чтения → внешний вызов без соединения → короткая транзакция записи.
+Соединение из пула держится только пока идет работа с БД, а не пока ждем ответ AI,
+поэтому размер пула определяется нагрузкой на БД, а не задержкой провайдеров.
+
+Использование в хендлере (сессия от DatabaseMiddleware):
+    profile = await ContentProfileService.get_profile_data(session, user.id)  # чтение
+    async with connection_released(session):
+        ideas = await llm_service.generate_content_ideas(...)                 # без соединения
+    await ContentIdeasService.create_idea(session, ...)                       # запись, commit — в middleware
+
+Вне хендлера (фоновые задачи) — отдельные короткие транзакции:
+    async with write_transaction() as session:
+        await AIDesignerService.save_generation(session, ...)
+"""
+
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from bot.database.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def connection_released(session: AsyncSession) -> AsyncIterator[None]:
+    """
+    Выполнить блок, не удерживая соединение с БД.
+
+    Перед блоком текущая транзакция коммитится (чтение или накопленные изменения),
+    соединение возвращается в пул. После блока сессия возьмет новое соединение
+    при первом запросе. Загруженные объекты остаются доступны для чтения
+    (expire_on_commit=False), но ленивые связи у них уже не подгрузятся.
+
+    Это ранний commit (см. DatabaseMiddleware): изменения, сделанные до блока,
+    сохранятся, даже если AI-вызов или код после блока упадет. Поэтому до блока —
+    только чтение или записи, которые безопасно оставить при сбое (в месте вызова
+    это поясняется комментарием).
+
+    Внутри блока сессию использовать нельзя.
+    """
+    await session.commit()
+    await session.close()
+    yield
+
+
+@asynccontextmanager
+async def read_transaction(
+    session_factory: async_sessionmaker = AsyncSessionLocal
+) -> AsyncIterator[AsyncSession]:
+    """Короткая транзакция чтения: соединение возвращается в пул сразу после блока"""
+    async with session_factory() as session:
+        yield session
+
+
+@asynccontextmanager
+async def write_transaction(
+    session_factory: async_sessionmaker = AsyncSessionLocal
+) -> AsyncIterator[AsyncSession]:
+    """Короткая транзакция записи: commit после блока, rollback при ошибке"""
+    async with session_factory() as session:
+        try:
+            yield session
+            await session.commit()
+        except BaseException:
+            await session.rollback()
+            raise
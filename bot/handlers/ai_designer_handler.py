@@ -3,11 +3,16 @@ from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKe
 from aiogram.fsm.context import FSMContext
 from sqlalchemy.ext.asyncio import AsyncSession
 from aiogram.exceptions import TelegramBadRequest
+from typing import Awaitable, Callable, Optional, Tuple
+import uuid
 
 
+from bot.database.unit_of_work import write_transaction
 from bot.keyboards.keyboards import get_back_to_pro_menu, get_ai_designer_menu, get_ai_designer_control_panel
 from bot.services.user_service import UserService
 from bot.services.ai_designer_service import AIDesignerService
+from bot.utils.background_jobs import get_background_jobs
+from bot.utils.fal_queue import FalProgressCallback
 from bot.utils.states import UserStates
 import logging
 
@@ -16,6 +21,113 @@ router = Router()
 logger = logging.getLogger(__name__)
 
 
+# Статус генерации в очереди Fal.ai для сообщения о прогрессе
+def _progress_line(status: str, queue_position: Optional[int]) -> str:
+    if status == "IN_QUEUE":
+        if queue_position:
+            return f"⏳ В очереди: перед тобой {queue_position}"
+        return "⏳ В очереди, скоро начну"
+    return "🖌 Рисую..."
+
+
+def deliver_generation_in_background(
+    message: Message,
+    processing_msg: Message,
+    user_id: uuid.UUID,
+    mode: str,
+    status_title: str,
+    generate: Callable[[FalProgressCallback], Awaitable[Tuple[str, str]]],
+    success_caption: str,
+    error_title: str,
+    error_hint: str = ""
+) -> None:
+    """
+    Запустить генерацию в фоне и доставить результат пользователю.
+    
+    Хендлер (и его соединение с БД) не ждет генерацию: статус-сообщение
+    обновляется по мере продвижения очереди Fal.ai, результат отправляется
+    и сохраняется фоновой задачей со своей сессией БД.
+    
+    Args:
+        message: Запрос пользователя
+        processing_msg: Статус-сообщение
+        user_id: ID пользователя в БД
+        mode: Режим генерации (для AIGeneration.mode)
+        status_title: Первая строка статус-сообщения
+        generate: Генерация (колбэк прогресса) -> (промпт, URL изображения)
+        success_caption: Подпись к готовому изображению
+        error_title: Заголовок сообщения об ошибке
+        error_hint: Подсказка после ошибки
+    """
+    async def report_progress(status: str, queue_position: Optional[int]) -> None:
+        try:
+            await processing_msg.edit_text(
+                f"{status_title}\n{_progress_line(status, queue_position)}",
+                parse_mode="Markdown"
+            )
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+    
+    async def job() -> None:
+        try:
+            prompt, image_url = await generate(report_progress)
+        except ValueError as e:
+            try:
+                await processing_msg.delete()
+            except:
+                pass
+            await message.answer(
+                f"⚠️ {str(e)}",
+                reply_markup=get_ai_designer_control_panel(),
+                parse_mode="Markdown"
+            )
+            return
+        except Exception as e:
+            logger.error(f"{error_title} ({mode}): {e}")
+            try:
+                await processing_msg.delete()
+            except:
+                pass
+            
+            # Экранируем спецсимволы для Markdown
+            error_msg = str(e).replace('_', '\\_').replace('*', '\\*').replace('[', '\\[').replace('`', '\\`')
+            await message.answer(
+                f"❌ **{error_title}**\n\n`{error_msg}`\n\n{error_hint}".rstrip(),
+                reply_markup=get_ai_designer_control_panel(),
+                parse_mode="Markdown"
+            )
+            return
+        
+        # Удаляем служебные сообщения
+        try:
+            await message.delete()  # Удаляем запрос пользователя
+            await processing_msg.delete()  # Удаляем статус
+        except:
+            pass
+        
+        # Отправляем результат с постоянной панелью
+        result_msg = await message.answer_photo(
+            photo=image_url,
+            caption=success_caption,
+            reply_markup=get_ai_designer_control_panel(),
+            parse_mode="Markdown"
+        )
+        
+        # ТЕПЕРЬ сохраняем с ID сообщения БОТА (своя сессия: хендлер давно завершился)
+        async with write_transaction() as db_session:
+            await AIDesignerService.save_generation(
+                db_session,
+                user_id,
+                str(result_msg.message_id),
+                prompt,
+                image_url,
+                mode
+            )
+    
+    get_background_jobs('generation').submit(f"designer:{message.chat.id}:{message.message_id}", job)
+
+
 @router.callback_query(F.data == "ai_designer")
 async def ai_designer_start(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Вход в AI-Designer"""
@@ -112,66 +224,39 @@ async def handle_text_request(message: Message, state: FSMContext, session: Asyn
 async def handle_text_to_image(message: Message, state: FSMContext, session: AsyncSession, user):
     """АГЕНТ 1: Генерация изображения из текста"""
     
+    status_title = "🎨 **Генерирую изображение...**"
     processing_msg = await message.answer(
-        "🎨 **Генерирую изображение...**\n⏱ Это займёт 10-30 секунд",
+        f"{status_title}\n⏱ Это займёт 10-30 секунд",
         parse_mode="Markdown"
     )
     
-    try:
-        # Генерируем изображение (пока без сохранения - нам нужен ID сообщения бота)
+    async def generate(on_progress: FalProgressCallback) -> Tuple[str, str]:
         prompt = await AIDesignerService.generate_prompt_with_openai(
             message.text,
             case_type="A"
         )
-        
-        image_url = await AIDesignerService.generate_image_with_flux_edit(prompt)
-        
-        # Удаляем служебные сообщения
-        try:
-            await message.delete()  # Удаляем запрос пользователя
-            await processing_msg.delete()  # Удаляем статус
-        except:
-            pass
-        
-        # Отправляем результат с постоянной панелью
-        result_msg = await message.answer_photo(
-            photo=image_url,
-            caption="✅ **Готово!**\n\n💡 Хочешь изменить? Ответь (Reply) на это фото с точным описанием!",
-            reply_markup=get_ai_designer_control_panel(),
-            parse_mode="Markdown"
-        )
-        
-        # ТЕПЕРЬ сохраняем с ID сообщения БОТА
-        await AIDesignerService.save_generation(
-            session,
-            user.id,
-            str(result_msg.message_id),
-            prompt,
-            image_url,
-            "text_to_image"
-        )
-        
-    except Exception as e:
-        logger.error(f"Ошибка генерации (Агент 1): {e}")
-        try:
-            await processing_msg.delete()
-        except:
-            pass
-        
-        # Экранируем спецсимволы для Markdown
-        error_msg = str(e).replace('_', '\\_').replace('*', '\\*').replace('[', '\\[').replace('`', '\\`')
-        await message.answer(
-            f"❌ **Ошибка генерации**\n\n`{error_msg}`\n\nПопробуй другой запрос.",
-            reply_markup=get_ai_designer_control_panel(),
-            parse_mode="Markdown"
-        )
+        image_url = await AIDesignerService.generate_image_with_flux_edit(prompt, on_progress=on_progress)
+        return prompt, image_url
+    
+    deliver_generation_in_background(
+        message,
+        processing_msg,
+        user.id,
+        "text_to_image",
+        status_title,
+        generate,
+        success_caption="✅ **Готово!**\n\n💡 Хочешь изменить? Ответь (Reply) на это фото с точным описанием!",
+        error_title="Ошибка генерации",
+        error_hint="Попробуй другой запрос."
+    )
 
 
 async def handle_image_edit(message: Message, state: FSMContext, session: AsyncSession, user):
     """АГЕНТ 2: Редактирование существующего изображения"""
     
+    status_title = "✏️ **Редактирую изображение...**"
     processing_msg = await message.answer(
-        "✏️ **Редактирую изображение...**\n⏱ Это займёт 10-30 секунд",
+        f"{status_title}\n⏱ Это займёт 10-30 секунд",
         parse_mode="Markdown"
     )
     
@@ -187,38 +272,28 @@ async def handle_image_edit(message: Message, state: FSMContext, session: AsyncS
         if not old_generation:
             raise ValueError("Старая генерация не найдена или истекла (48 часов)")
         
-        # Улучшаем промпт редактирования
-        edit_prompt = await AIDesignerService.enhance_edit_prompt_with_llm(message.text)
+        source_image_url = old_generation.image_url
         
-        # Генерируем
-        image_url = await AIDesignerService.generate_image_with_flux_edit(
-            edit_prompt,
-            image_url=old_generation.image_url
-        )
-        
-        # Удаляем служебные сообщения
-        try:
-            await message.delete()  # Удаляем запрос пользователя
-            await processing_msg.delete()  # Удаляем статус
-        except:
-            pass
-        
-        # Отправляем результат с панелью
-        result_msg = await message.answer_photo(
-            photo=image_url,
-            caption="✅ **Изменения применены!**\n\n💡 Продолжай редактировать? Ответь (Reply) на это фото!",
-            reply_markup=get_ai_designer_control_panel(),
-            parse_mode="Markdown"
-        )
+        async def generate(on_progress: FalProgressCallback) -> Tuple[str, str]:
+            # Улучшаем промпт редактирования
+            edit_prompt = await AIDesignerService.enhance_edit_prompt_with_llm(message.text)
+            image_url = await AIDesignerService.generate_image_with_flux_edit(
+                edit_prompt,
+                image_url=source_image_url,
+                on_progress=on_progress
+            )
+            return edit_prompt, image_url
         
-        # Сохраняем с ID сообщения БОТА
-        await AIDesignerService.save_generation(
-            session,
+        deliver_generation_in_background(
+            message,
+            processing_msg,
             user.id,
-            str(result_msg.message_id),
-            edit_prompt,
-            image_url,
-            "image_to_image_edit"
+            "image_to_image_edit",
+            status_title,
+            generate,
+            success_caption="✅ **Изменения применены!**\n\n💡 Продолжай редактировать? Ответь (Reply) на это фото!",
+            error_title="Ошибка редактирования",
+            error_hint="Попробуй точнее описать изменения."
         )
         
     except ValueError as e:
@@ -231,17 +306,6 @@ async def handle_image_edit(message: Message, state: FSMContext, session: AsyncS
             reply_markup=get_ai_designer_control_panel(),
             parse_mode="Markdown"
         )
-    except Exception as e:
-        logger.error(f"Ошибка редактирования (Агент 2): {e}")
-        try:
-            await processing_msg.delete()
-        except:
-            pass
-        await message.answer(
-            f"❌ **Ошибка редактирования**\n\n{str(e)}\n\nПопробуй точнее описать изменения.",
-            reply_markup=get_ai_designer_control_panel(),
-            parse_mode="Markdown"
-        )
 
 
 @router.message(UserStates.ai_designer_active, F.photo)
@@ -297,8 +361,9 @@ async def handle_photo_transformation(message: Message, state: FSMContext, sessi
 async def handle_image_edit_with_reference_photo(message: Message, state: FSMContext, session: AsyncSession, user):
     """АГЕНТ 2 (АЛЬТЕРНАТИВНЫЙ): Редактирование через reply на фото с фото-референсом"""
     
+    status_title = "✏️ **Редактирую изображение с референсом...**"
     processing_msg = await message.answer(
-        "✏️ **Редактирую изображение с референсом...**\n⏱ Это займёт 10-30 секунд",
+        f"{status_title}\n⏱ Это займёт 10-30 секунд",
         parse_mode="Markdown"
     )
     
@@ -314,45 +379,36 @@ async def handle_image_edit_with_reference_photo(message: Message, state: FSMCon
         if not old_generation:
             raise ValueError("Старая генерация не найдена или истекла (48 часов)")
         
+        source_image_url = old_generation.image_url
+        
         # Получаем URL фото пользователя (референс)
         photo = message.photo[-1]
         file = await message.bot.get_file(photo.file_id)
         reference_photo_url = f"https://api.telegram.org/file/bot{message.bot.token}/{file.file_path}"
         
-        # Улучшаем промпт редактирования с учётом референса
-        edit_prompt = await AIDesignerService.enhance_edit_prompt_with_llm(
-            f"{message.caption} (Reference photo provided for style/composition guidance)"
-        )
-        
-        # Генерируем с обоими изображениями
-        image_url = await AIDesignerService.generate_image_with_flux_edit(
-            edit_prompt,
-            image_urls=[old_generation.image_url, reference_photo_url]
-        )
-        
-        # Удаляем служебные сообщения
-        try:
-            await message.delete()
-            await processing_msg.delete()
-        except:
-            pass
-        
-        # Отправляем результат с панелью
-        result_msg = await message.answer_photo(
-            photo=image_url,
-            caption="✅ **Изменения применены!**\n\n💡 Продолжай редактировать? Ответь (Reply) на это фото!",
-            reply_markup=get_ai_designer_control_panel(),
-            parse_mode="Markdown"
-        )
+        async def generate(on_progress: FalProgressCallback) -> Tuple[str, str]:
+            # Улучшаем промпт редактирования с учётом референса
+            edit_prompt = await AIDesignerService.enhance_edit_prompt_with_llm(
+                f"{message.caption} (Reference photo provided for style/composition guidance)"
+            )
+            # Генерируем с обоими изображениями
+            image_url = await AIDesignerService.generate_image_with_flux_edit(
+                edit_prompt,
+                image_urls=[source_image_url, reference_photo_url],
+                on_progress=on_progress
+            )
+            return edit_prompt, image_url
         
-        # Сохраняем с ID сообщения БОТА
-        await AIDesignerService.save_generation(
-            session,
+        deliver_generation_in_background(
+            message,
+            processing_msg,
             user.id,
-            str(result_msg.message_id),
-            edit_prompt,
-            image_url,
-            "image_to_image_edit"
+            "image_to_image_edit",
+            status_title,
+            generate,
+            success_caption="✅ **Изменения применены!**\n\n💡 Продолжай редактировать? Ответь (Reply) на это фото!",
+            error_title="Ошибка редактирования",
+            error_hint="Попробуй точнее описать изменения."
         )
         
     except ValueError as e:
@@ -394,8 +450,9 @@ async def handle_standard_photo_transformation(message: Message, state: FSMConte
         )
         return
     
+    status_title = "🎭 **Трансформирую по референсу...**"
     processing_msg = await message.answer(
-        "🎭 **Трансформирую по референсу...**\n⏱ Это займёт 10-30 секунд",
+        f"{status_title}\n⏱ Это займёт 10-30 секунд",
         parse_mode="Markdown"
     )
     
@@ -405,41 +462,30 @@ async def handle_standard_photo_transformation(message: Message, state: FSMConte
         file = await message.bot.get_file(photo.file_id)
         photo_url = f"https://api.telegram.org/file/bot{message.bot.token}/{file.file_path}"
         
-        # Генерируем промпт трансформации
-        transform_prompt = await AIDesignerService.generate_prompt_with_openai(
-            f"Transform this image: {message.caption}",
-            case_type="C"
-        )
-        
-        # Генерируем изображение
-        image_url = await AIDesignerService.generate_image_with_flux_edit(
-            transform_prompt,
-            image_url=photo_url
-        )
-        
-        # Удаляем служебные сообщения
-        try:
-            await message.delete()
-            await processing_msg.delete()
-        except:
-            pass
-        
-        # Отправляем результат с панелью
-        result_msg = await message.answer_photo(
-            photo=image_url,
-            caption="✨ **Трансформация завершена!**\n\n💡 Хочешь добавить себя на эту картинку? Ответь (Reply) на неё с твоим фото!",
-            reply_markup=get_ai_designer_control_panel(),
-            parse_mode="Markdown"
-        )
+        async def generate(on_progress: FalProgressCallback) -> Tuple[str, str]:
+            # Генерируем промпт трансформации
+            transform_prompt = await AIDesignerService.generate_prompt_with_openai(
+                f"Transform this image: {message.caption}",
+                case_type="C"
+            )
+            # Генерируем изображение
+            image_url = await AIDesignerService.generate_image_with_flux_edit(
+                transform_prompt,
+                image_url=photo_url,
+                on_progress=on_progress
+            )
+            return transform_prompt, image_url
         
-        # Сохраняем с ID сообщения БОТА
-        await AIDesignerService.save_generation(
-            session,
+        deliver_generation_in_background(
+            message,
+            processing_msg,
             user.id,
-            str(result_msg.message_id),
-            transform_prompt,
-            image_url,
-            "image_to_image_transform"
+            "image_to_image_transform",
+            status_title,
+            generate,
+            success_caption="✨ **Трансформация завершена!**\n\n💡 Хочешь добавить себя на эту картинку? Ответь (Reply) на неё с твоим фото!",
+            error_title="Ошибка трансформации",
+            error_hint="Попробуй другое фото или описание."
         )
         
     except Exception as e:
@@ -473,8 +519,9 @@ async def handle_replay_with_user_photo(message: Message, state: FSMContext, ses
         )
         return
     
+    status_title = "🎬 **Добавляю тебя на изображение...**"
     processing_msg = await message.answer(
-        "🎬 **Добавляю тебя на изображение...**\n⏱ Это займёт 15-40 секунд",
+        f"{status_title}\n⏱ Это займёт 15-40 секунд",
         parse_mode="Markdown"
     )
     
@@ -495,38 +542,16 @@ async def handle_replay_with_user_photo(message: Message, state: FSMContext, ses
         file = await message.bot.get_file(photo.file_id)
         user_photo_url = f"https://api.telegram.org/file/bot{message.bot.token}/{file.file_path}"
         
-        # Оптимизируем промпт
-        replay_prompt = await AIDesignerService.enhance_replay_prompt_with_llm(message.caption)
-        
-        # Генерируем
-        image_url = await AIDesignerService.generate_image_with_flux_edit(
-            replay_prompt,
-            image_urls=[original_generation.image_url, user_photo_url]
-        )
-        
-        # Удаляем служебные сообщения
-        try:
-            await message.delete()
-            await processing_msg.delete()
-        except:
-            pass
-        
-        # Отправляем результат с панелью
-        result_msg = await message.answer_photo(
-            photo=image_url,
-            caption="🎬 **Готово! Ты добавлен на изображение!**\n\n💡 Хочешь ещё изменений? Ответь (Reply) на это фото!",
-            reply_markup=get_ai_designer_control_panel(),
-            parse_mode="Markdown"
-        )
-        
-        # Сохраняем с ID сообщения БОТА
-        await AIDesignerService.save_generation(
-            session,
+        deliver_generation_in_background(
+            message,
+            processing_msg,
             user.id,
-            str(result_msg.message_id),
-            replay_prompt,
-            image_url,
-            "image_to_image_replay"
+            "image_to_image_replay",
+            status_title,
+            _replay_generator(message.caption, original_generation.image_url, user_photo_url),
+            success_caption="🎬 **Готово! Ты добавлен на изображение!**\n\n💡 Хочешь ещё изменений? Ответь (Reply) на это фото!",
+            error_title="Ошибка добавления на изображение",
+            error_hint="Попробуй другое фото или описание."
         )
         
     except ValueError as e:
@@ -554,6 +579,26 @@ async def handle_replay_with_user_photo(message: Message, state: FSMContext, ses
         )
 
 
+def _replay_generator(
+    user_request: str,
+    scene_image_url: str,
+    user_photo_url: str
+) -> Callable[[FalProgressCallback], Awaitable[Tuple[str, str]]]:
+    """Генерация для replay (общая для reply на фото и выбора из истории)"""
+    async def generate(on_progress: FalProgressCallback) -> Tuple[str, str]:
+        # Оптимизируем промпт
+        replay_prompt = await AIDesignerService.enhance_replay_prompt_with_llm(user_request)
+        # Генерируем
+        image_url = await AIDesignerService.generate_image_with_flux_edit(
+            replay_prompt,
+            image_urls=[scene_image_url, user_photo_url],
+            on_progress=on_progress
+        )
+        return replay_prompt, image_url
+    
+    return generate
+
+
 @router.callback_query(F.data == "ai_designer_examples")
 async def show_examples(callback: CallbackQuery):
     """Показать примеры запросов"""
@@ -872,8 +917,9 @@ async def handle_replay_from_history(message: Message, state: FSMContext, sessio
         await state.set_state(UserStates.ai_designer_active)
         return
     
+    status_title = "🎬 **Добавляю тебя на изображение...**"
     processing_msg = await message.answer(
-        "🎬 **Добавляю тебя на изображение...**\n⏱ Это займёт 15-40 секунд",
+        f"{status_title}\n⏱ Это займёт 15-40 секунд",
         parse_mode="Markdown"
     )
     
@@ -892,41 +938,18 @@ async def handle_replay_from_history(message: Message, state: FSMContext, sessio
         file = await message.bot.get_file(photo.file_id)
         user_photo_url = f"https://api.telegram.org/file/bot{message.bot.token}/{file.file_path}"
         
-        # Оптимизируем промпт
-        replay_prompt = await AIDesignerService.enhance_replay_prompt_with_llm(message.caption)
-        
-        # Генерируем
-        image_url = await AIDesignerService.generate_image_with_flux_edit(
-            replay_prompt,
-            image_urls=[original_generation.image_url, user_photo_url]
-        )
-        
-        # Удаляем служебные сообщения
-        try:
-            await message.delete()
-            await processing_msg.delete()
-        except:
-            pass
-        
-        # Отправляем результат
-        result_msg = await message.answer_photo(
-            photo=image_url,
-            caption="🎬 **Готово! Ты добавлен на изображение!**\n\n💡 Хочешь ещё изменений? Ответь (Reply) на это фото!",
-            reply_markup=get_ai_designer_control_panel(),
-            parse_mode="Markdown"
-        )
-        
-        # Сохраняем с ID сообщения БОТА
-        await AIDesignerService.save_generation(
-            session,
+        deliver_generation_in_background(
+            message,
+            processing_msg,
             user.id,
-            str(result_msg.message_id),
-            replay_prompt,
-            image_url,
-            "image_to_image_replay"
+            "image_to_image_replay",
+            status_title,
+            _replay_generator(message.caption, original_generation.image_url, user_photo_url),
+            success_caption="🎬 **Готово! Ты добавлен на изображение!**\n\n💡 Хочешь ещё изменений? Ответь (Reply) на это фото!",
+            error_title="Ошибка"
         )
         
-        # Возвращаем в активный режим
+        # Возвращаем в активный режим (результат придет из фоновой задачи)
         await state.set_state(UserStates.ai_designer_active)
         
     except ValueError as e:
@@ -955,7 +978,6 @@ async def handle_replay_from_history(message: Message, state: FSMContext, sessio
         )
         await state.set_state(UserStates.ai_designer_active)
 
-
 @router.callback_query(UserStates.ai_designer_awaiting_replay_photo, F.data == "back_to_pro")
 async def cancel_replay_and_back_to_designer(callback: CallbackQuery, state: FSMContext):
     """Отмена ожидания фото для replay и возврат в AI-Designer"""
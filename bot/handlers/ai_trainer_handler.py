@@ -4,11 +4,9 @@ from aiogram.fsm.context import FSMContext
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Dict, Optional
 import logging
-import os
-import tempfile
-import asyncio
 from aiogram.exceptions import TelegramBadRequest
 
+from bot.database.unit_of_work import connection_released
 from bot.keyboards.keyboards import (
     get_ai_trainer_menu,
     get_opponent_card_keyboard,
@@ -20,6 +18,7 @@ from bot.keyboards.keyboards import (
 from bot.services.user_service import UserService
 from bot.services.ai_trainer_service import AITrainerService
 from bot.utils.states import UserStates
+from bot.utils.streaming import StreamingMessage
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -340,6 +339,9 @@ async def handle_training_text(message: Message, state: FSMContext, session: Asy
         await message.answer("❌ Ошибка: сессия не найдена")
         return
     
+    # Embedding для поиска фактов — до первого запроса к БД (соединение еще не взято)
+    await AITrainerService.prepare_query_embedding(message.text)
+    
     # Сохраняем сообщение пользователя
     await AITrainerService.add_message_to_session(
         session,
@@ -354,28 +356,36 @@ async def handle_training_text(message: Message, state: FSMContext, session: Asy
     # Получаем данные соперника
     opponent = await AITrainerService.get_opponent_by_id(session, opponent_id)
     
-    # Анализируем интент сообщения
-    intent = await AITrainerService.analyze_intent(message.text)
-    
-    # Получаем релевантные знания из БД
-    relevant_knowledge = await AITrainerService.get_relevant_knowledge(
-        session,
-        intent['topics']
-    )
+    # Получаем релевантные факты (гибридный поиск по базе знаний и documents)
+    relevant_knowledge = await AITrainerService.retrieve_context(session, message.text)
     
     # Получаем историю диалога
     conversation_history = await AITrainerService.get_session_history(session, session_id)
     
     # Генерируем ответ AI
-    ai_response = await AITrainerService.generate_ai_response(
-        opponent['base_prompt'],
-        conversation_history,
-        message.text,
-        relevant_knowledge
-    )
+    # Ответ выводим по мере генерации
+    stream = StreamingMessage(await message.answer("💬 ..."))
+    
+    # Соединение с БД не держим, пока LLM пишет ответ. Ранний commit фиксирует реплику
+    # пользователя: ее безопасно сохранить, даже если соперник не ответит (она уже в диалоге)
+    async with connection_released(session):
+        ai_response = await AITrainerService.generate_ai_response(
+            opponent['base_prompt'],
+            conversation_history,
+            message.text,
+            relevant_knowledge,
+            on_partial=stream.update
+        )
     
     if not ai_response:
-        ai_response = "Хм, интересно... Расскажи подробнее?"
+        # Не подставляем выдуманную реплику соперника — честно сообщаем об ошибке
+        await stream.finalize(
+            "⚠️ Соперник не смог ответить: сервис AI временно недоступен.\n"
+            "Отправь сообщение ещё раз чуть позже.",
+            reply_markup=get_training_active_keyboard(session_id),
+            parse_mode=None
+        )
+        return
     
     # Сохраняем ответ AI
     await AITrainerService.add_message_to_session(
@@ -385,10 +395,11 @@ async def handle_training_text(message: Message, state: FSMContext, session: Asy
         ai_response
     )
     
-    # Отправляем ответ
-    await message.answer(
+    # Финальный текст с клавиатурой
+    await stream.finalize(
         ai_response,
-        reply_markup=get_training_active_keyboard(session_id)
+        reply_markup=get_training_active_keyboard(session_id),
+        parse_mode=None
     )
 
 @router.message(UserStates.ai_trainer_active, F.voice)
@@ -404,72 +415,77 @@ async def handle_training_voice(message: Message, state: FSMContext, session: As
     
     await message.answer("🎤 Обрабатываю голосовое сообщение...")
     
-    # Скачиваем голосовое
     voice: Voice = message.voice
-    file = await message.bot.get_file(voice.file_id)
     
-    # Сохраняем во временный файл
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.ogg') as temp_file:
-        await message.bot.download_file(file.file_path, temp_file)
-        temp_path = temp_file.name
+    # Транскрибируем (повторно обработанное голосовое берется из кэша)
+    transcribed_text = await AITrainerService.transcribe_voice(message.bot, voice.file_id, voice.file_unique_id)
     
-    try:
-        # Транскрибируем
-        transcribed_text = await AITrainerService.transcribe_voice(temp_path)
-        
-        if not transcribed_text:
-            await message.answer("❌ Не удалось распознать голос. Попробуйте еще раз.")
-            return
-        
-        # Сохраняем сообщение пользователя (голосовое)
-        await AITrainerService.add_message_to_session(
-            session,
-            session_id,
-            'user',
-            transcribed_text,
-            is_voice=True,
-            voice_file_id=voice.file_id
-        )
-        
-        # Показываем что распознали
-        await message.answer(f"📝 Распознано: _{transcribed_text}_", parse_mode='Markdown')
-        
-        # Показываем индикатор "печатает..."
-        await message.bot.send_chat_action(message.chat.id, 'typing')
-        
-        # Далее обрабатываем как текст
-        opponent = await AITrainerService.get_opponent_by_id(session, opponent_id)
-        relevant_knowledge = await AITrainerService.search_in_documents(session, transcribed_text, limit=3)
-        conversation_history = await AITrainerService.get_session_history(session, session_id)
-        
+    if not transcribed_text:
+        await message.answer("❌ Не удалось распознать голос. Попробуйте еще раз.")
+        return
+    
+    # Embedding для поиска фактов — до первого запроса к БД (соединение еще не взято)
+    await AITrainerService.prepare_query_embedding(transcribed_text)
+    
+    # Сохраняем сообщение пользователя (голосовое)
+    await AITrainerService.add_message_to_session(
+        session,
+        session_id,
+        'user',
+        transcribed_text,
+        is_voice=True,
+        voice_file_id=voice.file_id
+    )
+    
+    # Показываем что распознали
+    await message.answer(f"📝 Распознано: _{transcribed_text}_", parse_mode='Markdown')
+    
+    # Показываем индикатор "печатает..."
+    await message.bot.send_chat_action(message.chat.id, 'typing')
+    
+    # Далее обрабатываем как текст
+    opponent = await AITrainerService.get_opponent_by_id(session, opponent_id)
+    relevant_knowledge = await AITrainerService.retrieve_context(session, transcribed_text)
+    conversation_history = await AITrainerService.get_session_history(session, session_id)
+    
+    # Ответ выводим по мере генерации
+    stream = StreamingMessage(await message.answer("💬 ..."))
+    
+    # Соединение с БД не держим, пока LLM пишет ответ. Ранний commit фиксирует реплику
+    # пользователя: ее безопасно сохранить, даже если соперник не ответит (она уже в диалоге)
+    async with connection_released(session):
         ai_response = await AITrainerService.generate_ai_response(
             opponent['base_prompt'],
             conversation_history,
             transcribed_text,
-            relevant_knowledge
+            relevant_knowledge,
+            on_partial=stream.update
         )
-        
-        if not ai_response:
-            ai_response = "Хм, интересно... Расскажи подробнее?"
-        
-        # Сохраняем ответ AI
-        await AITrainerService.add_message_to_session(
-            session,
-            session_id,
-            'assistant',
-            ai_response
-        )
-        
-        # Отправляем ответ (только текстом, так как TTS не реализован)
-        await message.answer(
-            ai_response,
-            reply_markup=get_training_active_keyboard(session_id)
+    
+    if not ai_response:
+        # Не подставляем выдуманную реплику соперника — честно сообщаем об ошибке
+        await stream.finalize(
+            "⚠️ Соперник не смог ответить: сервис AI временно недоступен.\n"
+            "Отправь сообщение ещё раз чуть позже.",
+            reply_markup=get_training_active_keyboard(session_id),
+            parse_mode=None
         )
+        return
+    
+    # Сохраняем ответ AI
+    await AITrainerService.add_message_to_session(
+        session,
+        session_id,
+        'assistant',
+        ai_response
+    )
     
-    finally:
-        # Удаляем временный файл асинхронно
-        if os.path.exists(temp_path):
-            await asyncio.to_thread(os.unlink, temp_path)
+    # Финальный текст (только текстом, так как TTS не реализован)
+    await stream.finalize(
+        ai_response,
+        reply_markup=get_training_active_keyboard(session_id),
+        parse_mode=None
+    )
 
 @router.callback_query(F.data.startswith("trainer_end_"))
 async def trainer_end_session(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
@@ -548,37 +564,32 @@ async def trainer_end_session(callback: CallbackQuery, state: FSMContext, sessio
                 raise
         return
     
-    # Запускаем AI-анализ
-    analysis_result = await AITrainerService.analyze_training_session(
-        conversation_history,
-        opponent['name']
-    )
+    # Запускаем AI-анализ (без удержания соединения с БД; до этого было только чтение)
+    async with connection_released(session):
+        analysis_result = await AITrainerService.analyze_training_session(
+            conversation_history,
+            opponent['name']
+        )
     
     if not analysis_result:
-        # Фоллбэк: базовый анализ без AI
-        analysis_result = {
-            'overall_score': 7.0,
-            'scores': {
-                'product_knowledge': 7.0,
-                'objection_handling': 7.0,
-                'emotional_intelligence': 7.0,
-                'confidence': 7.0
-            },
-            'strengths': [
-                'Активное участие в диалоге',
-                'Попытка отработать возражения'
-            ],
-            'weaknesses': [
-                'Недостаточно конкретики',
-                'Можно больше фактов'
-            ],
-            'recommendations': [
-                'Изучите больше деталей о продукте',
-                'Практикуйте работу с конкретными возражениями',
-                'Работайте над уверенностью'
-            ],
-            'summary': 'Хорошая попытка! Продолжайте тренироваться для улучшения навыков.'
-        }
+        # Анализ недоступен: завершаем сессию без оценки, а не выдумываем баллы
+        await AITrainerService.end_training_session(session, session_id)
+        
+        try:
+            await callback.message.edit_text(
+                "⚠️ **Не удалось проанализировать тренировку**\n\n"
+                "Сервис анализа сейчас недоступен. Диалог сохранён, "
+                "но оценка за эту тренировку не выставлена.\n\n"
+                "Попробуй пройти тренировку ещё раз чуть позже.",
+                reply_markup=get_training_results_keyboard(opponent_id),
+                parse_mode='Markdown'
+            )
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+        
+        await state.clear()
+        return
     
     # Сохраняем результаты в БД
     await AITrainerService.end_training_session(
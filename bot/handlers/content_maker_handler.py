@@ -18,8 +18,10 @@ from bot.keyboards.keyboards import (
     get_content_maker_profile_view,
     get_back_to_content_maker
 )
+from bot.database.unit_of_work import connection_released, read_transaction, write_transaction
 from bot.services.content_profile_service import ContentProfileService
 from bot.services.user_service import UserService
+from bot.utils.streaming import StreamingMessage
 
 logger = logging.getLogger(__name__)
 
@@ -657,13 +659,27 @@ async def profile_fill_voice_receive(message: Message, state: FSMContext, sessio
         
         # Сохраняем голосовой фрагмент
         from uuid import UUID
-        await ContentProfileService.add_voice_chunk(
+        chunk = await ContentProfileService.add_voice_chunk(
             session,
             UUID(session_id),
             message.voice.file_id,
             message.voice.duration
         )
         
+        # Фиксируем фрагмент до постановки транскрибации: фоновая задача пишет в него своей сессией.
+        # Ранний commit (см. DatabaseMiddleware): фрагмент безопасно сохранить и при сбое дальше —
+        # голосовое уже получено, а без транскрипта его дотранскрибирует "Завершить"
+        await session.commit()
+        
+        # Транскрибируем сразу, не дожидаясь "Завершить"
+        from bot.services.whisper_service import get_whisper_service
+        get_whisper_service().schedule_chunk_transcription(
+            message.bot,
+            chunk.id,
+            message.voice.file_id,
+            message.voice.file_unique_id
+        )
+        
         # Показываем кнопки управления сессией
         from bot.keyboards.keyboards import get_content_maker_voice_session
         
@@ -761,35 +777,64 @@ async def voice_finish(callback: CallbackQuery, state: FSMContext, session: Asyn
         whisper_service = get_whisper_service()
         bot = callback.bot
         
-        file_ids = [chunk.file_id for chunk in chunks]
-        
-        try:
-            await processing_msg.edit_text(f"🎙 Транскрибирую {len(file_ids)} голосовых сообщений...")
-        except TelegramBadRequest as e:
-            if "message is not modified" in str(e):
-                # Если сообщение не изменилось, просто отправляем ответ на callback
-                pass
-            else:
-                # Если другая ошибка BadRequest, пробрасываем дальше
-                raise
-        
-        combined_transcript = await whisper_service.transcribe_multiple_voices(bot, file_ids)
+        # Порядок склейки транскриптов — порядок записи фрагментов
+        chunks = sorted(chunks, key=lambda c: c.sequence_number)
         
-        # Парсим профиль через LLM
-        try:
-            await processing_msg.edit_text("🤖 Анализирую твой профиль...")
-        except TelegramBadRequest as e:
-            if "message is not modified" in str(e):
-                # Если сообщение не изменилось, просто отправляем ответ на callback
-                pass
-            else:
-                # Если другая ошибка BadRequest, пробрасываем дальше
-                raise
-        
-        from bot.services.llm_service import get_llm_service
-        llm_service = get_llm_service()
-        
-        profile_data = await llm_service.parse_profile_from_text(combined_transcript)
+        # Транскрибация и разбор профиля — без удержания соединения с БД
+        # (до этого только чтение: ранний commit ничего не фиксирует)
+        async with connection_released(session):
+            # Большинство фрагментов уже транскрибировано в фоне при получении
+            transcripts = [chunk.transcript for chunk in chunks]
+            missing = [index for index, transcript in enumerate(transcripts) if not transcript]
+            
+            if missing:
+                try:
+                    await processing_msg.edit_text(f"🎙 Транскрибирую {len(missing)} голосовых сообщений...")
+                except TelegramBadRequest as e:
+                    if "message is not modified" in str(e):
+                        # Если сообщение не изменилось, просто отправляем ответ на callback
+                        pass
+                    else:
+                        # Если другая ошибка BadRequest, пробрасываем дальше
+                        raise
+            
+                async def report_progress(done: int, total: int) -> None:
+                    try:
+                        await processing_msg.edit_text(f"🎙 Транскрибирую голосовые сообщения... {done}/{total}")
+                    except TelegramBadRequest as e:
+                        if "message is not modified" not in str(e):
+                            raise
+            
+                # Остальные доделываем параллельно; фрагменты, еще идущие в фоне, не дублируются
+                missing_transcripts = await whisper_service.transcribe_voices(
+                    bot,
+                    [chunks[index].file_id for index in missing],
+                    on_progress=report_progress
+                )
+                for index, transcript in zip(missing, missing_transcripts):
+                    transcripts[index] = transcript
+            
+            combined_transcript = " ".join(transcripts)
+            logger.info(
+                f"Голосовая сессия транскрибирована: {len(chunks) - len(missing)}/{len(chunks)} "
+                f"фрагментов готовы заранее, {len(combined_transcript)} символов"
+            )
+            
+            # Парсим профиль через LLM
+            try:
+                await processing_msg.edit_text("🤖 Анализирую твой профиль...")
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    # Если сообщение не изменилось, просто отправляем ответ на callback
+                    pass
+                else:
+                    # Если другая ошибка BadRequest, пробрасываем дальше
+                    raise
+            
+            from bot.services.llm_service import get_llm_service
+            llm_service = get_llm_service()
+            
+            profile_data = await llm_service.parse_profile_from_text(combined_transcript)
         
         # Сохраняем профиль
         await ContentProfileService.create_or_update_profile(
@@ -944,12 +989,14 @@ async def select_platform_and_generate(callback: CallbackQuery, state: FSMContex
         from bot.services.llm_service import get_llm_service
         llm_service = get_llm_service()
         
-        ideas = await llm_service.generate_content_ideas(
-            profile_data,
-            content_type.name,
-            content_type.description or "",
-            platform
-        )
+        # Соединение с БД не держим, пока ждем LLM (до этого только чтение)
+        async with connection_released(session):
+            ideas = await llm_service.generate_content_ideas(
+                profile_data,
+                content_type.name,
+                content_type.description or "",
+                platform
+            )
         
         # Очищаем предыдущие сообщения
         data = await state.get_data()
@@ -1171,9 +1218,8 @@ async def generate_post_from_idea(callback: CallbackQuery, state: FSMContext, bo
         from aiogram.client.session.aiohttp import AiohttpSession
         session_maker = bot.session_pool if hasattr(bot, 'session_pool') else None
         
-        # Получаем сессию БД через middleware (упрощенная версия)
-        from bot.database.database import AsyncSessionLocal
-        async with AsyncSessionLocal() as session:
+        # Короткая транзакция чтения: соединение не держим, пока пишется пост
+        async with read_transaction() as session:
             user = await UserService.get_user_by_telegram_id(session, str(callback.from_user.id))
             
             if not user:
@@ -1221,21 +1267,25 @@ async def generate_post_from_idea(callback: CallbackQuery, state: FSMContext, bo
             # Получаем профиль
             profile_data = await ContentProfileService.get_profile_data(session, user.id)
             
-            # Генерируем пост
-            from bot.services.llm_service import get_llm_service
-            llm_service = get_llm_service()
-            
-            post_text = await llm_service.generate_post(
-                profile_data,
-                idea['title'],
-                idea['description'],
-                data.get('selected_content_type_name', 'Контент'),
-                data.get('selected_platform', 'telegram')
-            )
-            
-            # Сохраняем пост в БД
-            from bot.services.content_posts_service import ContentPostsService
-            
+        # Генерируем пост
+        from bot.services.llm_service import get_llm_service
+        llm_service = get_llm_service()
+        
+        # Выводим текст по мере генерации
+        stream = StreamingMessage(processing_msg)
+        post_text = await llm_service.generate_post(
+            profile_data,
+            idea['title'],
+            idea['description'],
+            data.get('selected_content_type_name', 'Контент'),
+            data.get('selected_platform', 'telegram'),
+            on_partial=stream.update
+        )
+        
+        # Сохраняем пост в БД (короткая транзакция записи)
+        from bot.services.content_posts_service import ContentPostsService
+        
+        async with write_transaction() as session:
             post = await ContentPostsService.create_post(
                 session,
                 user.id,
@@ -1244,43 +1294,27 @@ async def generate_post_from_idea(callback: CallbackQuery, state: FSMContext, bo
                 version=1,
                 status='draft'
             )
-            
-            await session.commit()
-            
-            # Очищаем предыдущие сообщения
-            old_messages = data.get('cm_messages_to_delete', [])
-            if old_messages:
-                await cleanup_messages(bot, callback.message.chat.id, old_messages)
-            
-            # Показываем пост
-            from bot.keyboards.keyboards import get_post_actions_keyboard
-            
-            try:
-                await processing_msg.edit_text(
-                    f"{post_text}\n\n---\n_Вариант 1 (основной)_",
-                    reply_markup=get_post_actions_keyboard(str(post.id)),
-                    parse_mode="Markdown"
-                )
-            except TelegramBadRequest as e:
-                if "message is not modified" in str(e):
-                    # Если сообщение не изменилось, просто отправляем ответ на callback
-                    pass
-                else:
-                    # Если другая ошибка BadRequest, пробрасываем дальше
-                    raise
-                if "message is not modified" in str(e):
-                    # Если сообщение не изменилось, просто отправляем ответ на callback
-                    await callback.answer("Пост готов", show_alert=False)
-                else:
-                    # Если другая ошибка BadRequest, пробрасываем дальше
-                    raise
-            
-            await state.update_data(
-                current_post_id=str(post.id),
-                cm_messages_to_delete=[]
-            )
-            await state.set_state(ContentMakerStates.post_viewing)
         
+        # Очищаем предыдущие сообщения
+        old_messages = data.get('cm_messages_to_delete', [])
+        if old_messages:
+            await cleanup_messages(bot, callback.message.chat.id, old_messages)
+        
+        # Показываем пост
+        from bot.keyboards.keyboards import get_post_actions_keyboard
+        
+        await stream.finalize(
+            f"{post_text}\n\n---\n_Вариант 1 (основной)_",
+            reply_markup=get_post_actions_keyboard(str(post.id)),
+            parse_mode="Markdown"
+        )
+        
+        await state.update_data(
+            current_post_id=str(post.id),
+            cm_messages_to_delete=[]
+        )
+        await state.set_state(ContentMakerStates.post_viewing)
+    
     except Exception as e:
         logger.error(f"Ошибка при генерации поста: {e}", exc_info=True)
         await callback.message.answer("❌ Ошибка при генерации поста")
@@ -1349,7 +1383,11 @@ async def edit_post_voice(message: Message, state: FSMContext, session: AsyncSes
         
         processing_msg = await message.answer("⏳ Обрабатываю голосовое...")
         
-        transcript = await whisper_service.transcribe_voice(message.bot, message.voice.file_id)
+        transcript = await whisper_service.transcribe_voice(
+            message.bot,
+            message.voice.file_id,
+            file_unique_id=message.voice.file_unique_id
+        )
         
         if not transcript or len(transcript) < 10:
             try:
@@ -1439,11 +1477,16 @@ async def edit_post_with_llm(message: Message, state: FSMContext, session: Async
         from bot.services.llm_service import get_llm_service
         llm_service = get_llm_service()
         
-        edited_text = await llm_service.edit_post(
-            original_post=post.body,
-            edit_instruction=instruction,
-            profile_data=profile_data
-        )
+        # Выводим текст по мере генерации (соединение с БД не держим, пока LLM пишет;
+        # до этого только чтение, пост сохраняется одной транзакцией после генерации)
+        stream = StreamingMessage(processing_msg)
+        async with connection_released(session):
+            edited_text = await llm_service.edit_post(
+                original_post=post.body,
+                edit_instruction=instruction,
+                profile_data=profile_data,
+                on_partial=stream.update
+            )
         
         # Обновляем текст поста
         updated_post = await ContentPostsService.update_post_body(
@@ -1475,25 +1518,11 @@ async def edit_post_with_llm(message: Message, state: FSMContext, session: Async
         # Показываем обновленный пост
         from bot.keyboards.keyboards import get_post_actions_keyboard
         
-        try:
-            await processing_msg.edit_text(
-                f"{edited_text}\n\n---\n_Обновлённая версия_",
-                reply_markup=get_post_actions_keyboard(str(updated_post.id)),
-                parse_mode="Markdown"
-            )
-        except TelegramBadRequest as e:
-            if "message is not modified" in str(e):
-                # Если сообщение не изменилось, просто отправляем ответ на callback
-                pass
-            else:
-                # Если другая ошибка BadRequest, пробрасываем дальше
-                raise
-            if "message is not modified" in str(e):
-                # Если сообщение не изменилось, просто отправляем ответ на callback
-                await callback.answer("Пост обновлён", show_alert=False)
-            else:
-                # Если другая ошибка BadRequest, пробрасываем дальше
-                raise
+        await stream.finalize(
+            f"{edited_text}\n\n---\n_Обновлённая версия_",
+            reply_markup=get_post_actions_keyboard(str(updated_post.id)),
+            parse_mode="Markdown"
+        )
         
         await state.set_state(ContentMakerStates.post_viewing)
         
@@ -1798,13 +1827,21 @@ async def write_post_from_planner_idea(callback: CallbackQuery, state: FSMContex
         from bot.services.llm_service import get_llm_service
         llm_service = get_llm_service()
         
-        post_text = await llm_service.generate_post(
-            profile_data,
-            idea.title,
-            idea.description or "",
-            idea.content_type.name if idea.content_type else "Контент",
-            idea.platform or 'telegram'
-        )
+        # Связь content_type читаем до того, как отпустим соединение
+        content_type_name = idea.content_type.name if idea.content_type else "Контент"
+        
+        # Выводим текст по мере генерации (соединение с БД не держим, пока LLM пишет;
+        # до этого только чтение, пост сохраняется одной транзакцией после генерации)
+        stream = StreamingMessage(processing_msg)
+        async with connection_released(session):
+            post_text = await llm_service.generate_post(
+                profile_data,
+                idea.title,
+                idea.description or "",
+                content_type_name,
+                idea.platform or 'telegram',
+                on_partial=stream.update
+            )
         
         # Сохраняем пост
         from bot.services.content_posts_service import ContentPostsService
@@ -1826,25 +1863,11 @@ async def write_post_from_planner_idea(callback: CallbackQuery, state: FSMContex
         # Показываем пост
         from bot.keyboards.keyboards import get_post_actions_keyboard
         
-        try:
-            await processing_msg.edit_text(
-                f"{post_text}\n\n---\n_Вариант 1 (основной)_",
-                reply_markup=get_post_actions_keyboard(str(post.id)),
-                parse_mode="Markdown"
-            )
-        except TelegramBadRequest as e:
-            if "message is not modified" in str(e):
-                # Если сообщение не изменилось, просто отправляем ответ на callback
-                pass
-            else:
-                # Если другая ошибка BadRequest, пробрасываем дальше
-                raise
-            if "message is not modified" in str(e):
-                # Если сообщение не изменилось, просто отправляем ответ на callback
-                await callback.answer("Пост готов", show_alert=False)
-            else:
-                # Если другая ошибка BadRequest, пробрасываем дальше
-                raise
+        await stream.finalize(
+            f"{post_text}\n\n---\n_Вариант 1 (основной)_",
+            reply_markup=get_post_actions_keyboard(str(post.id)),
+            parse_mode="Markdown"
+        )
         
         await state.update_data(current_post_id=str(post.id))
         await state.set_state(ContentMakerStates.post_viewing)
@@ -1901,13 +1924,18 @@ async def process_custom_idea_for_post(message: Message, state: FSMContext, sess
         from bot.services.llm_service import get_llm_service
         llm_service = get_llm_service()
         
-        post_text = await llm_service.generate_post(
-            profile_data,
-            "Своя идея",
-            custom_idea,
-            "Контент",
-            'telegram'
-        )
+        # Выводим текст по мере генерации (соединение с БД не держим, пока LLM пишет;
+        # до этого только чтение, пост сохраняется одной транзакцией после генерации)
+        stream = StreamingMessage(processing_msg)
+        async with connection_released(session):
+            post_text = await llm_service.generate_post(
+                profile_data,
+                "Своя идея",
+                custom_idea,
+                "Контент",
+                'telegram',
+                on_partial=stream.update
+            )
         
         # Сохраняем пост
         from bot.services.content_posts_service import ContentPostsService
@@ -1926,25 +1954,11 @@ async def process_custom_idea_for_post(message: Message, state: FSMContext, sess
         # Показываем пост
         from bot.keyboards.keyboards import get_post_actions_keyboard
         
-        try:
-            await processing_msg.edit_text(
-                f"{post_text}\n\n---\n_Вариант 1 (основной)_",
-                reply_markup=get_post_actions_keyboard(str(post.id)),
-                parse_mode="Markdown"
-            )
-        except TelegramBadRequest as e:
-            if "message is not modified" in str(e):
-                # Если сообщение не изменилось, просто отправляем ответ на callback
-                pass
-            else:
-                # Если другая ошибка BadRequest, пробрасываем дальше
-                raise
-            if "message is not modified" in str(e):
-                # Если сообщение не изменилось, просто отправляем ответ на callback
-                await callback.answer("Пост готов", show_alert=False)
-            else:
-                # Если другая ошибка BadRequest, пробрасываем дальше
-                raise
+        await stream.finalize(
+            f"{post_text}\n\n---\n_Вариант 1 (основной)_",
+            reply_markup=get_post_actions_keyboard(str(post.id)),
+            parse_mode="Markdown"
+        )
         
         await state.update_data(current_post_id=str(post.id))
         await state.set_state(ContentMakerStates.post_viewing)
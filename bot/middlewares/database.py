@@ -1,7 +1,7 @@
 from typing import Callable, Dict, Any, Awaitable
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
-from bot.database.database import AsyncSessionLocal
+from bot.database.database import LazySession
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,42 +13,73 @@ class DatabaseMiddleware(BaseMiddleware):
     
     Правила:
     - Одна сессия на один запрос/хендлер
-    - Автоматический commit при успехе
+    - Сессия ленивая: соединение из пула берется только при первом запросе к БД
+    - Автоматический commit при успехе (пропускается, если БД не использовалась)
     - Автоматический rollback при ошибке
     - Сервисы НЕ должны делать commit/rollback сами
+    
+    Ранний commit в хендлере (connection_released перед долгим AI-вызовом, фиксация
+    записи перед постановкой фоновой задачи) — осознанное исключение: апдейт перестает
+    быть атомарным, и записанное до такого commit остается, даже если хендлер упадет
+    позже. До раннего commit пишем только то, что безопасно сохранить при сбое,
+    и в месте вызова поясняем, что именно фиксируется.
     """
     
+    # Счетчики для мониторинга (общие для процесса)
+    _total_updates = 0
+    _updates_with_connection = 0
+    _commits = 0
+    
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        """Сколько апдейтов реально потребовали соединение БД"""
+        return {
+            'total_updates': cls._total_updates,
+            'updates_with_connection': cls._updates_with_connection,
+            'commits': cls._commits,
+            'connection_ratio': round(cls._updates_with_connection / cls._total_updates, 3)
+            if cls._total_updates else 0.0
+        }
+    
     async def __call__(
         self,
         handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
         event: TelegramObject,
         data: Dict[str, Any]
     ) -> Any:
-        async with AsyncSessionLocal() as session:
-            data['session'] = session
+        session = LazySession()
+        data['session'] = session
+        DatabaseMiddleware._total_updates += 1
+        
+        try:
+            # Выполняем хендлер
+            result = await handler(event, data)
             
-            try:
-                # Выполняем хендлер
-                result = await handler(event, data)
-                
-                # Коммитим транзакцию при успехе
+            # Коммитим транзакцию при успехе (только если было что коммитить)
+            if session.has_pending_work:
                 await session.commit()
-                
-                return result
-                
-            except Exception as e:
-                # Откатываем транзакцию при ошибке
-                await session.rollback()
-                
-                # Логируем ошибку с контекстом
-                logger.error(
-                    "Database transaction failed",
-                    exc_info=True,
-                    extra={
-                        "event_type": type(event).__name__,
-                        "error": str(e)
-                    }
-                )
-                
-                # Пробрасываем исключение дальше
-                raise
\ No newline at end of file
+                DatabaseMiddleware._commits += 1
+            
+            return result
+            
+        except Exception as e:
+            # Откатываем транзакцию при ошибке
+            await session.rollback()
+            
+            # Логируем ошибку с контекстом
+            logger.error(
+                "Database transaction failed",
+                exc_info=True,
+                extra={
+                    "event_type": type(event).__name__,
+                    "error": str(e)
+                }
+            )
+            
+            # Пробрасываем исключение дальше
+            raise
+        
+        finally:
+            if session.connection_used:
+                DatabaseMiddleware._updates_with_connection += 1
+            await session.close()
@@ -0,0 +1,207 @@
+"""
+Per-user Lane Middleware.
+
+Выполняет апдейты одного пользователя строго по очереди, схлопывает
+повторные нажатия одной и той же кнопки и (опционально) отменяет
+устаревшую долгую работу, когда от пользователя пришел апдейт,
+заменяющий ее (та же работа заново).
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from bot.utils.rate_limiter import current_user_id
+
+logger = logging.getLogger(__name__)
+
+# Префиксы callback_data долгих генераций, которые можно перезапустить без потери данных:
+# до конца генерации они ничего не пишут, а запись идет одной транзакцией.
+# Хендлеры, сохраняющие данные пользователя (cm_voice_finish, trainer_end_), сюда не входят
+DEFAULT_CANCELLABLE_PREFIXES = (
+    'cm_platform_',
+    'cm_write_',
+    'cm_select_idea_',
+)
+
+# FSM-состояния, в которых новое голосовое заменяет предыдущее.
+# Пусто: все голосовые хендлеры сейчас сохраняют данные (фрагменты профиля, ответы, сообщения)
+DEFAULT_CANCELLABLE_VOICE_STATES: Tuple[str, ...] = ()
+
+
+@dataclass
+class _Lane:
+    """Очередь выполнения одного пользователя"""
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    pending: int = 0
+    callbacks: Set[Tuple[str, int]] = field(default_factory=set)
+    running_task: Optional[asyncio.Task] = None
+    running_kind: Optional[str] = None
+    superseded: bool = False
+
+
+def cancellable_kind(update: Update, raw_state: Optional[str] = None) -> Optional[str]:
+    """
+    Вид отменяемой работы апдейта (None — апдейт не отменяется).
+
+    Выполняющийся апдейт отменяется только новым апдейтом того же вида:
+    повторный запуск той же генерации (тот же префикс callback) или
+    голосовое в том же FSM-состоянии (только из DEFAULT_CANCELLABLE_VOICE_STATES).
+    """
+    if update.message and update.message.voice:
+        if raw_state and raw_state in DEFAULT_CANCELLABLE_VOICE_STATES:
+            return f"voice:{raw_state}"
+        return None
+
+    if update.callback_query and update.callback_query.data:
+        for prefix in DEFAULT_CANCELLABLE_PREFIXES:
+            if update.callback_query.data.startswith(prefix):
+                return f"callback:{prefix}"
+
+    return None
+
+
+class UserLaneMiddleware(BaseMiddleware):
+    """
+    Middleware для последовательной обработки апдейтов одного пользователя.
+
+    Правила:
+    - Апдейты одного from_user.id выполняются по одному (FIFO)
+    - Повторное нажатие той же кнопки, пока первое еще в очереди/в работе, отбрасывается
+    - Если cancel_superseded=True, новый апдейт отменяет выполняющийся апдейт
+      того же вида (см. cancellable_kind); другие апдейты просто ждут очереди
+    - Должен стоять до DatabaseMiddleware: ожидание в очереди не держит соединение БД
+    - Выставляет current_user_id для честной очереди к AI-провайдерам (RateGovernor)
+    """
+
+    def __init__(
+        self,
+        collapse_duplicate_callbacks: bool = True,
+        cancel_superseded: bool = False,
+        cancellable: Callable[[Update, Optional[str]], Optional[str]] = cancellable_kind
+    ):
+        self._collapse = collapse_duplicate_callbacks
+        self._cancel_superseded = cancel_superseded
+        self._cancellable = cancellable
+        self._lanes: Dict[int, _Lane] = {}
+
+        # Счетчики для мониторинга
+        self._collapsed = 0
+        self._cancelled = 0
+
+    def _callback_key(self, event: TelegramObject) -> Optional[Tuple[str, int]]:
+        """Ключ для схлопывания дублей: (callback_data, message_id)"""
+        if not isinstance(event, Update) or not event.callback_query:
+            return None
+
+        callback = event.callback_query
+        message_id = callback.message.message_id if callback.message else 0
+        return (callback.data or '', message_id)
+
+    async def _answer_duplicate(self, event: Update) -> None:
+        """Ответить на повторное нажатие, чтобы у кнопки пропали "часики" """
+        try:
+            await event.callback_query.answer("⏳ Уже выполняется...")
+        except Exception:
+            logger.debug("Не удалось ответить на повторный callback", exc_info=True)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+
+        lane = self._lanes.get(user.id)
+        if lane is None:
+            lane = self._lanes[user.id] = _Lane()
+
+        callback_key = self._callback_key(event) if self._collapse else None
+        if callback_key is not None and callback_key in lane.callbacks:
+            self._collapsed += 1
+            logger.info(
+                "Duplicate callback collapsed",
+                extra={"user_id": user.id, "callback_data": callback_key[0][:30]}
+            )
+            await self._answer_duplicate(event)
+            return None
+
+        kind = None
+        if self._cancel_superseded and isinstance(event, Update):
+            kind = self._cancellable(event, data.get('raw_state'))
+
+        # Новый апдейт вытесняет выполняющуюся работу того же вида
+        if (
+            kind is not None
+            and lane.running_task is not None
+            and lane.running_kind == kind
+            and not lane.running_task.done()
+        ):
+            lane.superseded = True
+            lane.running_task.cancel()
+
+        if callback_key is not None:
+            lane.callbacks.add(callback_key)
+        lane.pending += 1
+
+        user_token = current_user_id.set(user.id)
+        try:
+            async with lane.lock:
+                return await self._run(handler, event, data, lane, user.id, kind)
+        finally:
+            current_user_id.reset(user_token)
+            lane.pending -= 1
+            if callback_key is not None:
+                lane.callbacks.discard(callback_key)
+            if lane.pending == 0:
+                self._lanes.pop(user.id, None)
+
+    async def _run(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+        lane: _Lane,
+        user_id: int,
+        kind: Optional[str]
+    ) -> Any:
+        if kind is None:
+            return await handler(event, data)
+
+        # Отдельная задача: отменяем только этот апдейт, а не воркер/поллинг
+        task = asyncio.ensure_future(handler(event, data))
+        lane.running_task = task
+        lane.running_kind = kind
+        lane.superseded = False
+
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not task.done():
+                # Отменили нас снаружи (shutdown) — отменяем и обработку
+                task.cancel()
+                raise
+            if not lane.superseded:
+                raise
+
+            self._cancelled += 1
+            logger.info("Superseded update cancelled", extra={"user_id": user_id})
+            return None
+        finally:
+            lane.running_task = None
+            lane.running_kind = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика очередей пользователей"""
+        return {
+            'active_lanes': len(self._lanes),
+            'collapsed_callbacks': self._collapsed,
+            'cancelled_updates': self._cancelled
+        }
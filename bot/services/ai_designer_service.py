@@ -7,10 +7,13 @@ import uuid
 from typing import Tuple, Optional, List
 import logging
 
-from bot.utils.http_client import HTTPClientManager
+from bot.utils.fal_queue import FalAPIError, FalProgressCallback, FalQueue
+from bot.utils.openai_gateway import OpenAIGateway
 
 logger = logging.getLogger(__name__)
 
+# Короткие правки ("убери фон") повторяются постоянно — кэшируем улучшенные промпты на неделю
+ENHANCE_PROMPT_CACHE_TTL = 7 * 24 * 3600
 
 SYSTEM_PROMPT = """ROLE:
 You are a world-class Art Director and prompt engineer for FLUX.1 image generation. Your mission is to create prompts that produce INDISTINGUISHABLE from real photography results — images so realistic that viewers on Instagram cannot tell they are AI-generated.
@@ -113,7 +116,7 @@ class AIDesignerService:
     Сервис для работы с AI-Designer.
     
     Правила:
-    - Использует shared HTTP clients (HTTPClientManager)
+    - Использует shared HTTP clients (OpenAIGateway для OpenAI, FalQueue для Fal.ai)
     - НЕ делает session.commit() - это делает middleware
     - Все HTTP запросы с таймаутами
     - Логирует ошибки с контекстом
@@ -123,40 +126,21 @@ class AIDesignerService:
     async def generate_prompt_with_openai(user_input: str, case_type: str = "A") -> str:
         """
         Генерация промпта через OpenAI для Агента 1 и Агента 3.
-        Использует shared ClientSession для производительности.
+        Использует shared ClientSession (OpenAIGateway) для производительности.
         """
         full_input = user_input
         
         try:
-            # Получаем shared session
-            session = await HTTPClientManager.get_openai_session()
-            
-            async with session.post(
-                "https://api.openai.com/v1/chat/completions",
-                json={
-                    "model": "gpt-4o-mini",
-                    "messages": [
-                        {"role": "system", "content": SYSTEM_PROMPT},
-                        {"role": "user", "content": full_input}
-                    ],
-                    "temperature": 0.7,
-                    "max_tokens": 500
-                }
-            ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    logger.error(
-                        "OpenAI API error",
-                        extra={
-                            "status": response.status,
-                            "error": error_text,
-                            "case_type": case_type
-                        }
-                    )
-                    raise Exception(f"OpenAI API error: {error_text}")
-
-                data = await response.json()
-                return data["choices"][0]["message"]["content"].strip()
+            content = await OpenAIGateway.chat_completion(
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": full_input}
+                ],
+                model="gpt-4o-mini",
+                temperature=0.7,
+                max_tokens=500
+            )
+            return content.strip()
         
         except Exception as e:
             logger.error(
@@ -170,7 +154,7 @@ class AIDesignerService:
     async def enhance_edit_prompt_with_llm(user_edit: str) -> str:
         """
         Улучшение промпта редактирования через LLM (Агент 2).
-        Использует shared ClientSession.
+        Использует shared ClientSession, ответы кэшируются по хэшу запроса.
         """
         edit_system_prompt = """You are an expert at creating clear, professional edit instructions for image editing AI.
 
@@ -196,30 +180,17 @@ User: "add sunglasses" → "Add sunglasses to the person"
 Now convert this edit request:"""
 
         try:
-            session = await HTTPClientManager.get_openai_session()
-            
-            async with session.post(
-                "https://api.openai.com/v1/chat/completions",
-                json={
-                    "model": "gpt-4o-mini",
-                    "messages": [
-                        {"role": "system", "content": edit_system_prompt},
-                        {"role": "user", "content": user_edit}
-                    ],
-                    "temperature": 0.3,
-                    "max_tokens": 100
-                }
-            ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    logger.error(
-                        "OpenAI edit prompt error",
-                        extra={"status": response.status, "error": error_text}
-                    )
-                    raise Exception(f"OpenAI API error: {error_text}")
-
-                data = await response.json()
-                return data["choices"][0]["message"]["content"].strip()
+            content = await OpenAIGateway.chat_completion(
+                messages=[
+                    {"role": "system", "content": edit_system_prompt},
+                    {"role": "user", "content": user_edit.strip()}
+                ],
+                model="gpt-4o-mini",
+                temperature=0.3,
+                max_tokens=100,
+                cache_ttl=ENHANCE_PROMPT_CACHE_TTL
+            )
+            return content.strip()
         
         except Exception as e:
             logger.error("Failed to enhance edit prompt", exc_info=True)
@@ -229,7 +200,7 @@ Now convert this edit request:"""
     async def enhance_replay_prompt_with_llm(user_request: str) -> str:
         """
         АГЕНТ 4: Оптимизация промпта для replay - добавление пользователя на сгенерированное изображение.
-        Использует shared ClientSession.
+        Использует shared ClientSession, ответы кэшируются по хэшу запроса.
         """
         replay_system_prompt = """You are an expert at creating professional prompts for seamlessly integrating a person into an existing scene.
 
@@ -260,30 +231,17 @@ User: "Я хочу быть на пляже" → "Integrate the person into the
 Now create integration instructions for:"""
 
         try:
-            session = await HTTPClientManager.get_openai_session()
-            
-            async with session.post(
-                "https://api.openai.com/v1/chat/completions",
-                json={
-                    "model": "gpt-4o-mini",
-                    "messages": [
-                        {"role": "system", "content": replay_system_prompt},
-                        {"role": "user", "content": user_request}
-                    ],
-                    "temperature": 0.4,
-                    "max_tokens": 150
-                }
-            ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    logger.error(
-                        "OpenAI replay prompt error",
-                        extra={"status": response.status, "error": error_text}
-                    )
-                    raise Exception(f"OpenAI API error: {error_text}")
-
-                data = await response.json()
-                return data["choices"][0]["message"]["content"].strip()
+            content = await OpenAIGateway.chat_completion(
+                messages=[
+                    {"role": "system", "content": replay_system_prompt},
+                    {"role": "user", "content": user_request.strip()}
+                ],
+                model="gpt-4o-mini",
+                temperature=0.4,
+                max_tokens=150,
+                cache_ttl=ENHANCE_PROMPT_CACHE_TTL
+            )
+            return content.strip()
         
         except Exception as e:
             logger.error("Failed to enhance replay prompt", exc_info=True)
@@ -293,14 +251,18 @@ Now create integration instructions for:"""
     async def generate_image_with_flux_edit(
         prompt: str,
         image_url: str = None,
-        image_urls: list = None
+        image_urls: list = None,
+        on_progress: Optional[FalProgressCallback] = None
     ) -> str:
         """
-        Генерация/редактирование изображения через fal-ai API.
-        Использует shared ClientSession.
+        Генерация/редактирование изображения через очередь fal-ai.
+        HTTP-запрос не держится всю генерацию: submit → статус → результат.
+        
+        Args:
+            on_progress: Колбэк изменений статуса очереди (статус, позиция)
         """
         if image_urls:
-            endpoint = "https://fal.run/fal-ai/flux-2-pro/edit"
+            model_path = "fal-ai/flux-2-pro/edit"
             payload = {
                 "prompt": prompt,
                 "image_urls": image_urls,
@@ -310,7 +272,7 @@ Now create integration instructions for:"""
                 "safety_tolerance": "2"
             }
         elif image_url:
-            endpoint = "https://fal.run/fal-ai/flux-2-pro/edit"
+            model_path = "fal-ai/flux-2-pro/edit"
             payload = {
                 "prompt": prompt,
                 "image_urls": [image_url],
@@ -320,7 +282,7 @@ Now create integration instructions for:"""
                 "safety_tolerance": "2"
             }
         else:
-            endpoint = "https://fal.run/fal-ai/flux-2-pro"
+            model_path = "fal-ai/flux-2-pro"
             payload = {
                 "prompt": prompt,
                 "num_inference_steps": 40,
@@ -330,54 +292,46 @@ Now create integration instructions for:"""
             }
 
         try:
-            session = await HTTPClientManager.get_fal_session()
-            
-            async with session.post(endpoint, json=payload) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    
-                    # Проверяем на content_policy_violation
-                    if "content_policy_violation" in error_text.lower():
-                        logger.warning(
-                            "Content policy violation detected",
-                            extra={
-                                "prompt": payload.get("prompt", "")[:100],
-                                "endpoint": endpoint
-                            }
-                        )
-                        raise ValueError(
-                            "⚠️ Запрос заблокирован системой безопасности Fal.ai\n\n"
-                            "Попробуй переформулировать запрос без упоминания:\n"
-                            "• Оружия\n"
-                            "• Насилия\n"
-                            "• Запрещенного контента\n\n"
-                            "Например: вместо 'добавь топор' → 'турист с инструментом для похода'"
-                        )
-                    
-                    logger.error(
-                        "Fal.ai API error",
-                        extra={
-                            "status": response.status,
-                            "error": error_text,
-                            "endpoint": endpoint
-                        }
-                    )
-                    raise Exception(f"Fal.ai API error: {error_text}")
-
-                data = await response.json()
-                if "images" in data and len(data["images"]) > 0:
-                    return data["images"][0]["url"]
-
-                raise Exception("Fal.ai не вернул изображение")
+            # Слот Rate Governor "fal" FalQueue занимает сам, только на submit и результат
+            data = await FalQueue.run(model_path, payload, on_progress)
         
         except Exception as e:
+            # Проверяем на content_policy_violation (это ответ пользователю, а не сбой)
+            if isinstance(e, FalAPIError) and "content_policy_violation" in e.body.lower():
+                logger.warning(
+                    "Content policy violation detected",
+                    extra={
+                        "prompt": payload.get("prompt", "")[:100],
+                        "endpoint": model_path
+                    }
+                )
+                raise ValueError(
+                    "⚠️ Запрос заблокирован системой безопасности Fal.ai\n\n"
+                    "Попробуй переформулировать запрос без упоминания:\n"
+                    "• Оружия\n"
+                    "• Насилия\n"
+                    "• Запрещенного контента\n\n"
+                    "Например: вместо 'добавь топор' → 'турист с инструментом для похода'"
+                ) from None
+            
+            # Единственная запись об ошибке (для FalAPIError — со статусом и телом ответа)
             logger.error(
                 "Failed to generate image with Fal.ai",
                 exc_info=True,
-                extra={"has_image_url": image_url is not None}
+                extra={
+                    "status": getattr(e, "status", None),
+                    "error": getattr(e, "body", str(e)),
+                    "endpoint": model_path,
+                    "has_image_url": image_url is not None
+                }
             )
             raise
 
+        if "images" in data and len(data["images"]) > 0:
+            return data["images"][0]["url"]
+
+        raise Exception("Fal.ai не вернул изображение")
+
     @staticmethod
     async def save_generation(
         session: AsyncSession,
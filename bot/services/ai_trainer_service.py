@@ -1,16 +1,71 @@
-import os
-import aiohttp
-from typing import Optional, Dict, List, Any
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 from datetime import datetime
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, func, update
+from sqlalchemy import select, and_, func, update, text
+from aiogram import Bot
+import asyncio
 import logging
 import json
+import os
 
+from bot.services.embedding_service import get_embedding_service
+from bot.utils.audio import telegram_audio
 from bot.utils.cache import opponent_cache
+from bot.utils.keyword_matcher import KeywordMatcher
+from bot.utils.knowledge_index import get_knowledge_index
+from bot.utils.openai_gateway import OpenAIGateway
+from bot.utils.retrieval import fit_to_token_budget, reciprocal_rank_fusion
+from bot.utils.transcript_cache import get_transcript_cache
+from bot.utils.vector_index import get_document_index
 
 logger = logging.getLogger(__name__)
 
+# Сколько секунд после истечения TTL можно отдавать старый профиль соперника
+OPPONENT_STALE_TTL = 600
+
+# Бюджет токенов на факты из базы знаний в промпте соперника
+KNOWLEDGE_CONTEXT_TOKENS = int(os.getenv('KNOWLEDGE_CONTEXT_TOKENS', '800'))
+
+# Ключевые слова тем сообщения (analyze_intent)
+INTENT_KEYWORDS = {
+    'prices': ['сколько', 'цена', 'стоимость', 'дешевле', 'booking', 'дорого', 'платить'],
+    'legality': ['легально', 'документ', 'лицензия', 'пирамида', 'iata', 'законно', 'мошенник'],
+    'how_it_works': ['как работает', 'принцип', 'откуда', 'почему', 'как это'],
+    'earnings': ['заработок', 'доход', 'сколько зарабат', 'компенсация', 'млм', 'сетевой'],
+    'trust': ['доверять', 'обман', 'развод', 'лохотрон', 'отзыв', 'правда']
+}
+
+# Мапинг тем на категории knowledge_base
+TOPIC_CATEGORIES = {
+    'prices': 'цены',
+    'legality': 'легальность',
+    'how_it_works': 'как_работает',
+    'earnings': 'компенсация',
+    'trust': 'доверие'
+}
+
+# Автомат строится один раз: все ключевые слова ищутся за один проход по сообщению
+_intent_matcher = KeywordMatcher(
+    (word, topic) for topic, words in INTENT_KEYWORDS.items() for word in words
+)
+
+# Размер списка кандидатов HNSW при поиске по documents: больше — точнее, но медленнее
+DOCUMENTS_EF_SEARCH = int(os.getenv('DOCUMENTS_EF_SEARCH', '40'))
+
+# Сортировка по расстоянию с LIMIT — именно такой запрос обслуживает индекс documents_embedding_hnsw_idx
+# (EXPLAIN для проверки плана — в миграции 007_documents_embedding_idx)
+DOCUMENTS_SEARCH_SQL = text("""
+    SELECT content, metadata, 1 - distance AS similarity
+    FROM (
+        SELECT content, metadata, embedding <=> :embedding AS distance
+        FROM documents
+        WHERE embedding IS NOT NULL
+        ORDER BY distance
+        LIMIT :limit
+    ) AS nearest
+    ORDER BY distance
+""")
+
 class AITrainerService:
     """
     Сервис для работы с AI-тренажером возражений.
@@ -21,48 +76,56 @@ class AITrainerService:
     - Кэширует opponent profiles для производительности
     """
     
+    @staticmethod
+    def _opponent_to_dict(row) -> Dict:
+        """Преобразовать ORM-объект соперника в словарь для кэша"""
+        return {
+            'id': row.id,
+            'name': row.name,
+            'difficulty': row.difficulty,
+            'age': row.age,
+            'profession': row.profession,
+            'personality_type': row.personality_type,
+            'communication_style': row.communication_style,
+            'core_objections': row.core_objections,
+            'triggers': row.triggers,
+            'response_patterns': row.response_patterns,
+            'base_prompt': row.base_prompt,
+            'voice_style': row.voice_style,
+            'stats': row.stats
+        }
+
     @staticmethod
     async def get_opponent_by_id(session: AsyncSession, opponent_id: str) -> Optional[Dict]:
         """
         Получить соперника по ID с кэшированием.
         
         Кэш TTL: 1 час (профили соперников редко меняются).
-        """
-        # Пытаемся получить из кэша
-        cache_key = f"opponent:{opponent_id}"
-        cached = opponent_cache.get(cache_key)
-        if cached:
-            return cached
+        Параллельные промахи схлопываются в один запрос, после истечения TTL
+        еще OPPONENT_STALE_TTL секунд отдается старый профиль, пока он обновляется в фоне.
         
+        Args:
+            session: Не используется намеренно: loader открывает свою короткую сессию,
+                потому что при stale-while-revalidate он выполняется в фоне и может
+                пережить запрос (и его сессию). Параметр оставлен, чтобы вызовы
+                совпадали с остальными методами сервиса
+            opponent_id: ID соперника
+        """
+        from bot.database.database import AsyncSessionLocal
+        from bot.database.models import Opponent
+
+        async def load() -> Optional[Dict]:
+            async with AsyncSessionLocal() as load_session:
+                result = await load_session.execute(
+                    select(Opponent).where(Opponent.id == opponent_id)
+                )
+                row = result.scalar_one_or_none()
+            return AITrainerService._opponent_to_dict(row) if row else None
+
         try:
-            from bot.database.models import Opponent
-            
-            result = await session.execute(
-                select(Opponent).where(Opponent.id == opponent_id)
+            return await opponent_cache.get_or_load(
+                f"opponent:{opponent_id}", load, stale_ttl=OPPONENT_STALE_TTL
             )
-            row = result.scalar_one_or_none()
-            if row:
-                opponent_data = {
-                    'id': row.id,
-                    'name': row.name,
-                    'difficulty': row.difficulty,
-                    'age': row.age,
-                    'profession': row.profession,
-                    'personality_type': row.personality_type,
-                    'communication_style': row.communication_style,
-                    'core_objections': row.core_objections,
-                    'triggers': row.triggers,
-                    'response_patterns': row.response_patterns,
-                    'base_prompt': row.base_prompt,
-                    'voice_style': row.voice_style,
-                    'stats': row.stats
-                }
-                
-                # Сохраняем в кэш
-                opponent_cache.set(cache_key, opponent_data)
-                
-                return opponent_data
-            return None
         except Exception as e:
             logger.error(f"Ошибка получения соперника {opponent_id}: {e}", exc_info=True)
             return None
@@ -72,45 +135,30 @@ class AITrainerService:
         """
         Получить список соперников с фильтром по сложности и кэшированием.
         
-        Кэш TTL: 1 час.
-        """
-        # Пытаемся получить из кэша
-        cache_key = f"opponents:difficulty:{difficulty or 'all'}"
-        cached = opponent_cache.get(cache_key)
-        if cached:
-            return cached
+        Кэш TTL: 1 час, с single-flight и stale-while-revalidate (см. get_opponent_by_id).
         
-        try:
-            from bot.database.models import Opponent
-            
+        Args:
+            session: Не используется намеренно (loader открывает свою сессию, см. get_opponent_by_id)
+            difficulty: Фильтр по сложности (None — все)
+        """
+        from bot.database.database import AsyncSessionLocal
+        from bot.database.models import Opponent
+
+        async def load() -> List[Dict]:
             query = select(Opponent)
             if difficulty:
                 query = query.where(Opponent.difficulty == difficulty)
             query = query.order_by(Opponent.difficulty, Opponent.name)
-            
-            result = await session.execute(query)
-            opponents = result.scalars().all()
-            
-            opponents_data = [{
-                'id': opp.id,
-                'name': opp.name,
-                'difficulty': opp.difficulty,
-                'age': opp.age,
-                'profession': opp.profession,
-                'personality_type': opp.personality_type,
-                'communication_style': opp.communication_style,
-                'core_objections': opp.core_objections,
-                'triggers': opp.triggers,
-                'response_patterns': opp.response_patterns,
-                'base_prompt': opp.base_prompt,
-                'voice_style': opp.voice_style,
-                'stats': opp.stats
-            } for opp in opponents]
-            
-            # Сохраняем в кэш
-            opponent_cache.set(cache_key, opponents_data)
-            
-            return opponents_data
+
+            async with AsyncSessionLocal() as load_session:
+                result = await load_session.execute(query)
+                opponents = result.scalars().all()
+            return [AITrainerService._opponent_to_dict(opp) for opp in opponents]
+
+        try:
+            return await opponent_cache.get_or_load(
+                f"opponents:difficulty:{difficulty or 'all'}", load, stale_ttl=OPPONENT_STALE_TTL
+            )
         except Exception as e:
             logger.error(f"Ошибка получения списка соперников: {e}", exc_info=True)
             return []
@@ -351,21 +399,9 @@ class AITrainerService:
     
     @staticmethod
     async def analyze_intent(message: str) -> Dict[str, Any]:
-        """Простой анализ интента сообщения по ключевым словам"""
-        keywords = {
-            'prices': ['сколько', 'цена', 'стоимость', 'дешевле', 'booking', 'дорого', 'платить'],
-            'legality': ['легально', 'документ', 'лицензия', 'пирамида', 'iata', 'законно', 'мошенник'],
-            'how_it_works': ['как работает', 'принцип', 'откуда', 'почему', 'как это'],
-            'earnings': ['заработок', 'доход', 'сколько зарабат', 'компенсация', 'млм', 'сетевой'],
-            'trust': ['доверять', 'обман', 'развод', 'лохотрон', 'отзыв', 'правда']
-        }
-        
-        lower_message = message.lower()
-        detected_topics = []
-        
-        for topic, words in keywords.items():
-            if any(word in lower_message for word in words):
-                detected_topics.append(topic)
+        """Простой анализ интента сообщения по ключевым словам (один проход по тексту)"""
+        matched = _intent_matcher.match(message)
+        detected_topics = [topic for topic in INTENT_KEYWORDS if topic in matched]
         
         return {
             'topics': detected_topics,
@@ -376,32 +412,21 @@ class AITrainerService:
     @staticmethod
     async def get_relevant_knowledge(
         session: AsyncSession,
-        topics: List[str]
+        topics: List[str],
+        message: Optional[str] = None,
+        limit: int = 5
     ) -> List[Dict]:
-        """Получить релевантную информацию из базы знаний"""
+        """
+        Получить релевантную информацию из базы знаний.
+        
+        Ищет по категориям тем и по keywords записей в тексте сообщения (in-memory индекс).
+        """
         try:
-            if not topics:
+            if not topics and not message:
                 return []
             
-            # Мапинг топиков на категории в БД
-            topic_to_category = {
-                'prices': 'цены',
-                'legality': 'легальность',
-                'how_it_works': 'как_работает',
-                'earnings': 'компенсация',
-                'trust': 'доверие'
-            }
-            
-            categories = [topic_to_category.get(t, t) for t in topics]
-            
-            result = await session.execute(
-                select('knowledge_base')
-                .where('knowledge_base.category'.in_(categories))
-                .order_by('knowledge_base.priority'.desc())
-                .limit(5)
-            )
-            
-            return [dict(row._mapping) for row in result.fetchall()]
+            categories = [TOPIC_CATEGORIES.get(t, t) for t in topics]
+            return await get_knowledge_index().search(session, message, categories, limit=limit)
         except Exception as e:
             logger.error(f"Ошибка получения знаний: {e}")
             return []
@@ -413,11 +438,6 @@ class AITrainerService:
     ) -> Dict[str, Any]:
         """Анализ тренировочной сессии через OpenAI"""
         try:
-            api_key = os.getenv('OPEN_AI_API_KEY')
-            if not api_key:
-                logger.error("OPEN_AI_API_KEY не найден")
-                return None
-            
             # Формируем диалог для анализа
             dialogue = ""
             for msg in conversation_history:
@@ -466,61 +486,36 @@ overall_score - среднее арифметическое всех оцено
 
 Будь конкретным в strengths, weaknesses и recommendations. Приводи примеры из диалога."""
 
-            async with aiohttp.ClientSession() as http_session:
-                async with http_session.post(
-                    'https://api.openai.com/v1/chat/completions',
-                    headers={
-                        'Authorization': f'Bearer {api_key}',
-                        'Content-Type': 'application/json'
-                    },
-                    json={
-                        'model': 'gpt-4o-mini',
-                        'messages': [
-                            {'role': 'system', 'content': 'Ты эксперт по анализу продаж и тренингам. Отвечай только в JSON формате.'},
-                            {'role': 'user', 'content': analysis_prompt}
-                        ],
-                        'temperature': 0.7,
-                        'response_format': {'type': 'json_object'}
-                    }
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        analysis_text = result['choices'][0]['message']['content']
-                        return json.loads(analysis_text)
-                    else:
-                        logger.error(f"Ошибка API OpenAI: {response.status}")
-                        return None
+            analysis_text = await OpenAIGateway.chat_completion(
+                messages=[
+                    {'role': 'system', 'content': 'Ты эксперт по анализу продаж и тренингам. Отвечай только в JSON формате.'},
+                    {'role': 'user', 'content': analysis_prompt}
+                ],
+                model='gpt-4o-mini',
+                temperature=0.7,
+                response_format='json'
+            )
+            return json.loads(analysis_text)
         except Exception as e:
             logger.error(f"Ошибка анализа сессии: {e}")
             return None
     
     @staticmethod
-    async def transcribe_voice(file_path: str) -> Optional[str]:
-        """Транскрибировать голосовое сообщение через Whisper API"""
+    async def transcribe_voice(bot: Bot, file_id: str, file_unique_id: str) -> Optional[str]:
+        """Транскрибировать голосовое сообщение через Whisper API (с кэшем транскрипций)"""
+        model = 'gpt-4o-mini-transcribe'
+        
+        async def transcribe() -> str:
+            async with telegram_audio(bot, file_id) as audio:
+                return await OpenAIGateway.transcription(
+                    audio,
+                    filename='audio.ogg',
+                    model=model,
+                    language='ru'
+                )
+        
         try:
-            api_key = os.getenv('OPEN_AI_API_KEY')
-            if not api_key:
-                logger.error("OPEN_AI_API_KEY не найден")
-                return None
-            
-            async with aiohttp.ClientSession() as session:
-                with open(file_path, 'rb') as audio_file:
-                    form = aiohttp.FormData()
-                    form.add_field('file', audio_file, filename='audio.ogg')
-                    form.add_field('model', 'gpt-4o-mini-transcribe')
-                    form.add_field('language', 'ru')
-                    
-                    async with session.post(
-                        'https://api.openai.com/v1/audio/transcriptions',
-                        headers={'Authorization': f'Bearer {api_key}'},
-                        data=form
-                    ) as response:
-                        if response.status == 200:
-                            result = await response.json()
-                            return result.get('text')
-                        else:
-                            logger.error(f"Ошибка транскрибации: {response.status}")
-                            return None
+            return await get_transcript_cache().get_or_transcribe(file_unique_id, model, 'ru', transcribe)
         except Exception as e:
             logger.error(f"Ошибка транскрибации голоса: {e}")
             return None
@@ -531,78 +526,136 @@ overall_score - среднее арифметическое всех оцено
         query: str,
         limit: int = 5
     ) -> List[Dict]:
-        """Поиск релевантной информации в таблице documents через векторный поиск"""
+        """
+        Поиск релевантной информации в таблице documents через векторный поиск.
+        
+        Если включен in-memory индекс (VECTOR_INDEX_ENABLED), ищем в нем. Иначе
+        запрос идет по HNSW-индексу (ORDER BY расстояние LIMIT), embedding передается
+        бинарным параметром. Точность/скорость поиска настраивается DOCUMENTS_EF_SEARCH.
+        """
         try:
-            # Сначала получаем embedding для запроса через OpenAI
-            api_key = os.getenv('OPEN_AI_API_KEY')
-            if not api_key:
-                logger.error("OPEN_AI_API_KEY не найден")
-                return []
-            
-            async with aiohttp.ClientSession() as http_session:
-                # Генерируем embedding для запроса
-                async with http_session.post(
-                    'https://api.openai.com/v1/embeddings',
-                    headers={
-                        'Authorization': f'Bearer {api_key}',
-                        'Content-Type': 'application/json'
-                    },
-                    json={
-                        'input': query,
-                        'model': 'text-embedding-ada-002'
-                    }
-                ) as response:
-                    if response.status != 200:
-                        logger.error(f"Ошибка получения embedding: {response.status}")
-                        return []
-                    
-                    result = await response.json()
-                    query_embedding = result['data'][0]['embedding']
-            
-            # Выполняем векторный поиск в БД
-            embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
-            
-            query_sql = f"""
-            SELECT content, metadata,
-                   1 - (embedding <=> '{embedding_str}'::vector) as similarity
-            FROM documents
-            WHERE embedding IS NOT NULL
-            ORDER BY embedding <=> '{embedding_str}'::vector
-            LIMIT {limit};
-            """
-            
-            result = await session.execute(query_sql)
-            return [dict(row._mapping) for row in result.fetchall()]
+            # Сначала получаем embedding для запроса (повторяющиеся фразы — из кэша)
+            query_embedding = await get_embedding_service().embed(query, model='text-embedding-ada-002')
+            
+            # Индекс в памяти (если включен и загружен) — без запроса к БД.
+            # None — индекс не может ответить (другая размерность embeddings), ищем в БД
+            index = get_document_index()
+            if index is not None and index.ready:
+                results = index.search(query_embedding, limit)
+                if results is not None:
+                    return results
+            
+            # Savepoint: ошибка поиска не должна ломать транзакцию хендлера
+            async with session.begin_nested():
+                # Только для этой транзакции (аналог SET LOCAL, но с параметром)
+                await session.execute(
+                    text("SELECT set_config('hnsw.ef_search', :ef_search, true)"),
+                    {'ef_search': str(DOCUMENTS_EF_SEARCH)}
+                )
+                result = await session.execute(
+                    DOCUMENTS_SEARCH_SQL,
+                    {'embedding': query_embedding, 'limit': limit}
+                )
+                return [dict(row._mapping) for row in result.fetchall()]
             
         except Exception as e:
             logger.error(f"Ошибка поиска в documents: {e}")
             return []
     
+    @staticmethod
+    async def prepare_query_embedding(query: str) -> None:
+        """
+        Заранее посчитать embedding запроса для retrieve_context (ошибки не пробрасываются).
+        
+        Хендлер вызывает это до первой работы с БД, чтобы не держать соединение,
+        пока ждем Embeddings API: retrieve_context потом возьмет embedding из кэша.
+        """
+        try:
+            await get_embedding_service().embed(query, model='text-embedding-ada-002')
+        except Exception as e:
+            logger.warning(f"Не удалось заранее получить embedding запроса: {e}")
+    
+    @staticmethod
+    async def retrieve_context(
+        session: AsyncSession,
+        query: str,
+        limit: int = 5
+    ) -> List[Dict]:
+        """
+        Гибридный поиск фактов для ответа соперника (и для текста, и для голоса).
+        
+        Ранги нескольких поисков объединяются через Reciprocal Rank Fusion:
+        - knowledge_base по ключевым словам и темам (get_relevant_knowledge)
+        - knowledge_base по BM25
+        - documents по векторной близости (search_in_documents)
+        - documents по BM25 (если загружен in-memory индекс documents)
+        """
+        # Embedding запроса считается, пока идут лексические поиски (search_in_documents
+        # подхватит его из кэша)
+        prefetch = asyncio.create_task(get_embedding_service().embed(query, model='text-embedding-ada-002'))
+        
+        rankings: List[List[Dict]] = []
+        
+        intent = await AITrainerService.analyze_intent(query)
+        rankings.append(await AITrainerService.get_relevant_knowledge(
+            session, intent['topics'], message=query, limit=limit * 2
+        ))
+        
+        try:
+            rankings.append(await get_knowledge_index().bm25_search(session, query, limit=limit * 2))
+        except Exception as e:
+            logger.error(f"Ошибка BM25-поиска по базе знаний: {e}")
+        
+        rankings.append(await AITrainerService.search_in_documents(session, query, limit=limit * 2))
+        await asyncio.gather(prefetch, return_exceptions=True)
+        
+        document_index = get_document_index()
+        if document_index is not None:
+            rankings.append(document_index.lexical_search(query, limit=limit * 2))
+        
+        # Одна и та же запись из разных поисков — один ключ
+        items: Dict[Any, Dict] = {}
+        keyed_rankings = []
+        for ranking in rankings:
+            keys = []
+            for item in ranking:
+                key = ('doc', item['content']) if 'content' in item else ('kb', item['question'], item['answer'])
+                items.setdefault(key, item)
+                keys.append(key)
+            keyed_rankings.append(keys)
+        
+        return [items[key] for key in reciprocal_rank_fusion(keyed_rankings)[:limit]]
+    
     @staticmethod
     async def generate_ai_response(
         opponent_prompt: str,
         conversation_history: List[Dict],
         user_message: str,
-        relevant_knowledge: List[Dict]
+        relevant_knowledge: List[Dict],
+        on_partial: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Optional[str]:
-        """Генерация ответа AI-соперника через OpenAI GPT-4"""
+        """
+        Генерация ответа AI-соперника через OpenAI GPT-4.
+        
+        Если задан on_partial, ответ стримится и колбэк получает накопленный текст.
+        """
         try:
-            api_key = os.getenv('OPEN_AI_API_KEY')
-            if not api_key:
-                logger.error("OPEN_AI_API_KEY не найден")
-                return None
+            # Формируем контекст из базы знаний / documents (в пределах бюджета токенов)
+            snippets = []
+            for item in relevant_knowledge or []:
+                # Если это из documents
+                if 'content' in item:
+                    snippets.append(item['content'] or '')
+                # Если это из knowledge_base
+                elif 'question' in item and 'answer' in item:
+                    snippets.append(f"Q: {item['question']}\nA: {item['answer']}")
             
-            # Формируем контекст из базы знаний / documents
             knowledge_context = ""
-            if relevant_knowledge:
+            snippets = fit_to_token_budget(snippets, KNOWLEDGE_CONTEXT_TOKENS)
+            if snippets:
                 knowledge_context = "\n\n# РЕЛЕВАНТНЫЕ ФАКТЫ О ПРОДУКТЕ:\n"
-                for item in relevant_knowledge:
-                    # Если это из documents
-                    if 'content' in item:
-                        knowledge_context += f"\n{item['content'][:500]}...\n"
-                    # Если это из knowledge_base
-                    elif 'question' in item and 'answer' in item:
-                        knowledge_context += f"\nQ: {item['question']}\nA: {item['answer']}\n"
+                for snippet in snippets:
+                    knowledge_context += f"\n{snippet}\n"
             
             # Формируем историю диалога
             history_text = ""
@@ -621,30 +674,29 @@ overall_score - среднее арифметическое всех оцено
 
 Ответь В РОЛИ соперника, учитывая его психологию и паттерны поведения. НЕ повторяйся."""
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    'https://api.openai.com/v1/chat/completions',
-                    headers={
-                        'Authorization': f'Bearer {api_key}',
-                        'Content-Type': 'application/json'
-                    },
-                    json={
-                        'model': 'gpt-4o',
-                        'messages': [
-                            {'role': 'system', 'content': system_content},
-                            {'role': 'user', 'content': user_content}
-                        ],
-                        'max_tokens': 500,
-                        'temperature': 0.8
-                    }
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return result['choices'][0]['message']['content']
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Ошибка OpenAI API: {response.status} - {error_text}")
-                        return None
+            messages = [
+                {'role': 'system', 'content': system_content},
+                {'role': 'user', 'content': user_content}
+            ]
+            
+            if on_partial is None:
+                return await OpenAIGateway.chat_completion(
+                    messages=messages,
+                    model='gpt-4o',
+                    temperature=0.8,
+                    max_tokens=500
+                )
+            
+            text = ""
+            async for delta in OpenAIGateway.chat_completion_stream(
+                messages=messages,
+                model='gpt-4o',
+                temperature=0.8,
+                max_tokens=500
+            ):
+                text += delta
+                await on_partial(text)
+            return text
         except Exception as e:
             logger.error(f"Ошибка генерации ответа AI: {e}")
             return None
\ No newline at end of file
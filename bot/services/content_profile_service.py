@@ -270,6 +270,31 @@ class ContentProfileService:
             logger.error(f"Ошибка при добавлении голосового фрагмента: {e}", exc_info=True)
             raise
     
+    @staticmethod
+    async def set_chunk_transcript(session: AsyncSession, chunk_id: UUID, transcript: str) -> None:
+        """
+        Сохранить транскрипт голосового фрагмента
+        
+        Args:
+            session: Async сессия БД
+            chunk_id: ID фрагмента
+            transcript: Транскрибированный текст
+        """
+        try:
+            await session.execute(
+                update(ProfileVoiceChunk)
+                .where(ProfileVoiceChunk.id == chunk_id)
+                .values(transcript=transcript)
+            )
+            
+            await session.flush()
+            
+            logger.debug(f"Транскрипт сохранен для chunk_id={chunk_id} ({len(transcript)} символов)")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении транскрипта фрагмента: {e}", exc_info=True)
+            raise
+    
     @staticmethod
     async def get_session_voice_chunks(session: AsyncSession, session_id: UUID) -> List[ProfileVoiceChunk]:
         """
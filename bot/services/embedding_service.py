@@ -0,0 +1,193 @@
+"""
+Embedding Service: embeddings текстов с кэшем и микро-батчингом.
+
+Тренирующиеся постоянно повторяют одни и те же возражения ("это пирамида?", "сколько стоит?"),
+а каждый поиск по базе знаний начинается с запроса embedding.
+
+Правила:
+- Ключ кэша — sha256 от модели и нормализованного текста (регистр и пробелы не важны);
+  в API уходит тот же нормализованный текст, поэтому попадание в кэш равнозначно вызову
+- Два слоя (PersistentCache): TTLCache в памяти и таблица embedding_cache в Postgres;
+  параллельные запросы одного текста схлопываются в один
+- Промахи разных пользователей, пришедшие в пределах batch_window, уходят в API одним
+  запросом (до max_batch текстов)
+"""
+
+import asyncio
+import hashlib
+import os
+from array import array
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from bot.database.models import EmbeddingCacheEntry
+from bot.utils.cache import TTLCache, embedding_cache
+from bot.utils.openai_gateway import OpenAIGateway
+from bot.utils.persistent_cache import PersistentCache
+from bot.utils.rate_limiter import current_user_id
+
+DEFAULT_EMBEDDING_MODEL = 'text-embedding-ada-002'
+
+# Сколько хранить embedding в БД (сек): для фиксированной модели он не меняется
+EMBEDDING_TTL = 90 * 24 * 3600
+
+# Сколько ждать остальные промахи перед запросом к API (сек) и максимум текстов в запросе
+EMBEDDING_BATCH_WINDOW = float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', '20')) / 1000
+EMBEDDING_MAX_BATCH = int(os.getenv('EMBEDDING_MAX_BATCH', '64'))
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста для ключа кэша: регистр и лишние пробелы не важны"""
+    return ' '.join(text.casefold().split())
+
+
+def embedding_cache_key(model: str, normalized: str) -> str:
+    """Ключ кэша: sha256 от модели и нормализованного текста"""
+    return hashlib.sha256(f"{model}\n{normalized}".encode('utf-8')).hexdigest()
+
+
+def _vector_from_bytes(data: bytes) -> array:
+    vector = array('f')
+    vector.frombytes(data)
+    return vector
+
+
+class EmbeddingBatcher:
+    """Собирает одновременные запросы embeddings одной модели в один вызов API"""
+
+    def __init__(self, model: str, window: float, max_batch: int):
+        self._model = model
+        self._window = window
+        self._max_batch = max_batch
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+        # Счетчики для мониторинга
+        self.requests = 0
+        self.texts = 0
+
+    async def embed(self, text: str) -> List[float]:
+        """Поставить текст в ближайший батч и дождаться его embedding"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self._max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._window, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._send(batch), name=f"embeddings:{self._model}")
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        # Запрос общий для нескольких пользователей — не записываем его на одного в Rate Governor
+        current_user_id.set(None)
+
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            vectors = await OpenAIGateway.embeddings(texts, model=self._model)
+            by_text = dict(zip(texts, vectors))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.requests += 1
+        self.texts += len(texts)
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+
+class EmbeddingService:
+    """Embeddings с двухуровневым (память + Postgres) кэшем и микро-батчингом"""
+
+    def __init__(
+        self,
+        memory: TTLCache = embedding_cache,
+        ttl: int = EMBEDDING_TTL,
+        batch_window: float = EMBEDDING_BATCH_WINDOW,
+        max_batch: int = EMBEDDING_MAX_BATCH
+    ):
+        """
+        Args:
+            memory: Передний in-memory кэш
+            ttl: Время хранения embedding в БД (сек)
+            batch_window: Сколько ждать другие запросы перед вызовом API (сек)
+            max_batch: Максимум текстов в одном вызове API
+        """
+        self._cache = PersistentCache(
+            name="Embedding",
+            table=EmbeddingCacheEntry,
+            memory=memory,
+            key_columns=['key'],
+            value_column='embedding',
+            ttl=ttl,
+            encode=lambda vector: vector.tobytes(),
+            decode=_vector_from_bytes
+        )
+        self._batch_window = batch_window
+        self._max_batch = max_batch
+        self._batchers: Dict[str, EmbeddingBatcher] = {}
+
+    async def embed(self, text: str, model: str = DEFAULT_EMBEDDING_MODEL) -> List[float]:
+        """
+        Embedding одного текста.
+
+        Raises:
+            ValueError: пустой текст
+            OpenAIError / CircuitOpenError: ошибка API при промахе кэша
+        """
+        normalized = normalize_text(text)
+        if not normalized:
+            raise ValueError("Пустой текст для embedding")
+
+        async def compute() -> array:
+            return array('f', await self._batcher(model).embed(normalized))
+
+        vector = await self._cache.get_or_load(embedding_cache_key(model, normalized), compute, model=model)
+        return vector.tolist()
+
+    async def embed_many(self, texts: List[str], model: str = DEFAULT_EMBEDDING_MODEL) -> List[List[float]]:
+        """Embeddings нескольких текстов (промахи уходят в API одним батчем)"""
+        return list(await asyncio.gather(*(self.embed(text, model) for text in texts)))
+
+    def _batcher(self, model: str) -> EmbeddingBatcher:
+        batcher = self._batchers.get(model)
+        if batcher is None:
+            batcher = self._batchers[model] = EmbeddingBatcher(model, self._batch_window, self._max_batch)
+        return batcher
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика кэша и батчинга"""
+        return {
+            **self._cache.stats(),
+            'api_requests': sum(batcher.requests for batcher in self._batchers.values()),
+            'api_texts': sum(batcher.texts for batcher in self._batchers.values())
+        }
+
+
+# Singleton инстанс
+_embedding_service_instance: Optional[EmbeddingService] = None
+
+
+def get_embedding_service() -> EmbeddingService:
+    """Получить singleton инстанс Embedding Service"""
+    global _embedding_service_instance
+
+    if _embedding_service_instance is None:
+        _embedding_service_instance = EmbeddingService()
+
+    return _embedding_service_instance
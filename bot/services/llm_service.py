@@ -6,13 +6,17 @@ LLM Service для работы с OpenAI/Anthropic API
 import os
 import json
 import logging
-from typing import Dict, Any, List, Literal, Optional
-from openai import AsyncOpenAI
-import aiohttp
-from bot.utils.http_client import HTTPClientManager
+from typing import Dict, Any, AsyncIterator, Awaitable, Callable, List, Literal, Optional
+from bot.utils.openai_gateway import OpenAIGateway
 
 logger = logging.getLogger(__name__)
 
+# Время жизни кэша разбора профиля по одинаковому тексту (сек)
+PROFILE_PARSE_CACHE_TTL = 24 * 3600
+
+# Колбэк для частичного текста при стриминге (получает весь текст, накопленный на данный момент)
+PartialCallback = Callable[[str], Awaitable[None]]
+
 
 class LLMService:
     """Сервис для работы с LLM (OpenAI/Anthropic)"""
@@ -24,7 +28,6 @@ class LLMService:
         if not self.api_key:
             raise ValueError("OPEN_AI_API_KEY не найден в .env")
         
-        self.client = AsyncOpenAI(api_key=self.api_key)
         self.model = os.getenv('LLM_MODEL', 'gpt-4-turbo-preview')
         
         logger.info(f"LLM Service инициализирован: provider={self.provider}, model={self.model}")
@@ -35,7 +38,9 @@ class LLMService:
         system_prompt: Optional[str] = None,
         temperature: float = 0.7,
         max_tokens: int = 2000,
-        response_format: Literal['text', 'json'] = 'text'
+        response_format: Literal['text', 'json'] = 'text',
+        on_partial: Optional[PartialCallback] = None,
+        cache_ttl: Optional[int] = None
     ) -> str:
         """
         Универсальный метод для генерации completion
@@ -46,36 +51,40 @@ class LLMService:
             temperature: Температура (0-1)
             max_tokens: Максимальное количество токенов
             response_format: Формат ответа ('text' или 'json')
+            on_partial: Если задан, ответ стримится и колбэк получает накопленный текст
+                (только для response_format='text')
+            cache_ttl: Кэшировать ответ по хэшу запроса (для детерминированных промптов)
         
         Returns:
             str: Сгенерированный текст
         """
         try:
-            messages = []
-            
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            
-            messages.append({"role": "user", "content": prompt})
+            messages = self._build_messages(prompt, system_prompt)
             
-            # Параметры запроса
-            kwargs = {
-                "model": self.model,
-                "messages": messages,
-                "temperature": temperature,
-                "max_tokens": max_tokens
-            }
-            
-            # Для JSON ответа используем response_format
-            if response_format == 'json':
-                kwargs["response_format"] = {"type": "json_object"}
-            
-            # Выполняем запрос
-            response = await self.client.chat.completions.create(**kwargs)
+            if on_partial is not None and response_format == 'text':
+                text = ""
+                async for delta in self.stream_completion(
+                    prompt,
+                    system_prompt=system_prompt,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                ):
+                    text += delta
+                    await on_partial(text)
+                
+                logger.info(f"LLM completion (stream) успешно сгенерирован ({len(text)} chars)")
+                return text
             
-            result = response.choices[0].message.content
+            result = await OpenAIGateway.chat_completion(
+                messages=messages,
+                model=self.model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                response_format=response_format,
+                cache_ttl=cache_ttl
+            )
             
-            logger.info(f"LLM completion успешно сгенерирован (tokens: {response.usage.total_tokens})")
+            logger.info("LLM completion успешно сгенерирован")
             
             return result
             
@@ -83,6 +92,43 @@ class LLMService:
             logger.error(f"Ошибка при генерации completion: {e}", exc_info=True)
             raise
     
+    @staticmethod
+    def _build_messages(prompt: str, system_prompt: Optional[str]) -> List[Dict[str, str]]:
+        messages = []
+        
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        
+        messages.append({"role": "user", "content": prompt})
+        return messages
+    
+    async def stream_completion(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 2000
+    ) -> AsyncIterator[str]:
+        """
+        Потоковая генерация completion
+        
+        Args:
+            prompt: Основной промпт
+            system_prompt: Системный промпт (опционально)
+            temperature: Температура (0-1)
+            max_tokens: Максимальное количество токенов
+        
+        Yields:
+            str: Очередной фрагмент текста
+        """
+        async for delta in OpenAIGateway.chat_completion_stream(
+            messages=self._build_messages(prompt, system_prompt),
+            model=self.model,
+            temperature=temperature,
+            max_tokens=max_tokens
+        ):
+            yield delta
+    
     async def parse_profile_from_text(self, user_text: str) -> Dict[str, Any]:
         """
         Парсинг профиля пользователя из текста или транскрипта
@@ -144,7 +190,9 @@ class LLMService:
                 system_prompt=system_prompt,
                 temperature=0.3,
                 max_tokens=2000,
-                response_format='json'
+                response_format='json',
+                # Повторная попытка пользователя с тем же текстом не должна снова ждать LLM
+                cache_ttl=PROFILE_PARSE_CACHE_TTL
             )
             
             # Очищаем ответ от возможных markdown блоков
@@ -305,7 +353,8 @@ class LLMService:
         idea_title: str,
         idea_description: str,
         content_type_name: str,
-        platform: str
+        platform: str,
+        on_partial: Optional[PartialCallback] = None
     ) -> str:
         """
         Генерация готового поста
@@ -316,6 +365,7 @@ class LLMService:
             idea_description: Описание идеи
             content_type_name: Тип контента
             platform: Платформа
+            on_partial: Колбэк для постепенного вывода текста (стриминг)
         
         Returns:
             str: Готовый текст поста
@@ -375,7 +425,8 @@ class LLMService:
                 system_prompt=system_prompt,
                 temperature=0.8,
                 max_tokens=2500,
-                response_format='text'
+                response_format='text',
+                on_partial=on_partial
             )
             
             logger.info("Пост успешно сгенерирован")
@@ -390,7 +441,8 @@ class LLMService:
         self,
         original_post: str,
         edit_instruction: str,
-        profile_data: Dict[str, Any]
+        profile_data: Dict[str, Any],
+        on_partial: Optional[PartialCallback] = None
     ) -> str:
         """
         Редактирование поста по инструкции
@@ -399,6 +451,7 @@ class LLMService:
             original_post: Оригинальный текст поста
             edit_instruction: Инструкция по редактированию
             profile_data: Профиль пользователя
+            on_partial: Колбэк для постепенного вывода текста (стриминг)
         
         Returns:
             str: Отредактированный текст поста
@@ -437,7 +490,8 @@ class LLMService:
                 system_prompt=system_prompt,
                 temperature=0.7,
                 max_tokens=2500,
-                response_format='text'
+                response_format='text',
+                on_partial=on_partial
             )
             
             logger.info("Пост успешно отредактирован")
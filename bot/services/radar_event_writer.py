@@ -0,0 +1,242 @@
+"""
+Фоновая пакетная запись событий радара.
+
+Хендлеры воронки только кладут событие в буфер в памяти, а запись в БД
+выполняется фоновой задачей пачками (multi-row INSERT) по размеру или по времени.
+Задержка клика по воронке больше не зависит от задержки записи в БД.
+"""
+
+import asyncio
+import logging
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from bot.database.database import AsyncSessionLocal
+from bot.database.models import RadarEvent
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, которые не пройдут при повторе (плохие данные, нарушение FK и т.п.)
+BAD_ROW_ERRORS = (IntegrityError, DataError)
+
+
+class RadarEventWriter:
+    """
+    Буфер событий радара с пакетной записью.
+
+    Правила:
+    - enqueue() не обращается к БД и не блокирует хендлер
+    - Пачка пишется, когда набралось batch_size событий или прошло flush_interval
+    - При ошибке БД события остаются в буфере (не больше max_buffer), но не больше
+      max_attempts попыток: потом событие отбрасывается с записью в лог
+    - Если пачку отвергли из-за данных, события пишутся по одному: плохое событие
+      отбрасывается (в лог), остальные записываются и не блокируют очередь
+    - Все потерянные события (переполнение буфера, плохие данные, исчерпаны попытки) считаются в stats()
+    - close() дописывает все оставшиеся события (вызывается из shutdown())
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_buffer: int = 10000,
+        max_attempts: int = 10
+    ):
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._buffer: Deque[Dict[str, Any]] = deque(maxlen=max_buffer)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._max_attempts = max_attempts
+        self._attempts: Dict[uuid.UUID, int] = {}
+
+        # Счетчики для мониторинга
+        self._written = 0
+        self._dropped = 0
+        self._rejected = 0
+        self._expired = 0
+
+    def enqueue(
+        self,
+        partner_id: uuid.UUID,
+        lead_id: uuid.UUID,
+        action_type: str
+    ) -> None:
+        """Поставить событие в буфер (время события фиксируется сейчас)"""
+        if len(self._buffer) == self._buffer.maxlen:
+            # deque(maxlen) вытеснит самое старое событие
+            self._dropped += 1
+            logger.warning("Буфер событий радара переполнен, старое событие потеряно")
+
+        self._buffer.append({
+            'id': uuid.uuid4(),
+            'partner_id': partner_id,
+            'lead_id': lead_id,
+            'action_type': action_type,
+            'created_at': datetime.now(timezone.utc)
+        })
+
+        self._ensure_task()
+        if len(self._buffer) >= self._batch_size:
+            self._wakeup.set()
+
+    def _ensure_task(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run(), name="radar-event-writer")
+
+    async def _run(self) -> None:
+        failures = 0
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+                failures = 0
+            except Exception:
+                failures += 1
+                logger.error("Ошибка записи событий радара, повторим позже", exc_info=True)
+                # Пока БД недоступна, попытки (и их счетчики у событий) расходуем реже
+                await asyncio.sleep(min(self._flush_interval * 2 ** failures, 60.0))
+
+    async def flush(self) -> int:
+        """
+        Записать все накопленные события пачками.
+
+        Returns:
+            Количество записанных событий
+        """
+        if not self._buffer:
+            return 0
+
+        written = 0
+        async with self._flush_lock:
+            while self._buffer:
+                batch: List[Dict[str, Any]] = [
+                    self._buffer.popleft()
+                    for _ in range(min(self._batch_size, len(self._buffer)))
+                ]
+                try:
+                    await self._insert(batch)
+                except BAD_ROW_ERRORS:
+                    # Пачку отвергли из-за данных — ищем плохие события по одному
+                    written += await self._insert_one_by_one(batch)
+                    continue
+                except BaseException:
+                    self._requeue(batch)
+                    raise
+
+                written += len(batch)
+                self._written += len(batch)
+                self._forget_attempts(batch)
+
+        logger.debug(f"Записано событий радара: {written}")
+        return written
+
+    @staticmethod
+    async def _insert(events: List[Dict[str, Any]]) -> None:
+        async with AsyncSessionLocal() as session:
+            await session.execute(insert(RadarEvent), events)
+            await session.commit()
+
+    async def _insert_one_by_one(self, batch: List[Dict[str, Any]]) -> int:
+        """Записать события по одному, отбросив те, что отвергает БД"""
+        written = 0
+        for i, event in enumerate(batch):
+            try:
+                await self._insert([event])
+            except BAD_ROW_ERRORS as e:
+                self._rejected += 1
+                self._attempts.pop(event['id'], None)
+                logger.error(f"Событие радара отвергнуто БД и отброшено: {event} ({e})")
+                continue
+            except BaseException:
+                self._requeue(batch[i:])
+                raise
+
+            written += 1
+            self._written += 1
+            self._attempts.pop(event['id'], None)
+        return written
+
+    def _requeue(self, batch: List[Dict[str, Any]]) -> None:
+        """Вернуть пачку в начало буфера (в исходном порядке), кроме исчерпавших попытки"""
+        retry = []
+        for event in batch:
+            attempts = self._attempts.get(event['id'], 0) + 1
+            if attempts >= self._max_attempts:
+                self._expired += 1
+                self._attempts.pop(event['id'], None)
+                logger.error(f"Событие радара не записано за {attempts} попыток и отброшено: {event}")
+                continue
+            self._attempts[event['id']] = attempts
+            retry.append(event)
+
+        # extendleft в полный deque вытесняет самые новые события справа — считаем их
+        overflow = len(retry) - (self._buffer.maxlen - len(self._buffer))
+        if overflow > 0:
+            self._dropped += overflow
+            for event in list(self._buffer)[-overflow:]:
+                self._attempts.pop(event['id'], None)
+            logger.warning(f"Буфер событий радара переполнен, потеряно {overflow} новых событий")
+
+        self._buffer.extendleft(reversed(retry))
+
+    def _forget_attempts(self, batch: List[Dict[str, Any]]) -> None:
+        if self._attempts:
+            for event in batch:
+                self._attempts.pop(event['id'], None)
+
+    async def close(self) -> None:
+        """Остановить фоновую задачу и дописать оставшиеся события"""
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+        try:
+            await self.flush()
+        except Exception:
+            logger.error(
+                f"Не удалось дописать {len(self._buffer)} событий радара при остановке",
+                exc_info=True
+            )
+
+        logger.info(f"RadarEventWriter остановлен: {self.stats()}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика записи"""
+        return {
+            'buffered': len(self._buffer),
+            'written': self._written,
+            'dropped': self._dropped,
+            'rejected': self._rejected,
+            'expired': self._expired
+        }
+
+
+# Singleton инстанс
+_radar_event_writer_instance: Optional[RadarEventWriter] = None
+
+
+def get_radar_event_writer() -> RadarEventWriter:
+    """Получить singleton инстанс писателя событий радара"""
+    global _radar_event_writer_instance
+
+    if _radar_event_writer_instance is None:
+        _radar_event_writer_instance = RadarEventWriter()
+
+    return _radar_event_writer_instance
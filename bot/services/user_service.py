@@ -1,8 +1,13 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
+from sqlalchemy import select, update, event
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
 from bot.database.models import User, RadarEvent
+from bot.utils.cache import user_cache
+from bot.services.radar_event_writer import get_radar_event_writer
 from datetime import datetime
+from typing import Any, Dict, Optional
 import uuid
 import logging
 
@@ -17,8 +22,64 @@ class UserService:
     - Сервисы НЕ делают commit/rollback - это делает middleware
     - Используем session.add() и session.flush() для получения ID
     - Один запрос = одна транзакция (управляется middleware)
+    - Пользователи кэшируются: в рамках запроса (session.info) и в процессе (user_cache).
+      Все методы записи в users обязаны вызывать _invalidate_user()
     """
     
+    @staticmethod
+    def _cache_key_tg(telegram_id: str) -> str:
+        return f"user:tg:{telegram_id}"
+    
+    @staticmethod
+    def _cache_key_id(user_id: uuid.UUID) -> str:
+        return f"user:id:{user_id}"
+    
+    @staticmethod
+    def _request_identity(session: AsyncSession) -> Dict[str, User]:
+        """Кэш пользователей в рамках одного запроса (живет вместе с сессией)"""
+        return session.info.setdefault('user_identity', {})
+    
+    @staticmethod
+    def _cache_user(user: User) -> None:
+        """Положить снимок колонок пользователя в кэш процесса"""
+        values = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+        user_cache.set(UserService._cache_key_tg(user.telegram_id), values)
+        user_cache.set(UserService._cache_key_id(user.id), values)
+    
+    @staticmethod
+    async def _attach_cached_user(session: AsyncSession, values: Dict[str, Any]) -> User:
+        """
+        Присоединить пользователя из кэша к сессии без SELECT.
+        
+        Если пользователь уже есть в identity map сессии, возвращаем его (он свежее кэша).
+        """
+        existing = session.sync_session.identity_map.get(identity_key(User, values['id']))
+        if existing is not None:
+            return existing
+        
+        user = User(**values)
+        make_transient_to_detached(user)
+        return await session.merge(user, load=False)
+    
+    @staticmethod
+    def _invalidate_user(session: AsyncSession, telegram_id: str) -> None:
+        """
+        Сбросить кэш пользователя сейчас и после commit.
+        
+        Повторный сброс после commit нужен, чтобы параллельный запрос
+        не закэшировал старое значение до фиксации транзакции.
+        """
+        def invalidate(*_args) -> None:
+            values = user_cache.get(UserService._cache_key_tg(telegram_id))
+            user_cache.delete(UserService._cache_key_tg(telegram_id))
+            if values:
+                user_cache.delete(UserService._cache_key_id(values['id']))
+        
+        invalidate()
+        UserService._request_identity(session).pop(telegram_id, None)
+        event.listen(session.sync_session, "after_commit", invalidate, once=True)
+    
+
     @staticmethod
     async def get_or_create_user(
         session: AsyncSession,
@@ -48,6 +109,7 @@ class UserService:
                     if referrer:
                         referrer_id = referrer.id
                         referrer.total_referrals += 1
+                        UserService._invalidate_user(session, referrer.telegram_id)
 
                 # Генерируем новый реферальный код для нового пользователя
                 new_referral_code = str(uuid.uuid4())[:8]
@@ -89,15 +151,37 @@ class UserService:
             user.telegram_bot_referral_link = f"https://t.me/{bot_username}?start={user.referral_code}"
 
         await session.flush()  # Сохраняем обновления в рамках транзакции
+        
+        # Данные пользователя изменились
+        UserService._invalidate_user(session, telegram_id)
+        UserService._request_identity(session)[telegram_id] = user
         return user
     
     @staticmethod
     async def get_user_by_telegram_id(session: AsyncSession, telegram_id: str) -> User:
-        """Получить пользователя по telegram_id"""
-        result = await session.execute(
-            select(User).where(User.telegram_id == telegram_id)
-        )
-        return result.scalar_one_or_none()
+        """
+        Получить пользователя по telegram_id.
+        
+        Порядок: кэш запроса -> кэш процесса (без SELECT) -> БД.
+        """
+        identity = UserService._request_identity(session)
+        if telegram_id in identity:
+            return identity[telegram_id]
+        
+        cached = user_cache.get(UserService._cache_key_tg(telegram_id))
+        if cached:
+            user = await UserService._attach_cached_user(session, cached)
+        else:
+            result = await session.execute(
+                select(User).where(User.telegram_id == telegram_id)
+            )
+            user = result.scalar_one_or_none()
+            if user:
+                UserService._cache_user(user)
+        
+        if user:
+            identity[telegram_id] = user
+        return user
 
     @staticmethod
     async def update_subscription_status(
@@ -114,6 +198,7 @@ class UserService:
                 subscription_payment_date=datetime.now()
             )
         )
+        UserService._invalidate_user(session, telegram_id)
         # НЕ делаем commit - это сделает middleware
     
     @staticmethod
@@ -154,6 +239,7 @@ class UserService:
                 .where(User.telegram_id == telegram_id)
                 .values(**update_values)
             )
+            UserService._invalidate_user(session, telegram_id)
             # НЕ делаем commit - это сделает middleware
     
     @staticmethod
@@ -164,6 +250,7 @@ class UserService:
             .where(User.telegram_id == telegram_id)
             .values(welcome_video_id=video_id)
         )
+        UserService._invalidate_user(session, telegram_id)
         # НЕ делаем commit
     
     @staticmethod
@@ -174,6 +261,7 @@ class UserService:
             .where(User.telegram_id == telegram_id)
             .values(voice_passive_income_id=voice_id)
         )
+        UserService._invalidate_user(session, telegram_id)
         # НЕ делаем commit
     
     
@@ -185,6 +273,7 @@ class UserService:
             .where(User.telegram_id == telegram_id)
             .values(voice_freedom_id=voice_id)
         )
+        UserService._invalidate_user(session, telegram_id)
         # НЕ делаем commit
     
     @staticmethod
@@ -195,6 +284,7 @@ class UserService:
             .where(User.telegram_id == telegram_id)
             .values(voice_final_cta_id=voice_id)
         )
+        UserService._invalidate_user(session, telegram_id)
         # НЕ делаем commit
     
     @staticmethod
@@ -205,6 +295,7 @@ class UserService:
             .where(User.telegram_id == telegram_id)
             .values(voice_pay_less_id=voice_id)
         )
+        UserService._invalidate_user(session, telegram_id)
         # НЕ делаем commit
     
     @staticmethod
@@ -215,6 +306,7 @@ class UserService:
             .where(User.telegram_id == telegram_id)
             .values(voice_5star_3star_id=voice_id)
         )
+        UserService._invalidate_user(session, telegram_id)
         # НЕ делаем commit
     
     @staticmethod
@@ -225,6 +317,7 @@ class UserService:
             .where(User.telegram_id == telegram_id)
             .values(voice_travel_more_id=voice_id)
         )
+        UserService._invalidate_user(session, telegram_id)
         # НЕ делаем commit
     
     @staticmethod
@@ -235,6 +328,7 @@ class UserService:
             .where(User.telegram_id == telegram_id)
             .values(voice_passive_income_final_id=voice_id)
         )
+        UserService._invalidate_user(session, telegram_id)
         # НЕ делаем commit
     
     @staticmethod
@@ -245,6 +339,7 @@ class UserService:
             .where(User.telegram_id == telegram_id)
             .values(voice_free_travel_id=voice_id)
         )
+        UserService._invalidate_user(session, telegram_id)
         # НЕ делаем commit
     
     @staticmethod
@@ -255,6 +350,7 @@ class UserService:
             .where(User.telegram_id == telegram_id)
             .values(voice_free_travel_final_id=voice_id)
         )
+        UserService._invalidate_user(session, telegram_id)
         # НЕ делаем commit
     
     @staticmethod
@@ -265,18 +361,34 @@ class UserService:
             .where(User.telegram_id == telegram_id)
             .values(voice_quit_job_final_id=voice_id)
         )
+        UserService._invalidate_user(session, telegram_id)
         # НЕ делаем commit
     
     @staticmethod
-    async def get_referrer(session: AsyncSession, user: User) -> User:
-        """Получить реферера пользователя"""
+    async def get_referrer(session: AsyncSession, user: User) -> Optional[User]:
+        """
+        Получить реферера пользователя.
+        
+        Порядок: identity map сессии -> кэш процесса (без SELECT) -> БД.
+        """
         if not user.referred_by_user_id:
             return None
         
+        existing = session.sync_session.identity_map.get(identity_key(User, user.referred_by_user_id))
+        if existing is not None:
+            return existing
+        
+        cached = user_cache.get(UserService._cache_key_id(user.referred_by_user_id))
+        if cached:
+            return await UserService._attach_cached_user(session, cached)
+        
         result = await session.execute(
             select(User).where(User.id == user.referred_by_user_id)
         )
-        return result.scalar_one_or_none()
+        referrer = result.scalar_one_or_none()
+        if referrer:
+            UserService._cache_user(referrer)
+        return referrer
     
     @staticmethod
     async def add_radar_event(
@@ -285,14 +397,17 @@ class UserService:
         lead_id: uuid.UUID,
         action_type: str
     ):
-        """Добавить событие в радар"""
-        event = RadarEvent(
+        """
+        Добавить событие в радар.
+        
+        Событие ставится в буфер RadarEventWriter и пишется в БД фоновой пачкой,
+        а не в транзакции запроса (session не используется).
+        """
+        get_radar_event_writer().enqueue(
             partner_id=partner_id,
             lead_id=lead_id,
             action_type=action_type
         )
-        session.add(event)
-        # НЕ делаем commit - это сделает middleware
     
     @staticmethod
     async def get_radar_events(session: AsyncSession, partner_id: uuid.UUID, limit: int = 10):
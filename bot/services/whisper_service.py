@@ -1,17 +1,28 @@
 """
 Whisper Service для транскрибации голосовых сообщений
-Использует OpenAI Whisper API
+Использует OpenAI Whisper API (через OpenAIGateway)
 """
 
 import os
+import asyncio
 import logging
-from typing import Optional, List
-from openai import AsyncOpenAI
-import aiohttp
+from contextlib import AsyncExitStack
+from typing import Awaitable, BinaryIO, Callable, Optional, List
+from uuid import UUID
 from aiogram import Bot
 
+from bot.database.unit_of_work import write_transaction
+from bot.services.content_profile_service import ContentProfileService
+from bot.utils.audio import telegram_audio
+from bot.utils.background_jobs import get_background_jobs
+from bot.utils.openai_gateway import OpenAIGateway
+from bot.utils.transcript_cache import get_transcript_cache
+
 logger = logging.getLogger(__name__)
 
+# Колбэк прогресса транскрибации: (готово, всего)
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
 
 class WhisperService:
     """Сервис для транскрибации голосовых сообщений через Whisper API"""
@@ -22,7 +33,6 @@ class WhisperService:
         if not self.api_key:
             raise ValueError("OPEN_AI_API_KEY не найден в .env")
         
-        self.client = AsyncOpenAI(api_key=self.api_key)
         self.model = "gpt-4o-mini-transcribe"
         
         logger.info("Whisper Service инициализирован")
@@ -31,94 +41,172 @@ class WhisperService:
         self,
         bot: Bot,
         file_id: str,
-        language: str = "ru"
+        language: str = "ru",
+        file_unique_id: Optional[str] = None
     ) -> str:
         """
         Транскрибация голосового сообщения
         
+        Сначала проверяется кэш транскрипций: при попадании файл не скачивается.
+        
         Args:
             bot: Экземпляр бота для скачивания файла
             file_id: ID файла в Telegram
             language: Язык транскрипции (по умолчанию русский)
+            file_unique_id: Уникальный ID файла (если не передан — берется из bot.get_file)
         
         Returns:
             str: Транскрибированный текст
         """
-        temp_file_path = None
-        
         try:
-            # Получаем информацию о файле
-            file = await bot.get_file(file_id)
-            
-            # Скачиваем файл
-            temp_file_path = f"/tmp/voice_{file_id}.ogg"
-            await bot.download_file(file.file_path, destination=temp_file_path)
-            
-            logger.info(f"Голосовой файл скачан: {temp_file_path}")
+            file = None
+            if file_unique_id is None:
+                file = await bot.get_file(file_id)
+                file_unique_id = file.file_unique_id
             
-            # Транскрибируем через Whisper API
-            with open(temp_file_path, "rb") as audio_file:
-                transcript = await self.client.audio.transcriptions.create(
-                    model=self.model,
-                    file=audio_file,
-                    language=language,
-                    response_format="text"
-                )
+            async def transcribe() -> str:
+                async with telegram_audio(bot, file_id, file=file) as audio:
+                    return await self._transcribe(audio, language)
             
-            logger.info(f"Транскрипция выполнена успешно (length: {len(transcript)} chars)")
-            
-            return transcript
+            return await get_transcript_cache().get_or_transcribe(
+                file_unique_id, self.model, language, transcribe
+            )
             
         except Exception as e:
             logger.error(f"Ошибка при транскрибации голосового сообщения: {e}", exc_info=True)
             raise
+    
+    async def _transcribe(self, audio: BinaryIO, language: str) -> str:
+        """Транскрибировать загруженное аудио через Whisper API"""
+        transcript = await OpenAIGateway.transcription(
+            audio,
+            filename="voice.ogg",
+            model=self.model,
+            language=language
+        )
         
-        finally:
-            # Удаляем временный файл
-            if temp_file_path:
-                try:
-                    import os as os_module
-                    if os_module.path.exists(temp_file_path):
-                        os_module.remove(temp_file_path)
-                        logger.debug(f"Временный файл удален: {temp_file_path}")
-                except Exception as e:
-                    logger.warning(f"Не удалось удалить временный файл: {e}")
+        logger.info(f"Транскрипция выполнена успешно (length: {len(transcript)} chars)")
+        return transcript
     
-    async def transcribe_multiple_voices(
+    async def transcribe_voices(
         self,
         bot: Bot,
         file_ids: List[str],
-        language: str = "ru"
-    ) -> str:
+        language: str = "ru",
+        max_concurrency: int = 4,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> List[str]:
         """
-        Транскрибация нескольких голосовых сообщений и объединение в один текст
+        Транскрибация нескольких голосовых сообщений
+        
+        Фрагменты обрабатываются конвейером: скачивание (в память) идет параллельно,
+        транскрибация — не более max_concurrency одновременно. Фрагмент, который
+        уже транскрибируется в фоне, не транскрибируется повторно (single-flight кэша).
         
         Args:
             bot: Экземпляр бота
-            file_ids: Список ID файлов в Telegram
+            file_ids: Список ID файлов в Telegram (в порядке записи)
             language: Язык транскрипции
+            max_concurrency: Сколько фрагментов транскрибировать одновременно
+            on_progress: Колбэк прогресса (готово, всего)
         
         Returns:
-            str: Объединенный транскрибированный текст
+            List[str]: Транскрипты в порядке file_ids
         """
-        try:
-            transcripts = []
-            
-            for idx, file_id in enumerate(file_ids, 1):
-                logger.info(f"Транскрибация голосового фрагмента {idx}/{len(file_ids)}")
-                transcript = await self.transcribe_voice(bot, file_id, language)
-                transcripts.append(transcript)
-            
-            # Объединяем все транскрипты
-            combined_text = " ".join(transcripts)
+        total = len(file_ids)
+        transcripts: List[str] = [""] * total
+        download_limit = asyncio.Semaphore(max_concurrency * 2)
+        transcribe_limit = asyncio.Semaphore(max_concurrency)
+        done = 0
+        
+        async def process(index: int, file_id: str) -> None:
+            nonlocal done
+            async with download_limit:
+                file = await bot.get_file(file_id)
             
-            logger.info(f"Все голосовые сообщения транскрибированы. Общая длина: {len(combined_text)} символов")
+            async def transcribe() -> str:
+                async with AsyncExitStack() as stack:
+                    # Скачанное аудио живет до конца транскрибации, слот скачивания — нет
+                    async with download_limit:
+                        audio = await stack.enter_async_context(telegram_audio(bot, file_id, file=file))
+                    async with transcribe_limit:
+                        return await self._transcribe(audio, language)
             
-            return combined_text
+            # Уже транскрибированные фрагменты (повтор после ошибки) берутся из кэша
+            transcripts[index] = await get_transcript_cache().get_or_transcribe(
+                file.file_unique_id, self.model, language, transcribe
+            )
             
-        except Exception as e:
-            logger.error(f"Ошибка при транскрибации нескольких голосовых: {e}", exc_info=True)
+            done += 1
+            logger.info(f"Транскрибирован голосовой фрагмент {index + 1} ({done}/{total} готово)")
+            if on_progress is not None:
+                try:
+                    await on_progress(done, total)
+                except Exception as e:
+                    logger.debug(f"Не удалось сообщить прогресс транскрибации: {e}")
+        
+        tasks = [asyncio.ensure_future(process(index, file_id)) for index, file_id in enumerate(file_ids)]
+        
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException as e:
+            # Один фрагмент не удался — остальные больше не нужны
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if isinstance(e, Exception):
+                logger.error(f"Ошибка при транскрибации нескольких голосовых: {e}", exc_info=True)
             raise
+        
+        return transcripts
+    
+    async def transcribe_multiple_voices(
+        self,
+        bot: Bot,
+        file_ids: List[str],
+        language: str = "ru",
+        max_concurrency: int = 4,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> str:
+        """
+        Транскрибация нескольких голосовых сообщений и объединение в один текст
+        (в исходном порядке file_ids — порядке sequence_number)
+        
+        Returns:
+            str: Объединенный транскрибированный текст
+        """
+        transcripts = await self.transcribe_voices(bot, file_ids, language, max_concurrency, on_progress)
+        
+        # Объединяем все транскрипты
+        combined_text = " ".join(transcripts)
+        
+        logger.info(f"Все голосовые сообщения транскрибированы. Общая длина: {len(combined_text)} символов")
+        
+        return combined_text
+    
+    def schedule_chunk_transcription(
+        self,
+        bot: Bot,
+        chunk_id: UUID,
+        file_id: str,
+        file_unique_id: str,
+        language: str = "ru"
+    ) -> None:
+        """
+        Начать транскрибацию фрагмента голосовой сессии в фоне.
+        
+        Результат сохраняется в ProfileVoiceChunk.transcript. Фрагмент должен быть
+        уже закоммичен: задача пишет в БД своей сессией.
+        """
+        async def job() -> None:
+            transcript = await self.transcribe_voice(bot, file_id, language, file_unique_id=file_unique_id)
+            if not transcript:
+                return
+            
+            async with write_transaction() as session:
+                await ContentProfileService.set_chunk_transcript(session, chunk_id, transcript)
+        
+        get_background_jobs('transcription').submit(f"voice_chunk:{chunk_id}", job)
 
 
 # Singleton инстанс
@@ -0,0 +1,82 @@
+"""
+Загрузка аудио из Telegram без временных файлов.
+
+Правила:
+- Небольшие файлы (голосовые) скачиваются в память (BytesIO) и сразу уходят в API транскрипции
+- Файлы больше AUDIO_SPOOL_LIMIT (или неизвестного размера) пишутся на диск асинхронно
+  (aiogram пишет через aiofiles) и удаляются после использования
+- Ни открытие, ни удаление файла не блокируют event loop
+"""
+
+import asyncio
+import os
+import tempfile
+import uuid
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, BinaryIO, Optional
+
+from aiogram import Bot
+from aiogram.types import File
+
+logger = logging.getLogger(__name__)
+
+# Порог, после которого аудио не держим в памяти (байт)
+AUDIO_SPOOL_LIMIT = int(os.getenv('AUDIO_SPOOL_LIMIT', str(8 * 1024 * 1024)))
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+        logger.debug(f"Временный аудиофайл удален: {path}")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Не удалось удалить временный аудиофайл {path}: {e}")
+
+
+@asynccontextmanager
+async def telegram_audio(
+    bot: Bot,
+    file_id: str,
+    spool_limit: int = AUDIO_SPOOL_LIMIT,
+    file: Optional[File] = None
+) -> AsyncIterator[BinaryIO]:
+    """
+    Скачать аудио из Telegram и отдать его как файловый объект.
+
+    Использование:
+        async with telegram_audio(bot, voice.file_id) as audio:
+            text = await OpenAIGateway.transcription(audio, filename='voice.ogg')
+
+    Args:
+        bot: Экземпляр бота
+        file_id: ID файла в Telegram
+        spool_limit: Максимальный размер файла для загрузки в память (байт)
+        file: Уже полученный bot.get_file(file_id) (чтобы не запрашивать повторно)
+    """
+    if file is None:
+        file = await bot.get_file(file_id)
+
+    if file.file_size is not None and file.file_size <= spool_limit:
+        buffer = await bot.download_file(file.file_path)
+        logger.debug(f"Аудио загружено в память ({file.file_size} байт)")
+        try:
+            yield buffer
+        finally:
+            buffer.close()
+        return
+
+    # Большой файл — на диск, но без блокирующего I/O в event loop
+    path = os.path.join(tempfile.gettempdir(), f"audio_{uuid.uuid4().hex}.ogg")
+    try:
+        await bot.download_file(file.file_path, destination=path)
+        logger.info(f"Аудио ({file.file_size} байт) сохранено во временный файл: {path}")
+
+        audio = await asyncio.to_thread(open, path, 'rb')
+        try:
+            yield audio
+        finally:
+            await asyncio.to_thread(audio.close)
+    finally:
+        await asyncio.to_thread(_remove_file, path)
@@ -0,0 +1,120 @@
+"""
+Фоновые задачи, которые не должны задерживать ответ пользователю.
+
+Правила:
+- submit() возвращает сразу: задача выполняется вне хендлера (и вне его сессии БД)
+- Задача с тем же ключом, пока она выполняется, повторно не ставится
+- Одновременно выполняется не больше max_concurrency задач, остальные ждут
+- У каждого вида работы свой пул (get_background_jobs(pool)) со своим лимитом
+- Ошибка задачи логируется и не влияет на остальные
+- Контекст (current_user_id) копируется в задачу: Rate Governor видит владельца
+- close() дожидается задач при остановке (с таймаутом), оставшиеся отменяет
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundJobs:
+    """Пул фоновых задач с дедупликацией по ключу"""
+
+    def __init__(self, max_concurrency: int = 8, name: str = 'default'):
+        """
+        Args:
+            max_concurrency: Максимум одновременно выполняемых задач
+            name: Имя пула (для логов)
+        """
+        self.name = name
+        self._max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+        # Счетчики для мониторинга
+        self._completed = 0
+        self._failed = 0
+
+    def submit(self, key: str, job: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """
+        Поставить задачу в фон.
+
+        Args:
+            key: Ключ задачи (повторная постановка того же ключа вернет текущую задачу)
+            job: Фабрика корутины
+        """
+        task = self._tasks.get(key)
+        if task is not None and not task.done():
+            return task
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        task = asyncio.create_task(self._run(key, job), name=f"job:{key}")
+        self._tasks[key] = task
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return task
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    async def _run(self, key: str, job: Callable[[], Awaitable[Any]]) -> None:
+        async with self._semaphore:
+            try:
+                await job()
+                self._completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failed += 1
+                logger.error(f"Фоновая задача {key} завершилась ошибкой: {e}", exc_info=True)
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Дождаться выполняющихся задач (не дольше timeout), остальные отменить"""
+        tasks = list(self._tasks.values())
+        if not tasks:
+            return
+
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        if pending:
+            logger.warning(f"Отменено {len(pending)} фоновых задач пула {self.name} при остановке")
+        logger.info(f"BackgroundJobs ({self.name}) остановлен: {self.stats()}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика задач"""
+        return {
+            'running': len(self._tasks),
+            'completed': self._completed,
+            'failed': self._failed
+        }
+
+
+# Отдельные пулы для разных видов работы: долгие генерации изображений не должны
+# занимать слоты коротких транскрипций (и наоборот)
+JOB_POOLS: Dict[str, int] = {
+    'transcription': 8,  # Транскрипция фрагментов голосовых (секунды)
+    'generation': 8,     # Генерации Fal.ai (минуты)
+    'default': 8
+}
+
+_background_jobs_instances: Dict[str, BackgroundJobs] = {}
+
+
+def get_background_jobs(pool: str = 'default') -> BackgroundJobs:
+    """Получить singleton инстанс пула фоновых задач по имени (см. JOB_POOLS)"""
+    jobs = _background_jobs_instances.get(pool)
+    if jobs is None:
+        jobs = _background_jobs_instances[pool] = BackgroundJobs(JOB_POOLS.get(pool, JOB_POOLS['default']), name=pool)
+
+    return jobs
+
+
+async def close_background_jobs(timeout: float = 10.0) -> None:
+    """Дождаться задач всех пулов (для graceful shutdown)"""
+    await asyncio.gather(*(jobs.close(timeout) for jobs in _background_jobs_instances.values()))
@@ -0,0 +1,89 @@
+"""
+Лексический поиск BM25 в памяти процесса.
+
+Дополняет векторный поиск там, где важны точные слова (названия, цифры, "IATA"),
+а embeddings их размывают.
+
+Правила:
+- Токены — слова (\\w+) без учета регистра, "ё" = "е", однобуквенные отбрасываются
+- Вместо морфологии — обрезка слова до STEM_LENGTH символов ("пирамида"/"пирамиды" — один токен)
+- Индекс неизменяемый: при изменении корпуса строится заново (корпус небольшой)
+"""
+
+import heapq
+import math
+import re
+from typing import Dict, List, Sequence, Tuple
+
+TOKEN_RE = re.compile(r'\w+')
+
+# До скольких символов обрезать слово (грубый стемминг для русского)
+STEM_LENGTH = 6
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбить текст на токены для BM25"""
+    return [
+        token[:STEM_LENGTH]
+        for token in TOKEN_RE.findall(text.casefold().replace('ё', 'е'))
+        if len(token) > 1
+    ]
+
+
+class BM25Index:
+    """Инвертированный индекс с ранжированием Okapi BM25"""
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            texts: Документы корпуса (позиция в списке — номер документа)
+            k1: Насыщение частоты термина
+            b: Нормализация по длине документа
+        """
+        self._k1 = k1
+        self._b = b
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._lengths: List[int] = []
+
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            self._lengths.append(len(tokens))
+
+            frequencies: Dict[str, int] = {}
+            for token in tokens:
+                frequencies[token] = frequencies.get(token, 0) + 1
+            for token, frequency in frequencies.items():
+                self._postings.setdefault(token, []).append((doc, frequency))
+
+        count = len(self._lengths)
+        self._avg_length = (sum(self._lengths) / count) if count else 0.0
+        self._idf = {
+            token: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for token, postings in self._postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[int, float]]:
+        """
+        Лучшие документы по запросу.
+
+        Returns:
+            Список (номер документа, score) по убыванию score
+        """
+        if not self._avg_length:
+            return []
+
+        scores: Dict[int, float] = {}
+        for token in set(tokenize(query)):
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+
+            idf = self._idf[token]
+            for doc, frequency in postings:
+                norm = self._k1 * (1 - self._b + self._b * self._lengths[doc] / self._avg_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * frequency * (self._k1 + 1) / (frequency + norm)
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
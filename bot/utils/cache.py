@@ -1,148 +1,398 @@
 """
-Простая система кэширования для часто используемых данных.
+Система кэширования для часто используемых данных.
 
-Использует in-memory кэш с TTL для:
+Использует in-memory LRU кэш с TTL и ограничением размера для:
 - Opponent profiles
-- User profiles (опционально)
-- Knowledge base queries
+- User identity (users по telegram_id / id)
+- Ответы LLM на детерминированные промпты
+- Транскрипции голосовых и embeddings текстов
+
+Правила:
+- Время считается по монотонным часам (не зависит от перевода системного времени)
+- Размер ограничен количеством записей и (опционально) примерным объемом в байтах,
+  при превышении вытесняются самые давно использованные записи (LRU)
+- Истекшие записи удаляются фоновой задачей (start_cache_janitor), а не только при чтении
+- stats() работает за O(1)
+- get_or_load() схлопывает параллельные промахи по одному ключу в одну загрузку
+  (single-flight) и умеет отдавать устаревшее значение, пока идет обновление
+  (stale-while-revalidate)
 """
 
-from typing import Optional, Dict, Any
-from datetime import datetime, timedelta
+import asyncio
 import logging
+import sys
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional
 
 logger = logging.getLogger(__name__)
 
 
-class SimpleCache:
+def estimate_size(value: Any, _depth: int = 0) -> int:
+    """
+    Примерный размер значения в байтах.
+
+    Учитывает вложенные dict/list/tuple/set на несколько уровней —
+    для ограничения памяти кэша точности достаточно.
     """
-    Простой in-memory кэш с поддержкой TTL (Time To Live).
-    
+    size = sys.getsizeof(value)
+    if _depth >= 4:
+        return size
+
+    if isinstance(value, dict):
+        size += sum(
+            estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1)
+            for k, v in value.items()
+        )
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _depth + 1) for item in value)
+
+    return size
+
+
+class _Entry(NamedTuple):
+    value: Any
+    expires_at: float
+    stale_until: float  # До этого момента запись можно отдавать как устаревшую
+    size: int
+
+
+class TTLCache:
+    """
+    In-memory LRU кэш с TTL (Time To Live) и ограничением размера.
+
     Правила:
-    - Данные хранятся в памяти
+    - Данные хранятся в памяти процесса
     - Автоматическое истечение по TTL
-    - Потокобезопасен для async/await
+    - Ограничение по количеству записей и по объему (LRU вытеснение)
+    - Безопасен для async/await (операции синхронные, без await внутри)
     """
-    
-    def __init__(self, default_ttl: int = 3600):
+
+    def __init__(
+        self,
+        default_ttl: int = 3600,
+        max_items: int = 10000,
+        max_bytes: Optional[int] = None,
+        sizeof: Callable[[Any], int] = estimate_size,
+        name: str = "cache"
+    ):
         """
         Args:
-            default_ttl: Время жизни кэша в секундах (по умолчанию 1 час)
+            default_ttl: Время жизни записи в секундах (по умолчанию 1 час)
+            max_items: Максимальное количество записей
+            max_bytes: Максимальный примерный объем в байтах (None — без ограничения)
+            sizeof: Функция оценки размера значения
+            name: Имя кэша для логов и статистики
         """
-        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
         self._default_ttl = default_ttl
-    
-    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        self._max_items = max_items
+        self._max_bytes = max_bytes
+        self._sizeof = sizeof
+        self.name = name
+
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+        self._total_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._loads = 0
+        self._coalesced = 0
+        self._stale_hits = 0
+
+        _registry.add(self)
+
+    def set(
+        self,
+        key: str,
+        value: Any,
+        ttl: Optional[int] = None,
+        stale_ttl: int = 0
+    ) -> None:
         """
         Сохранить значение в кэш.
-        
+
         Args:
             key: Уникальный ключ
             value: Значение для кэширования
-            ttl: Время жизни в секундах (опционально)
+            ttl: Время жизни в секундах (None — default_ttl, 0 и меньше — не кэшировать)
+            stale_ttl: Сколько секунд после истечения запись еще можно отдавать
+                через get_or_load() как устаревшую (пока идет обновление)
         """
-        expires_at = datetime.now() + timedelta(seconds=ttl or self._default_ttl)
-        self._cache[key] = {
-            'value': value,
-            'expires_at': expires_at
-        }
-        
-        logger.debug(f"Cache SET: {key} (TTL: {ttl or self._default_ttl}s)")
-    
+        ttl = ttl if ttl is not None else self._default_ttl
+        if ttl <= 0:
+            # "Не кэшировать": старое значение тоже убираем, чтобы не отдать его позже
+            self.delete(key)
+            return
+
+        size = self._sizeof(value) if self._max_bytes else 0
+
+        old = self._cache.pop(key, None)
+        if old is not None:
+            self._total_bytes -= old.size
+
+        expires_at = time.monotonic() + ttl
+        self._cache[key] = _Entry(value, expires_at, expires_at + stale_ttl, size)
+        self._total_bytes += size
+        self._evict_overflow()
+
+        logger.debug(f"Cache[{self.name}] SET: {key} (TTL: {ttl}s)")
+
     def get(self, key: str) -> Optional[Any]:
         """
         Получить значение из кэша.
-        
+
         Args:
             key: Ключ для поиска
-            
+
         Returns:
             Значение или None если не найдено/истекло
         """
-        if key not in self._cache:
-            logger.debug(f"Cache MISS: {key}")
+        entry = self._cache.get(key)
+        if entry is None:
+            self._misses += 1
+            logger.debug(f"Cache[{self.name}] MISS: {key}")
             return None
-        
-        entry = self._cache[key]
-        
+
         # Проверяем TTL
-        if datetime.now() > entry['expires_at']:
-            # Удаляем истекшую запись
-            del self._cache[key]
-            logger.debug(f"Cache EXPIRED: {key}")
+        now = time.monotonic()
+        if now > entry.expires_at:
+            # Устаревшую запись оставляем для stale-while-revalidate
+            if now > entry.stale_until:
+                self._remove(key)
+                self._expirations += 1
+            self._misses += 1
+            logger.debug(f"Cache[{self.name}] EXPIRED: {key}")
             return None
-        
-        logger.debug(f"Cache HIT: {key}")
-        return entry['value']
-    
+
+        self._cache.move_to_end(key)
+        self._hits += 1
+        logger.debug(f"Cache[{self.name}] HIT: {key}")
+        return entry.value
+
+    async def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: Optional[int] = None,
+        stale_ttl: int = 0,
+        cache_none: bool = False
+    ) -> Any:
+        """
+        Получить значение из кэша или загрузить его (single-flight).
+
+        - Параллельные промахи по одному ключу ждут одну и ту же загрузку
+        - Если stale_ttl > 0, после истечения TTL еще stale_ttl секунд отдается
+          старое значение, а обновление идет одной фоновой загрузкой
+
+        Подходит для запросов к БД, embeddings и LLM-вызовов.
+        loader выполняется в отдельной задаче, поэтому не должен зависеть от
+        ресурсов конкретного запроса (например, его сессии БД), если используется stale_ttl.
+
+        Args:
+            key: Ключ кэша
+            loader: Корутина-фабрика, загружающая значение
+            ttl: Время жизни в секундах (опционально)
+            stale_ttl: Окно stale-while-revalidate в секундах
+            cache_none: Кэшировать ли None (по умолчанию нет)
+
+        Returns:
+            Значение из кэша или результат loader
+        """
+        entry = self._cache.get(key)
+        if entry is not None:
+            now = time.monotonic()
+            if now <= entry.expires_at:
+                self._cache.move_to_end(key)
+                self._hits += 1
+                return entry.value
+
+            if now <= entry.stale_until:
+                self._stale_hits += 1
+                if key not in self._inflight:
+                    self._start_load(key, loader, ttl, stale_ttl, cache_none)
+                return entry.value
+
+        self._misses += 1
+        task = self._inflight.get(key)
+        if task is not None:
+            self._coalesced += 1
+        else:
+            task = self._start_load(key, loader, ttl, stale_ttl, cache_none)
+
+        # shield: отмена одного ожидающего не отменяет общую загрузку
+        return await asyncio.shield(task)
+
+    def _start_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: Optional[int],
+        stale_ttl: int,
+        cache_none: bool
+    ) -> asyncio.Task:
+        async def run() -> Any:
+            try:
+                value = await loader()
+                if value is not None or cache_none:
+                    self.set(key, value, ttl=ttl, stale_ttl=stale_ttl)
+                return value
+            finally:
+                self._inflight.pop(key, None)
+
+        self._loads += 1
+        task = asyncio.ensure_future(run())
+        task.add_done_callback(self._log_background_error)
+        self._inflight[key] = task
+        return task
+
+    def _log_background_error(self, task: asyncio.Task) -> None:
+        """Забираем исключение загрузки, чтобы фоновое обновление не терялось молча"""
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Cache[{self.name}] loader failed: {task.exception()}")
+
     def delete(self, key: str) -> bool:
         """
         Удалить значение из кэша.
-        
+
         Args:
             key: Ключ для удаления
-            
+
         Returns:
             True если удалено, False если не найдено
         """
         if key in self._cache:
-            del self._cache[key]
-            logger.debug(f"Cache DELETE: {key}")
+            self._remove(key)
+            logger.debug(f"Cache[{self.name}] DELETE: {key}")
             return True
         return False
-    
+
     def clear(self) -> None:
         """Очистить весь кэш"""
         count = len(self._cache)
         self._cache.clear()
-        logger.info(f"Cache CLEARED: {count} items removed")
-    
+        self._total_bytes = 0
+        logger.info(f"Cache[{self.name}] CLEARED: {count} items removed")
+
     def cleanup_expired(self) -> int:
         """
         Удалить все истекшие записи.
-        
+
         Returns:
             Количество удаленных записей
         """
-        now = datetime.now()
+        now = time.monotonic()
         expired_keys = [
             key for key, entry in self._cache.items()
-            if now > entry['expires_at']
+            if now > entry.stale_until
         ]
-        
+
         for key in expired_keys:
-            del self._cache[key]
-        
+            self._remove(key)
+
+        self._expirations += len(expired_keys)
+
         if expired_keys:
-            logger.info(f"Cache CLEANUP: {len(expired_keys)} expired items removed")
-        
+            logger.debug(f"Cache[{self.name}] CLEANUP: {len(expired_keys)} expired items removed")
+
         return len(expired_keys)
-    
+
     def stats(self) -> Dict[str, Any]:
         """
-        Получить статистику кэша.
-        
+        Получить статистику кэша (O(1)).
+
         Returns:
             Словарь со статистикой
         """
-        now = datetime.now()
-        active_count = sum(
-            1 for entry in self._cache.values()
-            if now <= entry['expires_at']
-        )
-        expired_count = len(self._cache) - active_count
-        
+        lookups = self._hits + self._misses
         return {
+            'name': self.name,
             'total_items': len(self._cache),
-            'active_items': active_count,
-            'expired_items': expired_count
+            'max_items': self._max_items,
+            'total_bytes': self._total_bytes,
+            'max_bytes': self._max_bytes,
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_ratio': round(self._hits / lookups, 3) if lookups else 0.0,
+            'evictions': self._evictions,
+            'expirations': self._expirations,
+            'loads': self._loads,
+            'coalesced': self._coalesced,
+            'stale_hits': self._stale_hits,
+            'inflight': len(self._inflight)
         }
 
+    def _remove(self, key: str) -> None:
+        entry = self._cache.pop(key)
+        self._total_bytes -= entry.size
+
+    def _evict_overflow(self) -> None:
+        """Вытеснить самые давно использованные записи сверх лимитов"""
+        while self._cache and (
+            len(self._cache) > self._max_items
+            or (self._max_bytes is not None and self._total_bytes > self._max_bytes)
+        ):
+            _, entry = self._cache.popitem(last=False)
+            self._total_bytes -= entry.size
+            self._evictions += 1
+
+
+# Все созданные кэши (для фоновой очистки)
+_registry: "weakref.WeakSet[TTLCache]" = weakref.WeakSet()
+_janitor_task: Optional[asyncio.Task] = None
+
+
+async def _janitor(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        for cache in list(_registry):
+            try:
+                cache.cleanup_expired()
+            except Exception:
+                logger.error(f"Ошибка очистки кэша {cache.name}", exc_info=True)
+
+
+def start_cache_janitor(interval: float = 60.0) -> None:
+    """Запустить фоновую очистку истекших записей во всех кэшах"""
+    global _janitor_task
+
+    if _janitor_task is None or _janitor_task.done():
+        _janitor_task = asyncio.create_task(_janitor(interval), name="cache-janitor")
+        logger.info(f"Cache janitor запущен (интервал: {interval}s)")
+
+
+async def stop_cache_janitor() -> None:
+    """Остановить фоновую очистку (для graceful shutdown)"""
+    global _janitor_task
+
+    if _janitor_task is not None:
+        _janitor_task.cancel()
+        await asyncio.gather(_janitor_task, return_exceptions=True)
+        _janitor_task = None
+
+    for cache in list(_registry):
+        logger.info(f"Cache stats: {cache.stats()}")
+
 
 # Глобальный кэш для opponent profiles
 # TTL = 1 час (профили соперников редко меняются)
-opponent_cache = SimpleCache(default_ttl=3600)
+opponent_cache = TTLCache(default_ttl=3600, max_items=500, name="opponents")
+
+# Глобальный кэш для пользователей (UserService.get_user_by_telegram_id / get_referrer)
+# TTL = 1 минута (инвалидируется при записи, короткий TTL страхует от других процессов)
+user_cache = TTLCache(default_ttl=60, max_items=50000, name="users")
+
+# Глобальный кэш ответов LLM (передний слой PersistentCache из llm_cache, персистентный слой — в БД)
+# TTL задается при вызове, по умолчанию 1 день
+llm_response_cache = TTLCache(default_ttl=86400, max_items=5000, max_bytes=32 * 1024 * 1024, name="llm")
+
+# Глобальный кэш транскрипций голосовых (передний слой для TranscriptCache, персистентный слой — в БД)
+# TTL = 1 день
+transcript_cache = TTLCache(default_ttl=86400, max_items=5000, max_bytes=16 * 1024 * 1024, name="transcripts")
 
-# Глобальный кэш для knowledge base queries
-# TTL = 30 минут
-knowledge_cache = SimpleCache(default_ttl=1800)
\ No newline at end of file
+# Глобальный кэш embeddings (передний слой для EmbeddingService, персистентный слой — в БД)
+# TTL = 1 день, значения — array('f') (~6 КБ на вектор ada-002)
+embedding_cache = TTLCache(default_ttl=86400, max_items=10000, max_bytes=64 * 1024 * 1024, name="embeddings")
@@ -0,0 +1,232 @@
+"""
+Клиент очереди Fal.ai (queue.fal.run).
+
+Вместо одного HTTP-запроса, висящего всю генерацию (до 2 минут), генерация идет в три шага:
+submit (получаем request_id) → ожидание статуса → получение результата.
+
+Правила:
+- Каждый запрос к очереди короткий, с повторами и общим circuit breaker "fal"
+- submit не повторяется после таймаута (иначе можно поставить генерацию дважды)
+- Статус опрашивается с растущим интервалом; если задан FAL_WEBHOOK_URL, Fal.ai присылает
+  webhook о завершении и ожидание прерывается сразу (опрос остается страховкой:
+  webhook мог прийти в другой процесс или потеряться)
+- Webhook только будит ожидание, содержимому webhook не доверяем — результат всегда
+  забираем сами по response_url
+- Изменения статуса (очередь/позиция/генерация) отдаются в колбэк прогресса
+- Слот Rate Governor "fal" занимается только на submit и на получение результата:
+  пока генерация ждет в очереди Fal.ai, слот свободен для других пользователей
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+from urllib.parse import urlencode
+
+import aiohttp
+
+from bot.utils.http_client import HTTPClientManager
+from bot.utils.rate_limiter import get_rate_governor
+from bot.utils.resilience import RetryPolicy, call_with_retry, get_circuit_breaker, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+FAL_QUEUE_URL = os.getenv('FAL_QUEUE_URL', 'https://queue.fal.run').rstrip('/')
+
+# Публичный адрес webhook о завершении генерации (опционально, только в режиме webhook)
+FAL_WEBHOOK_URL = os.getenv('FAL_WEBHOOK_URL')
+
+# Таймаут одного запроса к очереди (сек)
+FAL_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=10, sock_read=20)
+
+# Ожидание результата: интервал опроса растет от min до max, общий лимит — job_timeout (сек)
+FAL_POLL_MIN_INTERVAL = 1.0
+FAL_POLL_MAX_INTERVAL = 5.0
+FAL_JOB_TIMEOUT = float(os.getenv('FAL_JOB_TIMEOUT', '300'))
+
+# submit: не повторяем после таймаута (генерация могла уже встать в очередь)
+SUBMIT_RETRY_POLICY = RetryPolicy(attempts=2, base_delay=1.0, max_delay=10.0, deadline=None, retry_timeouts=False)
+
+# Статус и результат — идемпотентные чтения, их можно повторять смело
+POLL_RETRY_POLICY = RetryPolicy(attempts=3, base_delay=0.5, max_delay=5.0, deadline=30.0)
+
+# Колбэк прогресса: (статус очереди, позиция в очереди)
+FalProgressCallback = Callable[[str, Optional[int]], Awaitable[None]]
+
+
+class FalAPIError(Exception):
+    """Fal.ai ответил не-2xx статусом"""
+
+    def __init__(self, status: int, body: str, retry_after: Optional[float] = None):
+        self.status = status
+        self.body = body
+        self.retry_after = retry_after
+        super().__init__(f"Fal.ai API error: {body}")
+
+
+class FalTimeoutError(Exception):
+    """Генерация не завершилась за FAL_JOB_TIMEOUT"""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        super().__init__("Fal.ai не успел сгенерировать изображение, попробуй еще раз")
+
+
+class FalQueue:
+    """Генерации через очередь Fal.ai поверх shared ClientSession"""
+
+    # request_id → событие, которое будит webhook о завершении
+    _waiters: Dict[str, asyncio.Event] = {}
+
+    @classmethod
+    async def _call(
+        cls,
+        method: str,
+        url: str,
+        policy: RetryPolicy,
+        json: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Короткий запрос к очереди с повторами и circuit breaker.
+
+        Raises:
+            FalAPIError: не-2xx ответ
+            CircuitOpenError: Fal.ai недоступен
+        """
+        async def attempt() -> Dict[str, Any]:
+            session = await HTTPClientManager.get_fal_session()
+            async with session.request(method, url, json=json, timeout=FAL_REQUEST_TIMEOUT) as response:
+                if response.status >= 300:
+                    raise FalAPIError(
+                        response.status,
+                        await response.text(),
+                        retry_after=parse_retry_after(response.headers.get('Retry-After'))
+                    )
+                return await response.json()
+
+        return await call_with_retry(attempt, breaker=get_circuit_breaker('fal'), policy=policy)
+
+    @classmethod
+    async def submit(cls, model_path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Поставить генерацию в очередь.
+
+        Args:
+            model_path: Модель ("fal-ai/flux-2-pro/edit")
+            payload: Параметры генерации
+
+        Returns:
+            Ответ очереди: request_id, status_url, response_url, cancel_url
+        """
+        url = f"{FAL_QUEUE_URL}/{model_path}"
+        if FAL_WEBHOOK_URL:
+            url = f"{url}?{urlencode({'fal_webhook': FAL_WEBHOOK_URL})}"
+
+        job = await cls._call('POST', url, SUBMIT_RETRY_POLICY, json=payload)
+
+        # Старые ответы очереди могли не содержать URL — собираем их сами (по id приложения)
+        app_id = '/'.join(model_path.split('/')[:2])
+        base = f"{FAL_QUEUE_URL}/{app_id}/requests/{job['request_id']}"
+        job.setdefault('status_url', f"{base}/status")
+        job.setdefault('response_url', base)
+        job.setdefault('cancel_url', f"{base}/cancel")
+
+        logger.info(f"Fal.ai: генерация {job['request_id']} поставлена в очередь ({model_path})")
+        return job
+
+    @classmethod
+    async def wait(cls, job: Dict[str, Any], on_progress: Optional[FalProgressCallback] = None) -> None:
+        """
+        Дождаться завершения генерации (webhook или опрос статуса).
+
+        Raises:
+            FalTimeoutError: не дождались за FAL_JOB_TIMEOUT (генерация отменяется)
+        """
+        request_id = job['request_id']
+        wakeup = cls._waiters[request_id] = asyncio.Event()
+        deadline = time.monotonic() + FAL_JOB_TIMEOUT
+        interval = FAL_POLL_MIN_INTERVAL
+        last_reported = None
+
+        try:
+            while True:
+                status = await cls._call('GET', job['status_url'], POLL_RETRY_POLICY)
+                state = status.get('status')
+                if state == 'COMPLETED':
+                    return
+
+                progress = (state, status.get('queue_position'))
+                if on_progress is not None and progress != last_reported:
+                    last_reported = progress
+                    try:
+                        await on_progress(*progress)
+                    except Exception as e:
+                        logger.debug(f"Не удалось сообщить прогресс генерации: {e}")
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    await cls._cancel(job)
+                    raise FalTimeoutError(request_id)
+
+                # Webhook будит раньше, иначе ждем очередной интервал опроса
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=min(interval, remaining))
+                except asyncio.TimeoutError:
+                    interval = min(interval * 1.5, FAL_POLL_MAX_INTERVAL)
+                wakeup.clear()
+        finally:
+            cls._waiters.pop(request_id, None)
+
+    @classmethod
+    async def result(cls, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Забрать результат завершенной генерации"""
+        return await cls._call('GET', job['response_url'], POLL_RETRY_POLICY)
+
+    @classmethod
+    async def run(
+        cls,
+        model_path: str,
+        payload: Dict[str, Any],
+        on_progress: Optional[FalProgressCallback] = None
+    ) -> Dict[str, Any]:
+        """Полный цикл: submit → ожидание → результат"""
+        governor = get_rate_governor()
+        model = model_path.rsplit('fal-ai/', 1)[-1]
+
+        # Слот держим только на время запроса submit, а не всю генерацию
+        async with governor.slot('fal', model):
+            job = await cls.submit(model_path, payload)
+        if on_progress is not None:
+            try:
+                await on_progress('IN_QUEUE', job.get('queue_position'))
+            except Exception as e:
+                logger.debug(f"Не удалось сообщить прогресс генерации: {e}")
+
+        await cls.wait(job, on_progress)
+
+        # Ответ уже готов — короткий слот только на его загрузку
+        async with governor.slot('fal'):
+            return await cls.result(job)
+
+    @classmethod
+    async def _cancel(cls, job: Dict[str, Any]) -> None:
+        """Отменить генерацию (best effort: за отмененную генерацию не платим)"""
+        try:
+            await cls._call('PUT', job['cancel_url'], RetryPolicy(attempts=1))
+        except Exception as e:
+            logger.warning(f"Fal.ai: не удалось отменить генерацию {job['request_id']}: {e}")
+
+    @classmethod
+    def notify(cls, request_id: str) -> bool:
+        """
+        Webhook о завершении генерации: разбудить ожидание.
+
+        Returns:
+            True если генерация ожидается в этом процессе
+        """
+        wakeup = cls._waiters.get(request_id)
+        if wakeup is None:
+            return False
+        wakeup.set()
+        return True
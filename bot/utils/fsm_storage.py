@@ -0,0 +1,325 @@
+"""
+Персистентное хранилище FSM для aiogram.
+
+Заменяет MemoryStorage: состояние и данные FSM хранятся в таблице
+fsm_storage (Postgres) и переживают рестарты и деплои.
+
+Правила:
+- Одна строка на ключ (state + data вместе), у каждой строки свой expires_at (TTL)
+- Записи коалесцируются: серия state.update_data() внутри хендлера
+  превращается в один multi-row UPSERT через flush_delay
+- Прочитанные/записанные ключи держатся в локальном кэше процесса.
+  Это корректно, пока апдейты одного пользователя обрабатывает один процесс
+  (polling или шардирование по from_user.id)
+- Данные сериализуются компактным JSON, крупные — дополнительно сжимаются zlib
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from bot.database.database import AsyncSessionLocal
+from bot.database.models import FSMRecord
+
+logger = logging.getLogger(__name__)
+
+# Данные крупнее этого порога сжимаются zlib
+COMPRESS_THRESHOLD = 512
+
+_RAW_PREFIX = b'j'
+_ZLIB_PREFIX = b'z'
+
+
+def serialize_data(data: Dict[str, Any]) -> Optional[bytes]:
+    """Компактная сериализация данных FSM"""
+    if not data:
+        return None
+
+    raw = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if len(raw) > COMPRESS_THRESHOLD:
+        return _ZLIB_PREFIX + zlib.compress(raw)
+    return _RAW_PREFIX + raw
+
+
+def deserialize_data(blob: Optional[bytes]) -> Dict[str, Any]:
+    """Обратная операция к serialize_data"""
+    if not blob:
+        return {}
+
+    prefix, payload = blob[:1], blob[1:]
+    if prefix == _ZLIB_PREFIX:
+        payload = zlib.decompress(payload)
+    return json.loads(payload.decode('utf-8'))
+
+
+@dataclass
+class _Entry:
+    """Запись локального кэша хранилища"""
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    expires_at: Optional[datetime] = None
+    touched: float = field(default_factory=time.monotonic)
+
+
+class DatabaseStorage(BaseStorage):
+    """
+    FSM хранилище в Postgres с TTL и коалесцированием записей.
+    """
+
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        key_builder: Optional[KeyBuilder] = None,
+        ttl: Optional[int] = 7 * 24 * 3600,
+        flush_delay: float = 0.2,
+        cache_idle_ttl: int = 600,
+        purge_interval: int = 3600
+    ):
+        """
+        Args:
+            session_factory: Фабрика сессий БД
+            key_builder: Построитель ключей aiogram
+            ttl: Время жизни ключа с последней записи (сек, None — бессрочно)
+            flush_delay: Задержка, в течение которой записи коалесцируются (сек)
+            cache_idle_ttl: Через сколько неиспользуемый ключ выгружается из локального кэша (сек)
+            purge_interval: Как часто удалять истекшие строки из БД (сек)
+        """
+        self._session_factory = session_factory
+        self._key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._ttl = ttl
+        self._flush_delay = flush_delay
+        self._cache_idle_ttl = cache_idle_ttl
+        self._purge_interval = purge_interval
+
+        self._cache: Dict[str, _Entry] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._dirty: set = set()
+        self._flush_event: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_purge = time.monotonic()
+
+    # ------------------------------------------------------------------
+    # Интерфейс BaseStorage
+    # ------------------------------------------------------------------
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self._key_builder.build(key)
+        entry = await self._get_entry(storage_key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(storage_key, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = await self._get_entry(self._key_builder.build(key))
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self._key_builder.build(key)
+        entry = await self._get_entry(storage_key)
+        entry.data = dict(data)
+        self._mark_dirty(storage_key, entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        entry = await self._get_entry(self._key_builder.build(key))
+        return dict(entry.data)
+
+    async def close(self) -> None:
+        """Сбросить все незаписанные изменения и остановить фоновую задачу"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+
+        await self._flush()
+        logger.info("DatabaseStorage закрыт, изменения FSM сохранены")
+
+    # ------------------------------------------------------------------
+    # Кэш и загрузка
+    # ------------------------------------------------------------------
+
+    async def _get_entry(self, storage_key: str) -> _Entry:
+        """Получить запись из кэша или загрузить из БД (single-flight)"""
+        entry = self._cache.get(storage_key)
+        if entry is not None:
+            if entry.expires_at and entry.expires_at <= datetime.now(timezone.utc):
+                entry.state, entry.data, entry.expires_at = None, {}, None
+            entry.touched = time.monotonic()
+            return entry
+
+        pending = self._loading.get(storage_key)
+        if pending is not None:
+            return await pending
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[storage_key] = future
+        try:
+            entry = await self._load(storage_key)
+            self._cache[storage_key] = entry
+            future.set_result(entry)
+            return entry
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже получит вызывающий, не логируем "never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._loading.pop(storage_key, None)
+
+    async def _load(self, storage_key: str) -> _Entry:
+        async with self._session_factory() as session:
+            result = await session.execute(
+                select(FSMRecord.state, FSMRecord.data, FSMRecord.expires_at)
+                .where(FSMRecord.key == storage_key)
+            )
+            row = result.one_or_none()
+
+        if row is None or (row.expires_at and row.expires_at <= datetime.now(timezone.utc)):
+            return _Entry()
+
+        return _Entry(state=row.state, data=deserialize_data(row.data), expires_at=row.expires_at)
+
+    def _mark_dirty(self, storage_key: str, entry: _Entry) -> None:
+        if self._ttl:
+            entry.expires_at = datetime.now(timezone.utc) + timedelta(seconds=self._ttl)
+        self._dirty.add(storage_key)
+        self._ensure_flush_task()
+        self._flush_event.set()
+
+    # ------------------------------------------------------------------
+    # Фоновая запись
+    # ------------------------------------------------------------------
+
+    def _ensure_flush_task(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_event = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_loop(), name="fsm-storage-flush")
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self._cache_idle_ttl)
+            except asyncio.TimeoutError:
+                pass
+
+            # Даем хендлеру сделать остальные update_data до записи
+            await asyncio.sleep(self._flush_delay)
+            self._flush_event.clear()
+
+            try:
+                await self._flush()
+                self._evict_idle()
+                await self._purge_expired()
+            except Exception:
+                logger.error("Ошибка записи FSM в БД, повторим позже", exc_info=True)
+                await asyncio.sleep(1)
+                self._flush_event.set()
+
+    async def _flush(self) -> None:
+        """Записать все измененные ключи одним multi-row UPSERT"""
+        if not self._dirty:
+            return
+
+        keys, self._dirty = self._dirty, set()
+        try:
+            upserts, deletes = self._build_flush_rows(keys)
+            async with self._session_factory() as session:
+                if upserts:
+                    stmt = pg_insert(FSMRecord).values(upserts)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[FSMRecord.key],
+                        set_={
+                            'state': stmt.excluded.state,
+                            'data': stmt.excluded.data,
+                            'expires_at': stmt.excluded.expires_at,
+                            'updated_at': datetime.now(timezone.utc)
+                        }
+                    )
+                    await session.execute(stmt)
+                if deletes:
+                    await session.execute(delete(FSMRecord).where(FSMRecord.key.in_(deletes)))
+                await session.commit()
+        except Exception:
+            # Возвращаем ключи в очередь записи
+            self._dirty |= keys
+            raise
+
+        logger.debug(f"FSM flush: {len(upserts)} upsert, {len(deletes)} delete")
+
+    def _build_flush_rows(self, keys) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Строки для UPSERT и ключи для DELETE (ключ с несериализуемыми данными пропускается)"""
+        upserts = []
+        deletes = []
+        for storage_key in keys:
+            entry = self._cache.get(storage_key)
+            if entry is None:
+                continue
+            if entry.state is None and not entry.data:
+                deletes.append(storage_key)
+            else:
+                # Несериализуемые данные одного ключа не должны терять запись остальных
+                try:
+                    data = serialize_data(entry.data)
+                except Exception:
+                    logger.error(f"FSM: данные ключа {storage_key} не сериализуются, запись пропущена", exc_info=True)
+                    continue
+                upserts.append({
+                    'key': storage_key,
+                    'state': entry.state,
+                    'data': data,
+                    'expires_at': entry.expires_at
+                })
+        return upserts, deletes
+
+    def _evict_idle(self) -> None:
+        """Выгрузить из кэша давно неиспользуемые и уже записанные ключи"""
+        deadline = time.monotonic() - self._cache_idle_ttl
+        idle = [
+            storage_key for storage_key, entry in self._cache.items()
+            if entry.touched < deadline and storage_key not in self._dirty
+        ]
+        for storage_key in idle:
+            del self._cache[storage_key]
+
+    async def _purge_expired(self) -> None:
+        """Удалить истекшие строки из БД (не чаще purge_interval)"""
+        if time.monotonic() - self._last_purge < self._purge_interval:
+            return
+        self._last_purge = time.monotonic()
+
+        async with self._session_factory() as session:
+            result = await session.execute(
+                delete(FSMRecord).where(FSMRecord.expires_at < datetime.now(timezone.utc))
+            )
+            await session.commit()
+
+        if result.rowcount:
+            logger.info(f"FSM storage: удалено {result.rowcount} истекших ключей")
+
+
+def create_fsm_storage() -> BaseStorage:
+    """
+    Создать FSM хранилище по настройкам .env.
+
+    FSM_STORAGE: database (по умолчанию) или memory
+    FSM_TTL: время жизни ключа в секундах (0 — бессрочно)
+    """
+    backend = os.getenv('FSM_STORAGE', 'database')
+
+    if backend == 'memory':
+        logger.info("FSM storage: MemoryStorage")
+        return MemoryStorage()
+
+    ttl = int(os.getenv('FSM_TTL', str(7 * 24 * 3600)))
+    logger.info(f"FSM storage: DatabaseStorage (ttl={ttl or 'нет'})")
+    return DatabaseStorage(ttl=ttl or None)
@@ -40,6 +40,7 @@ class HTTPClientManager:
         Получить shared ClientSession для OpenAI API.
         
         Переиспользует одно соединение для всех запросов к OpenAI.
+        Сервисы используют ее через bot.utils.openai_gateway.OpenAIGateway.
         """
         if cls._openai_session is None or cls._openai_session.closed:
             api_key = os.getenv("OPEN_AI_API_KEY")
@@ -61,13 +62,12 @@ class HTTPClientManager:
                 ttl_dns_cache=300       # Кэш DNS на 5 минут
             )
             
+            # Content-Type не задаем: aiohttp ставит его сам
+            # (application/json для json=, multipart/form-data для транскрипций)
             cls._openai_session = aiohttp.ClientSession(
                 connector=connector,
                 timeout=timeout,
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json"
-                }
+                headers={"Authorization": f"Bearer {api_key}"}
             )
             
             logger.info("OpenAI ClientSession created and cached")
@@ -0,0 +1,103 @@
+"""
+Поиск множества ключевых слов в тексте за один проход (автомат Ахо–Корасик).
+
+Вместо вложенных циклов `any(word in text for word in words)` по каждой группе слов
+автомат строится один раз, а текст читается один раз, сколько бы ни было ключевых слов.
+
+Правила:
+- Сравнение без учета регистра, лишние пробелы в тексте не мешают ("как  работает")
+- Ключевое слово ищется как подстрока (как `word in text`): "сколько зарабат" найдет
+  и "сколько зарабатывают"
+- У одного ключевого слова может быть несколько значений (тем, записей базы знаний)
+"""
+
+from collections import deque
+from typing import Any, Dict, Hashable, Iterable, List, Set, Tuple
+
+
+def normalize_keyword_text(text: str) -> str:
+    """Нормализация текста и ключевых слов: регистр и лишние пробелы не важны"""
+    return ' '.join(text.casefold().split())
+
+
+class KeywordMatcher:
+    """Автомат Ахо–Корасик над набором ключевых слов"""
+
+    def __init__(self, keywords: Iterable[Tuple[str, Hashable]]):
+        """
+        Args:
+            keywords: Пары (ключевое слово, значение), слово может повторяться с разными значениями
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Set[int]] = [set()]
+        self._values: List[Set[Hashable]] = []
+        keyword_ids: Dict[str, int] = {}
+
+        for keyword, value in keywords:
+            keyword = normalize_keyword_text(keyword)
+            if not keyword:
+                continue
+
+            keyword_id = keyword_ids.get(keyword)
+            if keyword_id is None:
+                keyword_id = keyword_ids[keyword] = len(self._values)
+                self._values.append(set())
+                self._output[self._insert(keyword)].add(keyword_id)
+            self._values[keyword_id].add(value)
+
+        self._build_failure_links()
+
+    def _insert(self, keyword: str) -> int:
+        node = 0
+        for char in keyword:
+            child = self._goto[node].get(char)
+            if child is None:
+                child = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+                self._goto[node][char] = child
+            node = child
+        return node
+
+    def _build_failure_links(self) -> None:
+        # Обход в ширину: у узлов первого уровня переход по неудаче — в корень
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+
+                # Слова, которые заканчиваются в суффиксе, тоже найдены
+                self._output[child] |= self._output[self._fail[child]]
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def match(self, text: str) -> Dict[Any, int]:
+        """
+        Найти ключевые слова в тексте.
+
+        Returns:
+            Значение → сколько разных его ключевых слов найдено
+        """
+        found: Set[int] = set()
+        node = 0
+        for char in normalize_keyword_text(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            if self._output[node]:
+                found |= self._output[node]
+
+        counts: Dict[Any, int] = {}
+        for keyword_id in found:
+            for value in self._values[keyword_id]:
+                counts[value] = counts.get(value, 0) + 1
+        return counts
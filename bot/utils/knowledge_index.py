@@ -0,0 +1,169 @@
+"""
+In-memory индекс базы знаний тренажера (knowledge_base).
+
+Правила:
+- Все записи knowledge_base держим в памяти, по их keywords строится KeywordMatcher
+- Запись релевантна, если в сообщении найдено ее ключевое слово или ее категория
+  совпадает с темой сообщения; сортировка — по priority, затем по числу найденных слов
+- Не чаще check_interval сверяем сигнатуру таблицы (count, max(updated_at), max(created_at))
+  и перестраиваем индекс, только если она изменилась
+- Дополнительно по вопросу, ответу и keywords строится BM25-индекс (bm25_search)
+- Поиск после загрузки — без запросов к БД (кроме редкой сверки)
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.database.models import KnowledgeBase
+from bot.utils.bm25 import BM25Index
+from bot.utils.keyword_matcher import KeywordMatcher
+
+logger = logging.getLogger(__name__)
+
+
+class _Snapshot(NamedTuple):
+    signature: Tuple[Any, ...]
+    entries: List[Dict[str, Any]]
+    matcher: KeywordMatcher
+    by_category: Dict[str, List[int]]
+    bm25: BM25Index
+
+
+class KnowledgeIndex:
+    """Индекс knowledge_base с поиском по ключевым словам и категориям"""
+
+    def __init__(self, check_interval: float = 60.0):
+        """
+        Args:
+            check_interval: Как часто сверять индекс с таблицей (сек)
+        """
+        self._check_interval = check_interval
+        self._snapshot: Optional[_Snapshot] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+        # Счетчики для мониторинга
+        self._searches = 0
+        self._rebuilds = 0
+
+    async def search(
+        self,
+        session: AsyncSession,
+        text: Optional[str],
+        categories: Sequence[str] = (),
+        limit: int = 5
+    ) -> List[Dict[str, Any]]:
+        """
+        Записи базы знаний, релевантные сообщению.
+
+        Args:
+            session: Сессия БД (только для сверки с таблицей)
+            text: Текст сообщения (поиск по keywords)
+            categories: Категории тем сообщения
+            limit: Максимум записей
+
+        Returns:
+            Список {category, question, answer, priority, source_doc}
+        """
+        snapshot = await self._fresh_snapshot(session)
+        self._searches += 1
+
+        hits = snapshot.matcher.match(text) if text else {}
+        for category in categories:
+            for i in snapshot.by_category.get(category, ()):
+                hits.setdefault(i, 0)
+
+        ranked = sorted(hits, key=lambda i: (-snapshot.entries[i]['priority'], -hits[i]))
+        return [snapshot.entries[i] for i in ranked[:limit]]
+
+    async def bm25_search(self, session: AsyncSession, text: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Записи базы знаний по BM25 (вопрос, ответ и keywords), от лучшей к худшей"""
+        snapshot = await self._fresh_snapshot(session)
+        return [snapshot.entries[i] for i, _ in snapshot.bm25.search(text, limit)]
+
+    async def _fresh_snapshot(self, session: AsyncSession) -> _Snapshot:
+        if self._snapshot is not None and time.monotonic() - self._checked_at < self._check_interval:
+            return self._snapshot
+
+        async with self._lock:
+            # Пока ждали блокировку, индекс мог обновить другой запрос
+            if self._snapshot is not None and time.monotonic() - self._checked_at < self._check_interval:
+                return self._snapshot
+
+            # Savepoint: ошибка сверки не должна ломать транзакцию хендлера
+            async with session.begin_nested():
+                signature = tuple((await session.execute(
+                    select(
+                        func.count(KnowledgeBase.id),
+                        func.max(KnowledgeBase.updated_at),
+                        func.max(KnowledgeBase.created_at)
+                    )
+                )).one())
+
+                if self._snapshot is None or self._snapshot.signature != signature:
+                    rows = (await session.execute(select(KnowledgeBase))).scalars().all()
+                    self._snapshot = self._build(signature, rows)
+                    self._rebuilds += 1
+                    logger.info(
+                        f"Knowledge index перестроен: {len(rows)} записей, "
+                        f"{len(self._snapshot.matcher)} ключевых слов"
+                    )
+
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    @staticmethod
+    def _build(signature: Tuple[Any, ...], rows: Sequence[KnowledgeBase]) -> _Snapshot:
+        entries = []
+        keywords = []
+        texts = []
+        by_category: Dict[str, List[int]] = {}
+
+        for i, row in enumerate(rows):
+            entries.append({
+                'category': row.category,
+                'question': row.question,
+                'answer': row.answer,
+                'priority': row.priority or 0,
+                'source_doc': row.source_doc
+            })
+            by_category.setdefault(row.category, []).append(i)
+
+            row_keywords = [keyword for keyword in row.keywords or [] if isinstance(keyword, str)]
+            keywords.extend((keyword, i) for keyword in row_keywords)
+            texts.append(' '.join([row.question, row.answer, *row_keywords]))
+
+        return _Snapshot(signature, entries, KeywordMatcher(keywords), by_category, BM25Index(texts))
+
+    def invalidate(self) -> None:
+        """Сверить индекс с таблицей при следующем поиске (после изменения knowledge_base)"""
+        self._checked_at = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика индекса"""
+        snapshot = self._snapshot
+        return {
+            'entries': len(snapshot.entries) if snapshot is not None else 0,
+            'keywords': len(snapshot.matcher) if snapshot is not None else 0,
+            'searches': self._searches,
+            'rebuilds': self._rebuilds
+        }
+
+
+# Singleton инстанс
+_knowledge_index_instance: Optional[KnowledgeIndex] = None
+
+
+def get_knowledge_index() -> KnowledgeIndex:
+    """Получить singleton инстанс индекса базы знаний"""
+    global _knowledge_index_instance
+
+    if _knowledge_index_instance is None:
+        _knowledge_index_instance = KnowledgeIndex()
+
+    return _knowledge_index_instance
@@ -0,0 +1,58 @@
+"""
+Content-addressed кэш ответов LLM.
+
+Для детерминированных (низкотемпературных) промптов одинаковый запрос дает
+практически одинаковый ответ, поэтому ответ можно переиспользовать.
+
+Правила:
+- Кэш opt-in: используется только при явном cache_ttl в OpenAIGateway.chat_completion
+- Ключ — sha256 от (model, messages, параметры генерации)
+- Два слоя (PersistentCache): TTLCache в памяти и таблица llm_response_cache в Postgres;
+  параллельные одинаковые запросы схлопываются в один вызов API
+- Пустые и слишком длинные ответы в таблицу не сохраняются
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+from bot.database.models import LLMCacheEntry
+from bot.utils.cache import llm_response_cache
+from bot.utils.persistent_cache import PersistentCache
+
+# Ответы длиннее этого порога не кэшируем (это уже не "короткие детерминированные" ответы)
+MAX_CACHED_RESPONSE = 32 * 1024
+
+
+def llm_cache_key(model: str, messages: List[Dict[str, str]], **params: Any) -> str:
+    """Ключ кэша: sha256 от модели, сообщений и параметров генерации"""
+    payload = json.dumps(
+        {'model': model, 'messages': messages, 'params': params},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(',', ':')
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# Singleton инстанс
+_llm_response_cache_instance: Optional[PersistentCache] = None
+
+
+def get_llm_response_cache() -> PersistentCache:
+    """Получить singleton инстанс кэша ответов LLM (ключ — llm_cache_key, TTL задается при вызове)"""
+    global _llm_response_cache_instance
+
+    if _llm_response_cache_instance is None:
+        _llm_response_cache_instance = PersistentCache(
+            name="LLM",
+            table=LLMCacheEntry,
+            memory=llm_response_cache,
+            key_columns=['key'],
+            value_column='response',
+            ttl=24 * 3600,  # OpenAIGateway всегда передает свой cache_ttl
+            expires_column='expires_at',
+            cacheable=lambda response: bool(response) and len(response) <= MAX_CACHED_RESPONSE
+        )
+
+    return _llm_response_cache_instance
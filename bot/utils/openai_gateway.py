@@ -0,0 +1,415 @@
+"""
+OpenAI Gateway — единая точка доступа к OpenAI API.
+
+Правила:
+- Все сервисы ходят в OpenAI только через OpenAIGateway
+- Соединения переиспользуются (shared ClientSession из HTTPClientManager, keep-alive)
+- У каждого эндпоинта свой таймаут (чат генерирует дольше, чем embeddings)
+- Ошибки приводятся к единым типам: OpenAIAPIError / OpenAITimeoutError / OpenAIError
+- Каждый запрос проходит через RateGovernor (лимиты по провайдеру, модели и токенам в минуту)
+- Временные ошибки повторяются с backoff, у каждого эндпоинта свой circuit breaker
+  (см. bot.utils.resilience)
+- Ответы детерминированных промптов можно кэшировать (cache_ttl, см. bot.utils.llm_cache)
+"""
+
+import asyncio
+import json as jsonlib
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, BinaryIO, Callable, Dict, List, Literal, Optional, Union
+
+import aiohttp
+
+from bot.utils.http_client import HTTPClientManager
+from bot.utils.llm_cache import get_llm_response_cache, llm_cache_key
+from bot.utils.rate_limiter import get_rate_governor
+from bot.utils.resilience import (
+    RetryPolicy,
+    call_with_retry,
+    get_circuit_breaker,
+    is_retryable,
+    parse_retry_after,
+    record_outcome
+)
+
+logger = logging.getLogger(__name__)
+
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1').rstrip('/')
+
+# Таймауты по эндпоинтам (сек)
+ENDPOINT_TIMEOUTS: Dict[str, aiohttp.ClientTimeout] = {
+    'chat': aiohttp.ClientTimeout(total=90, connect=10, sock_read=60),
+    # При стриминге чанки идут часто, долгая пауза между ними — признак зависания
+    'chat_stream': aiohttp.ClientTimeout(total=120, connect=10, sock_read=30),
+    'embeddings': aiohttp.ClientTimeout(total=20, connect=10, sock_read=15),
+    'transcription': aiohttp.ClientTimeout(total=120, connect=10, sock_read=90),
+}
+
+# Политика повторов: укладываемся в разумное время ожидания пользователя
+RETRY_POLICY = RetryPolicy(attempts=3, base_delay=0.5, max_delay=8.0, deadline=45.0)
+
+
+class OpenAIError(Exception):
+    """Базовая ошибка обращения к OpenAI (сеть, неожиданный ответ)"""
+
+
+class OpenAIAPIError(OpenAIError):
+    """OpenAI ответил не-2xx статусом"""
+
+    def __init__(self, status: int, body: str, endpoint: str, retry_after: Optional[float] = None):
+        self.status = status
+        self.body = body
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+        super().__init__(f"OpenAI {endpoint} error {status}: {body[:500]}")
+
+
+class OpenAITimeoutError(OpenAIError):
+    """Запрос к OpenAI не уложился в таймаут эндпоинта"""
+    retryable = True
+    is_timeout = True
+
+
+class OpenAIConnectionError(OpenAIError):
+    """Сетевая ошибка при обращении к OpenAI"""
+    retryable = True
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка количества токенов (для бюджета TPM точности достаточно)"""
+    return len(text) // 3 + 1
+
+
+class OpenAIGateway:
+    """Клиент OpenAI API поверх shared ClientSession"""
+
+    @classmethod
+    @asynccontextmanager
+    async def _request(
+        cls,
+        endpoint: str,
+        path: str,
+        json: Optional[Dict[str, Any]] = None,
+        data: Optional[aiohttp.FormData] = None,
+        model: Optional[str] = None,
+        tokens: int = 0
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        Выполнить POST запрос к OpenAI и отдать успешный ответ.
+
+        Args:
+            model: Модель (для лимитов RateGovernor)
+            tokens: Оценка токенов запроса (для бюджета TPM)
+
+        Raises:
+            OpenAIAPIError: не-2xx ответ
+            OpenAITimeoutError: превышен таймаут эндпоинта
+            OpenAIError: сетевая ошибка
+            RateLimitExceeded: не дождались слота в RateGovernor
+        """
+        session = await HTTPClientManager.get_openai_session()
+
+        try:
+            async with get_rate_governor().slot('openai', model, tokens=tokens), session.post(
+                f"{OPENAI_BASE_URL}{path}",
+                json=json,
+                data=data,
+                timeout=ENDPOINT_TIMEOUTS[endpoint]
+            ) as response:
+                if response.status != 200:
+                    body = await response.text()
+                    logger.error(
+                        "OpenAI API error",
+                        extra={"endpoint": endpoint, "status": response.status, "error": body[:500]}
+                    )
+                    raise OpenAIAPIError(
+                        response.status, body, endpoint,
+                        retry_after=cls._retry_after(response)
+                    )
+
+                yield response
+        except asyncio.TimeoutError as e:
+            raise OpenAITimeoutError(f"OpenAI {endpoint} timeout") from e
+        except aiohttp.ClientError as e:
+            raise OpenAIConnectionError(f"OpenAI {endpoint} connection error: {e}") from e
+
+    @staticmethod
+    def _retry_after(response: aiohttp.ClientResponse) -> Optional[float]:
+        """Пауза, которую просит OpenAI (retry-after-ms точнее, чем Retry-After)"""
+        retry_after_ms = response.headers.get('retry-after-ms')
+        if retry_after_ms:
+            try:
+                return float(retry_after_ms) / 1000
+            except ValueError:
+                pass
+        return parse_retry_after(response.headers.get('Retry-After'))
+
+    @staticmethod
+    def _breaker_name(endpoint: str) -> str:
+        # Стриминг и обычный чат — один и тот же эндпоинт провайдера
+        return f"openai:{endpoint.replace('_stream', '')}"
+
+    @classmethod
+    async def _post(
+        cls,
+        endpoint: str,
+        path: str,
+        json: Optional[Dict[str, Any]] = None,
+        form_factory: Optional[Callable[[], aiohttp.FormData]] = None,
+        model: Optional[str] = None,
+        tokens: int = 0,
+        expect_json: bool = True
+    ) -> Any:
+        """
+        Выполнить POST запрос к OpenAI (с повторами) и прочитать ответ целиком.
+
+        Args:
+            form_factory: Фабрика multipart-формы: FormData нельзя отправить повторно,
+                поэтому на каждую попытку собирается новая
+        """
+        async def attempt() -> Any:
+            data = form_factory() if form_factory else None
+            async with cls._request(
+                endpoint, path, json=json, data=data, model=model, tokens=tokens
+            ) as response:
+                if expect_json:
+                    return await response.json()
+                return await response.text()
+
+        return await call_with_retry(
+            attempt,
+            breaker=get_circuit_breaker(cls._breaker_name(endpoint)),
+            policy=RETRY_POLICY
+        )
+
+    @staticmethod
+    def _chat_payload(
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float,
+        max_tokens: Optional[int],
+        response_format: Literal['text', 'json'] = 'text'
+    ) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {
+            'model': model,
+            'messages': messages,
+            'temperature': temperature
+        }
+        if max_tokens is not None:
+            payload['max_tokens'] = max_tokens
+        if response_format == 'json':
+            payload['response_format'] = {'type': 'json_object'}
+        return payload
+
+    @staticmethod
+    def _chat_tokens(payload: Dict[str, Any]) -> int:
+        """Оценка токенов chat-запроса: промпт + максимум ответа"""
+        prompt = sum(estimate_tokens(message.get('content') or '') for message in payload['messages'])
+        return prompt + (payload.get('max_tokens') or 1000)
+
+    @classmethod
+    async def chat_completion(
+        cls,
+        messages: List[Dict[str, str]],
+        model: str = 'gpt-4o-mini',
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        response_format: Literal['text', 'json'] = 'text',
+        cache_ttl: Optional[int] = None
+    ) -> str:
+        """
+        Chat Completions API.
+
+        Args:
+            messages: Сообщения [{"role": ..., "content": ...}]
+            model: Модель
+            temperature: Температура
+            max_tokens: Ограничение длины ответа (None — по умолчанию модели)
+            response_format: 'json' включает JSON mode
+            cache_ttl: Если задан, ответ кэшируется по хэшу запроса на cache_ttl секунд
+                (только для детерминированных, низкотемпературных промптов)
+
+        Returns:
+            str: Текст ответа модели
+        """
+        payload = cls._chat_payload(messages, model, temperature, max_tokens, response_format)
+
+        async def compute() -> str:
+            result = await cls._post(
+                'chat', '/chat/completions', json=payload,
+                model=model, tokens=cls._chat_tokens(payload)
+            )
+
+            try:
+                content = result['choices'][0]['message']['content']
+            except (KeyError, IndexError, TypeError) as e:
+                raise OpenAIError(f"Неожиданный ответ chat completions: {result}") from e
+
+            usage = result.get('usage') or {}
+            logger.info(f"OpenAI chat completion: model={model}, tokens={usage.get('total_tokens')}")
+
+            return content or ''
+
+        if not cache_ttl:
+            return await compute()
+
+        key = llm_cache_key(
+            model, messages,
+            temperature=temperature, max_tokens=max_tokens, response_format=response_format
+        )
+        return await get_llm_response_cache().get_or_load(key, compute, ttl=cache_ttl, model=model)
+
+    @classmethod
+    async def chat_completion_stream(
+        cls,
+        messages: List[Dict[str, str]],
+        model: str = 'gpt-4o-mini',
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        """
+        Chat Completions API в режиме стриминга (Server-Sent Events).
+
+        Yields:
+            str: Очередной фрагмент текста ответа
+        """
+        payload = cls._chat_payload(messages, model, temperature, max_tokens)
+        payload['stream'] = True
+
+        breaker = get_circuit_breaker(cls._breaker_name('chat_stream'))
+        started = time.monotonic()
+        attempt = 0
+
+        # Повторяем только до первого полученного фрагмента:
+        # то, что уже показано пользователю, не переигрываем
+        while True:
+            breaker.before_call()
+            yielded = False
+            try:
+                async with cls._request(
+                    'chat_stream', '/chat/completions', json=payload,
+                    model=model, tokens=cls._chat_tokens(payload)
+                ) as response:
+                    async for delta in cls._iter_stream(response):
+                        yielded = True
+                        yield delta
+            except BaseException as exc:
+                record_outcome(breaker, exc)
+                if isinstance(exc, (asyncio.CancelledError, GeneratorExit)) or yielded:
+                    raise
+
+                attempt += 1
+                if attempt >= RETRY_POLICY.attempts or not is_retryable(exc):
+                    raise
+
+                delay = RETRY_POLICY.delay(attempt - 1, exc)
+                if time.monotonic() - started + delay > RETRY_POLICY.deadline:
+                    raise
+
+                logger.warning(f"Повтор стрима OpenAI через {delay:.1f}s: {exc}")
+                await asyncio.sleep(delay)
+                continue
+
+            record_outcome(breaker, None)
+            return
+
+    @staticmethod
+    async def _iter_stream(response: aiohttp.ClientResponse) -> AsyncIterator[str]:
+        """Разобрать Server-Sent Events ответа chat completions"""
+        async for raw_line in response.content:
+            line = raw_line.decode('utf-8').strip()
+            if not line.startswith('data:'):
+                continue
+
+            data = line[5:].strip()
+            if data == '[DONE]':
+                break
+
+            try:
+                chunk = jsonlib.loads(data)
+            except ValueError:
+                logger.warning(f"Некорректный чанк стрима OpenAI: {data[:200]}")
+                continue
+
+            choices = chunk.get('choices') or []
+            if not choices:
+                continue
+
+            delta = (choices[0].get('delta') or {}).get('content')
+            if delta:
+                yield delta
+
+    @classmethod
+    async def embeddings(
+        cls,
+        inputs: Union[str, List[str]],
+        model: str = 'text-embedding-ada-002'
+    ) -> List[List[float]]:
+        """
+        Embeddings API.
+
+        Args:
+            inputs: Текст или список текстов
+            model: Модель embeddings
+
+        Returns:
+            Список векторов в порядке входных текстов
+        """
+        texts = [inputs] if isinstance(inputs, str) else inputs
+        result = await cls._post(
+            'embeddings', '/embeddings', json={'input': inputs, 'model': model},
+            model=model, tokens=sum(estimate_tokens(text) for text in texts)
+        )
+
+        try:
+            items = sorted(result['data'], key=lambda item: item['index'])
+            return [item['embedding'] for item in items]
+        except (KeyError, TypeError) as e:
+            raise OpenAIError(f"Неожиданный ответ embeddings: {result}") from e
+
+    @classmethod
+    async def transcription(
+        cls,
+        audio: Union[bytes, BinaryIO],
+        filename: str = 'audio.ogg',
+        model: str = 'gpt-4o-mini-transcribe',
+        language: Optional[str] = 'ru'
+    ) -> str:
+        """
+        Audio Transcriptions API.
+
+        Args:
+            audio: Содержимое файла (bytes или открытый файл)
+            filename: Имя файла (по расширению API определяет формат)
+            model: Модель транскрипции
+            language: Язык аудио (None — автоопределение)
+
+        Returns:
+            str: Распознанный текст
+        """
+        # aiohttp (до 3.12) закрывает файловый payload после отправки, поэтому повторная
+        # попытка не может перечитать тот же файл. Читаем аудио один раз (для API оно ≤ 25 МБ)
+        # и собираем каждую форму из bytes
+        if isinstance(audio, (bytes, bytearray)):
+            content = bytes(audio)
+        elif hasattr(audio, 'getvalue'):
+            content = audio.getvalue()
+        else:
+            content = await asyncio.to_thread(audio.read)
+
+        def build_form() -> aiohttp.FormData:
+            form = aiohttp.FormData()
+            form.add_field('file', content, filename=filename)
+            form.add_field('model', model)
+            form.add_field('response_format', 'text')
+            if language:
+                form.add_field('language', language)
+            return form
+
+        text = await cls._post(
+            'transcription', '/audio/transcriptions', form_factory=build_form,
+            model=model, expect_json=False
+        )
+        return text.strip()
@@ -0,0 +1,188 @@
+"""
+Двухуровневый кэш: TTLCache в памяти + таблица в Postgres (переживает рестарты).
+
+Общая основа кэшей ответов LLM, транскрипций и embeddings.
+
+Правила:
+- Сначала память, затем таблица, затем вычисление; найденное в таблице поднимается в память
+- Параллельные промахи одного ключа схлопываются в одно вычисление (single-flight)
+- Срок жизни строки в таблице — по колонке expires_at (TTL задается на запись)
+  или по created_at (один TTL на весь кэш)
+- None не кэшируется; что сохранять в таблицу, дополнительно решает cacheable
+- Ошибки БД не ломают вызов: слой таблицы просто пропускается
+- Кэш работает в своей сессии и сам делает commit (это не данные хендлера)
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from bot.database.database import AsyncSessionLocal
+from bot.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class PersistentCache:
+    """Кэш значений с передним слоем в памяти и персистентным слоем в таблице"""
+
+    def __init__(
+        self,
+        name: str,
+        table: Any,
+        memory: TTLCache,
+        key_columns: Sequence[str],
+        value_column: str,
+        ttl: int,
+        expires_column: Optional[str] = None,
+        created_column: str = 'created_at',
+        cacheable: Optional[Callable[[Any], bool]] = None,
+        encode: Optional[Callable[[Any], Any]] = None,
+        decode: Optional[Callable[[Any], Any]] = None,
+        session_factory=AsyncSessionLocal,
+        purge_interval: int = 3600
+    ):
+        """
+        Args:
+            name: Имя кэша (для логов)
+            table: ORM-модель таблицы
+            memory: Передний in-memory кэш
+            key_columns: Колонки первичного ключа (в порядке значений ключа)
+            value_column: Колонка со значением
+            ttl: Время хранения в таблице по умолчанию (сек)
+            expires_column: Колонка срока годности (если нет — срок считается от created_column)
+            created_column: Колонка времени записи
+            cacheable: Сохранять ли значение в таблицу (по умолчанию — любое, кроме None)
+            encode: Значение → содержимое колонки
+            decode: Содержимое колонки → значение
+            session_factory: Фабрика сессий БД
+            purge_interval: Как часто удалять устаревшие строки из таблицы (сек)
+        """
+        self._name = name
+        self._table = table
+        self._memory = memory
+        self._key_columns = [getattr(table, column) for column in key_columns]
+        self._value_column = getattr(table, value_column)
+        self._ttl = ttl
+        self._expires_column = getattr(table, expires_column) if expires_column else None
+        self._created_column = getattr(table, created_column)
+        self._cacheable = cacheable
+        self._encode = encode
+        self._decode = decode
+        self._session_factory = session_factory
+        self._purge_interval = purge_interval
+        self._last_purge = time.monotonic()
+
+        # Счетчики для мониторинга
+        self._db_hits = 0
+        self._computed = 0
+
+    async def get_or_load(
+        self,
+        key: Any,
+        compute: Callable[[], Awaitable[Any]],
+        ttl: Optional[int] = None,
+        **columns: Any
+    ) -> Any:
+        """
+        Получить значение из кэша или вычислить его.
+
+        Args:
+            key: Значение ключа (кортеж, если ключевых колонок несколько)
+            compute: Вычисление при промахе обоих слоев
+            ttl: Время жизни значения (сек), по умолчанию — TTL кэша
+            **columns: Прочие колонки строки (например, model)
+        """
+        key = key if isinstance(key, tuple) else (key,)
+        db_ttl = ttl if ttl is not None else self._ttl
+
+        async def load() -> Any:
+            cached = await self._db_get(key)
+            if cached is not None:
+                self._db_hits += 1
+                return cached
+
+            value = await compute()
+            self._computed += 1
+            if value is not None and (self._cacheable is None or self._cacheable(value)):
+                await self._db_put(key, value, db_ttl, columns)
+            return value
+
+        memory_key = ':'.join(str(part) for part in key)
+        return await self._memory.get_or_load(memory_key, load, ttl=ttl)
+
+    def _key_clause(self, key: Tuple[Any, ...]):
+        return and_(*(column == value for column, value in zip(self._key_columns, key)))
+
+    def _expired_clause(self, now: datetime):
+        if self._expires_column is not None:
+            return self._expires_column <= now
+        return self._created_column <= now - timedelta(seconds=self._ttl)
+
+    async def _db_get(self, key: Tuple[Any, ...]) -> Any:
+        now = datetime.now(timezone.utc)
+        try:
+            async with self._session_factory() as session:
+                result = await session.execute(
+                    select(self._value_column).where(self._key_clause(key), ~self._expired_clause(now))
+                )
+                data = result.scalar_one_or_none()
+        except Exception as e:
+            logger.warning(f"{self._name} cache: не удалось прочитать из БД: {e}")
+            return None
+
+        if data is None or self._decode is None:
+            return data
+        return self._decode(data)
+
+    async def _db_put(self, key: Tuple[Any, ...], value: Any, ttl: int, columns: Dict[str, Any]) -> None:
+        now = datetime.now(timezone.utc)
+        values = {column.key: part for column, part in zip(self._key_columns, key)}
+        values.update(columns)
+        values[self._value_column.key] = self._encode(value) if self._encode else value
+
+        if self._expires_column is not None:
+            values[self._expires_column.key] = now + timedelta(seconds=ttl)
+        else:
+            values[self._created_column.key] = now
+
+        try:
+            async with self._session_factory() as session:
+                stmt = pg_insert(self._table).values(**values)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=self._key_columns,
+                    set_={
+                        name: stmt.excluded[name]
+                        for name in values
+                        if name not in {column.key for column in self._key_columns}
+                    }
+                )
+                await session.execute(stmt)
+                await self._purge_expired(session)
+                await session.commit()
+        except Exception as e:
+            logger.warning(f"{self._name} cache: не удалось сохранить в БД: {e}")
+
+    async def _purge_expired(self, session) -> None:
+        """Удалить устаревшие строки (не чаще purge_interval)"""
+        if time.monotonic() - self._last_purge < self._purge_interval:
+            return
+        self._last_purge = time.monotonic()
+
+        result = await session.execute(
+            delete(self._table).where(self._expired_clause(datetime.now(timezone.utc)))
+        )
+        if result.rowcount:
+            logger.info(f"{self._name} cache: удалено {result.rowcount} устаревших записей")
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика кэша"""
+        return {
+            'memory': self._memory.stats(),
+            'db_hits': self._db_hits,
+            'computed': self._computed
+        }
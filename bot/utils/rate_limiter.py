@@ -0,0 +1,325 @@
+"""
+Rate Governor для исходящих AI-вызовов (OpenAI, Fal.ai).
+
+Правила:
+- Лимиты задаются на провайдера ("openai") и на модель ("openai:gpt-4o")
+- Лимит = максимум одновременных запросов + (опционально) бюджет токенов в минуту
+- Ожидающие слота обслуживаются по кругу по пользователям: один пользователь
+  с пачкой запросов не блокирует остальных
+- Ожидание ограничено max_wait: при перегрузке вызов получает RateLimitExceeded,
+  а не висит бесконечно
+
+Пользователь берется из current_user_id (выставляет UserLaneMiddleware).
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Telegram ID пользователя, в контексте которого выполняется вызов
+current_user_id: ContextVar[Optional[int]] = ContextVar('current_user_id', default=None)
+
+
+class RateLimitExceeded(Exception):
+    """Не дождались слота у провайдера за max_wait"""
+
+
+@dataclass(frozen=True)
+class Limit:
+    """Лимит для провайдера или модели"""
+    concurrency: int
+    tokens_per_minute: Optional[int] = None
+
+
+class FairSemaphore:
+    """
+    Семафор с честной очередью: ожидающие обслуживаются по кругу по владельцам.
+    """
+
+    def __init__(self, limit: int):
+        self._limit = limit
+        self._active = 0
+        self._waiters: "OrderedDict[Any, Deque[asyncio.Future]]" = OrderedDict()
+        self.queued_total = 0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+
+    async def acquire(self, owner: Any) -> None:
+        if self._active < self._limit and not self._waiters:
+            self._active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(owner, deque()).append(future)
+        self.queued_total += 1
+
+        try:
+            await future
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан, но нас отменили — возвращаем его
+                self.release()
+            else:
+                self._discard(owner, future)
+            raise
+
+    def release(self) -> None:
+        self._active -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._active < self._limit and self._waiters:
+            owner, queue = next(iter(self._waiters.items()))
+            future = queue.popleft()
+
+            # Следующий слот получит другой владелец
+            if queue:
+                self._waiters.move_to_end(owner)
+            else:
+                del self._waiters[owner]
+
+            if future.done():
+                continue
+
+            self._active += 1
+            future.set_result(None)
+
+    def _discard(self, owner: Any, future: asyncio.Future) -> None:
+        queue = self._waiters.get(owner)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            pass
+        if not queue:
+            del self._waiters[owner]
+
+
+class TokenBucket:
+    """Token bucket: бюджет токенов в минуту с плавным пополнением"""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self._rate = tokens_per_minute / 60.0
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    @property
+    def available(self) -> int:
+        self._refill()
+        return int(self._tokens)
+
+    async def acquire(self, amount: int) -> None:
+        """Списать amount токенов, дождавшись пополнения при необходимости"""
+        amount = min(amount, self.capacity)
+
+        # Lock: ожидающие списывают строго по очереди
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self._rate)
+
+    def refund(self, amount: int) -> None:
+        """Вернуть списанные токены (вызов так и не состоялся)"""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + min(amount, self.capacity))
+
+
+class _Budget:
+    """Лимиты одного ключа (провайдер или модель)"""
+
+    def __init__(self, key: str, limit: Limit):
+        self.key = key
+        self.semaphore = FairSemaphore(limit.concurrency)
+        self.bucket = TokenBucket(limit.tokens_per_minute) if limit.tokens_per_minute else None
+
+        # Счетчики для мониторинга
+        self.calls = 0
+        self.rejected = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'active': self.semaphore.active,
+            'waiting': self.semaphore.waiting,
+            'calls': self.calls,
+            'queued': self.semaphore.queued_total,
+            'rejected': self.rejected,
+            'tokens_available': self.bucket.available if self.bucket else None
+        }
+
+
+class RateGovernor:
+    """
+    Ограничитель исходящих AI-вызовов.
+
+    Использование:
+        async with get_rate_governor().slot('openai', 'gpt-4o', tokens=1500):
+            ... запрос к провайдеру ...
+    """
+
+    def __init__(self, limits: Dict[str, Limit], max_wait: float = 60.0):
+        """
+        Args:
+            limits: Лимиты по ключам "provider" и "provider:model"
+            max_wait: Максимальное ожидание слота (сек)
+        """
+        self._limits = limits
+        self._max_wait = max_wait
+        self._budgets: Dict[str, _Budget] = {}
+
+    def _budget(self, key: str) -> Optional[_Budget]:
+        budget = self._budgets.get(key)
+        if budget is None and key in self._limits:
+            budget = self._budgets[key] = _Budget(key, self._limits[key])
+        return budget
+
+    async def _enter(self, budget: _Budget, owner: Any, tokens: int, deadline: float) -> None:
+        """Занять слот и токены одного бюджета (до deadline)"""
+        budget.calls += 1
+
+        try:
+            await asyncio.wait_for(
+                budget.semaphore.acquire(owner),
+                timeout=max(0.0, deadline - time.monotonic())
+            )
+        except asyncio.TimeoutError:
+            budget.rejected += 1
+            raise RateLimitExceeded(
+                f"Сервис {budget.key} сейчас перегружен, попробуй через минуту"
+            ) from None
+
+        if budget.bucket is None or not tokens:
+            return
+
+        try:
+            await asyncio.wait_for(
+                budget.bucket.acquire(tokens),
+                timeout=max(0.0, deadline - time.monotonic())
+            )
+        except BaseException as e:
+            budget.semaphore.release()
+            if isinstance(e, asyncio.TimeoutError):
+                budget.rejected += 1
+                raise RateLimitExceeded(
+                    f"Исчерпан лимит запросов к {budget.key}, попробуй через минуту"
+                ) from None
+            raise
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        provider: str,
+        model: Optional[str] = None,
+        tokens: int = 0
+    ) -> AsyncIterator[None]:
+        """
+        Занять слот у провайдера (и модели, если для нее задан лимит).
+
+        Args:
+            provider: Провайдер ("openai", "fal")
+            model: Модель (опционально)
+            tokens: Оценка токенов запроса для бюджета TPM
+
+        Raises:
+            RateLimitExceeded: слот не освободился за max_wait
+        """
+        owner = current_user_id.get()
+        deadline = time.monotonic() + self._max_wait
+
+        # Порядок захвата всегда модель → провайдер (без взаимных блокировок): пока ждем
+        # узкий лимит модели, общие слоты и токены провайдера остаются другим моделям
+        budgets = []
+        if model:
+            budgets.append(self._budget(f"{provider}:{model}"))
+        budgets.append(self._budget(provider))
+
+        entered = []
+        try:
+            for budget in budgets:
+                if budget is None:
+                    continue
+                await self._enter(budget, owner, tokens, deadline)
+                entered.append(budget)
+        except BaseException:
+            # Вызов не состоится: возвращаем уже занятые слоты и списанные токены
+            for budget in reversed(entered):
+                if budget.bucket is not None and tokens:
+                    budget.bucket.refund(tokens)
+                budget.semaphore.release()
+            raise
+
+        try:
+            yield
+        finally:
+            for budget in reversed(entered):
+                budget.semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика по всем бюджетам"""
+        return {key: budget.stats() for key, budget in self._budgets.items()}
+
+
+def parse_limits(spec: str) -> Dict[str, Limit]:
+    """
+    Разобрать лимиты из строки вида "openai=32;openai:gpt-4o=8/30000;fal=4"
+    (ключ=одновременных_запросов[/токенов_в_минуту]).
+    """
+    limits: Dict[str, Limit] = {}
+    for item in filter(None, (part.strip() for part in spec.split(';'))):
+        key, _, value = item.partition('=')
+        concurrency, _, tpm = value.partition('/')
+        limits[key.strip()] = Limit(int(concurrency), int(tpm) if tpm else None)
+    return limits
+
+
+# Лимиты по умолчанию (переопределяются через RATE_LIMITS в .env)
+DEFAULT_LIMITS: Dict[str, Limit] = {
+    'openai': Limit(concurrency=32),
+    'openai:gpt-4o': Limit(concurrency=8, tokens_per_minute=30000),
+    'openai:gpt-4o-mini': Limit(concurrency=16, tokens_per_minute=200000),
+    'openai:gpt-4o-mini-transcribe': Limit(concurrency=8),
+    'fal': Limit(concurrency=4),
+}
+
+
+# Singleton инстанс
+_rate_governor_instance: Optional[RateGovernor] = None
+
+
+def get_rate_governor() -> RateGovernor:
+    """Получить singleton инстанс Rate Governor"""
+    global _rate_governor_instance
+
+    if _rate_governor_instance is None:
+        limits = dict(DEFAULT_LIMITS)
+        limits.update(parse_limits(os.getenv('RATE_LIMITS', '')))
+        max_wait = float(os.getenv('RATE_LIMIT_MAX_WAIT', '60'))
+
+        _rate_governor_instance = RateGovernor(limits, max_wait=max_wait)
+        logger.info(f"RateGovernor инициализирован: {len(limits)} лимитов, max_wait={max_wait}s")
+
+    return _rate_governor_instance
@@ -0,0 +1,257 @@
+"""
+Повторы и circuit breaker для внешних AI-вызовов.
+
+Правила:
+- Повторяем только временные ошибки: 408/429/5xx, таймауты, обрывы соединения
+- Пауза между попытками — экспонента с полным джиттером, Retry-After от провайдера уважается
+- Общее время всех попыток ограничено deadline: не ждем дольше, чем пользователь готов ждать
+- На каждый эндпоинт свой CircuitBreaker: после серии сбоев вызовы сразу получают
+  CircuitOpenError, пока провайдер не восстановится (пробный запрос через recovery_timeout)
+- Ошибки клиента (400, нарушение политики контента) не повторяются и не размыкают цепь
+"""
+
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# HTTP статусы, после которых имеет смысл повторить запрос
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(Exception):
+    """Провайдер недоступен: цепь разомкнута, вызов не выполнялся"""
+
+    def __init__(self, name: str, retry_in: float):
+        self.name = name
+        self.retry_in = retry_in
+        super().__init__(
+            f"Сервис {name} временно недоступен, попробуй через {max(1, int(retry_in))} сек"
+        )
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разобрать заголовок Retry-After (секунды или HTTP-дата)"""
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def is_retryable(exc: BaseException, retry_timeouts: bool = True) -> bool:
+    """
+    Временная ли ошибка.
+
+    Исключение может само сказать об этом атрибутом retryable,
+    либо через HTTP статус в атрибуте status.
+    """
+    retryable = getattr(exc, 'retryable', None)
+    if retryable is not None:
+        return bool(retryable) and (retry_timeouts or not getattr(exc, 'is_timeout', False))
+
+    if isinstance(exc, asyncio.TimeoutError):
+        return retry_timeouts
+
+    if isinstance(exc, aiohttp.ClientConnectionError):
+        return True
+
+    return getattr(exc, 'status', None) in RETRYABLE_STATUSES
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Политика повторов"""
+    attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    deadline: Optional[float] = 45.0  # Общий бюджет времени на все попытки (сек)
+    retry_timeouts: bool = True
+
+    def delay(self, attempt: int, exc: BaseException) -> float:
+        """Пауза перед попыткой attempt + 1 (экспонента с полным джиттером)"""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = getattr(exc, 'retry_after', None)
+        if retry_after is not None:
+            return max(backoff, retry_after)
+        return backoff
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker для одного эндпоинта.
+
+    closed → (failure_threshold сбоев подряд) → open → (recovery_timeout) → half-open:
+    один пробный вызов; успех замыкает цепь, сбой снова размыкает.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._recovery_timeout = recovery_timeout
+
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+        # Счетчики для мониторинга
+        self._rejected = 0
+        self._trips = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self._recovery_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self) -> None:
+        """
+        Проверить, можно ли выполнять вызов.
+
+        Raises:
+            CircuitOpenError: цепь разомкнута
+        """
+        state = self.state
+        if state == 'closed':
+            return
+
+        if state == 'half-open' and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+
+        self._rejected += 1
+        retry_in = self._recovery_timeout - (time.monotonic() - self._opened_at)
+        raise CircuitOpenError(self.name, max(retry_in, 1.0))
+
+    def record_success(self) -> None:
+        if self._opened_at is not None:
+            logger.info(f"Circuit {self.name}: восстановлен")
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        probe_failed = self._probe_in_flight
+        self._probe_in_flight = False
+
+        if probe_failed or (self._opened_at is None and self._failures >= self._failure_threshold):
+            self._opened_at = time.monotonic()
+            self._trips += 1
+            logger.warning(
+                f"Circuit {self.name}: разомкнут на {self._recovery_timeout}s "
+                f"после {self._failures} сбоев"
+            )
+
+    def record_ignored(self) -> None:
+        """Вызов завершился ошибкой клиента: на здоровье провайдера не влияет"""
+        self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'failures': self._failures,
+            'trips': self._trips,
+            'rejected': self._rejected
+        }
+
+
+# Реестр breaker'ов по имени эндпоинта
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Получить (или создать) CircuitBreaker для эндпоинта"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(name)
+    return breaker
+
+
+def circuit_stats() -> Dict[str, Dict[str, Any]]:
+    """Статистика всех breaker'ов"""
+    return {name: breaker.stats() for name, breaker in _breakers.items()}
+
+
+def record_outcome(breaker: CircuitBreaker, exc: Optional[BaseException]) -> None:
+    """Учесть результат вызова в breaker'е"""
+    if exc is None:
+        breaker.record_success()
+    elif isinstance(exc, asyncio.CancelledError):
+        breaker.record_ignored()
+    elif is_retryable(exc):
+        breaker.record_failure()
+    else:
+        breaker.record_ignored()
+
+
+async def call_with_retry(
+    func: Callable[[], Awaitable[T]],
+    breaker: Optional[CircuitBreaker] = None,
+    policy: RetryPolicy = RetryPolicy()
+) -> T:
+    """
+    Выполнить вызов с повторами и circuit breaker.
+
+    Args:
+        func: Фабрика корутины (вызывается заново на каждую попытку)
+        breaker: CircuitBreaker эндпоинта (опционально)
+        policy: Политика повторов
+
+    Raises:
+        CircuitOpenError: цепь разомкнута
+        Исключение последней попытки, если повторы не помогли
+    """
+    started = time.monotonic()
+    attempt = 0
+
+    while True:
+        if breaker is not None:
+            breaker.before_call()
+
+        try:
+            result = await func()
+        except BaseException as exc:
+            if breaker is not None:
+                record_outcome(breaker, exc)
+
+            if isinstance(exc, asyncio.CancelledError):
+                raise
+
+            attempt += 1
+            if attempt >= policy.attempts or not is_retryable(exc, policy.retry_timeouts):
+                raise
+
+            delay = policy.delay(attempt - 1, exc)
+            if policy.deadline is not None and time.monotonic() - started + delay > policy.deadline:
+                raise
+
+            logger.warning(
+                f"Повтор вызова {breaker.name if breaker else ''} через {delay:.1f}s "
+                f"(попытка {attempt + 1}/{policy.attempts}): {exc}"
+            )
+            await asyncio.sleep(delay)
+            continue
+
+        if breaker is not None:
+            record_outcome(breaker, None)
+        return result
@@ -0,0 +1,86 @@
+"""
+Объединение результатов нескольких поисков и сборка контекста для промпта.
+
+Правила:
+- Ранги разных поисков (BM25, векторный, по ключевым словам) объединяются через
+  Reciprocal Rank Fusion: score = Σ 1 / (k + rank), шкалы score поисков не сравниваются
+- Контекст ограничивается бюджетом токенов, а не символов: фрагменты добавляются
+  по порядку, последний обрезается по границе предложения, если в бюджет помещается
+  осмысленная часть
+"""
+
+from typing import Dict, Hashable, Iterable, List, Sequence
+
+from bot.utils.openai_gateway import estimate_tokens
+
+# Константа RRF: чем больше, тем меньше вес первых мест отдельного поиска
+RRF_K = 60
+
+# Фрагмент короче этого (в токенах) не обрезаем, а отбрасываем
+MIN_SNIPPET_TOKENS = 40
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[Hashable]], k: int = RRF_K) -> List[Hashable]:
+    """
+    Объединить несколько ранжированных списков в один.
+
+    Args:
+        rankings: Списки ключей, каждый — от лучшего к худшему
+        k: Константа RRF
+
+    Returns:
+        Ключи по убыванию суммарного score
+    """
+    scores: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Обрезать текст до max_tokens по границе предложения (или слова)"""
+    # estimate_tokens: ~3 символа на токен
+    limit = max(max_tokens - 1, 0) * 3
+    if len(text) <= limit:
+        return text
+
+    cut = text[:limit]
+    boundary = max(cut.rfind('. '), cut.rfind('! '), cut.rfind('? '), cut.rfind('\n'))
+    if boundary >= limit // 2:
+        return cut[:boundary + 1].rstrip()
+
+    space = cut.rfind(' ')
+    if space > 0:
+        cut = cut[:space]
+    return cut.rstrip() + '…'
+
+
+def fit_to_token_budget(snippets: Iterable[str], max_tokens: int) -> List[str]:
+    """
+    Взять фрагменты по порядку, пока они помещаются в бюджет токенов.
+
+    Args:
+        snippets: Фрагменты от самого релевантного к наименее
+        max_tokens: Бюджет токенов на весь контекст
+    """
+    selected = []
+    remaining = max_tokens
+
+    for snippet in snippets:
+        snippet = snippet.strip()
+        if not snippet:
+            continue
+
+        tokens = estimate_tokens(snippet)
+        if tokens <= remaining:
+            selected.append(snippet)
+            remaining -= tokens
+            continue
+
+        if remaining >= MIN_SNIPPET_TOKENS:
+            selected.append(_truncate(snippet, remaining))
+        break
+
+    return selected
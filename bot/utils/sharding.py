@@ -0,0 +1,285 @@
+"""
+Шардирование обработки апдейтов по процессам-воркерам.
+
+Схема:
+- Фронт-процесс принимает webhook и маршрутизирует сырой апдейт в воркер
+  по from_user.id (один пользователь всегда попадает в один воркер,
+  поэтому сохраняются порядок его апдейтов и консистентность FSM)
+- Каждый воркер — отдельный процесс со своим event loop, Bot, Dispatcher,
+  пулом соединений БД и HTTPClientManager
+- Фронт не разбирает JSON апдейта: ID отправителя достается из сырых байт
+  регулярным выражением (Telegram сериализует "from" раньше вложенных сообщений),
+  и только если его там нет (channel_post и т.п.), тело разбирается целиком.
+  Полностью апдейт разбирается уже в воркере
+- Воркер останавливается по sentinel из очереди или по SIGTERM (с graceful shutdown)
+- Фронт присматривает за воркерами: упавший процесс перезапускается с той же очередью,
+  апдейты его пользователей дождутся нового процесса
+- Webhook Fal.ai приходит во фронт, а генерацию ждет воркер: фронт рассылает
+  уведомление во все очереди (кто ждет — проснется, остальные проигнорируют)
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import queue
+import re
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, Dict, List, Optional
+
+from bot.utils.fal_queue import FalQueue
+
+logger = logging.getLogger(__name__)
+
+# Первый "from": {"id": N} в сыром апдейте — отправитель самого апдейта.
+# Внутри строковых значений такой последовательности быть не может (кавычки там экранированы)
+_SENDER_ID_RE = re.compile(rb'"from"\s*:\s*\{\s*"id"\s*:\s*(-?\d+)')
+
+# Как часто воркер проверяет сигнал остановки, пока очередь пуста (сек)
+_QUEUE_POLL_INTERVAL = 1.0
+
+# Как часто фронт проверяет, живы ли воркеры (сек)
+_SUPERVISE_INTERVAL = 5.0
+
+# Служебное сообщение в очереди воркера: (_FAL_NOTIFY, request_id)
+_FAL_NOTIFY = 'fal_notify'
+
+# Типы апдейтов, в которых есть отправитель (поле "from")
+_USER_UPDATE_TYPES = (
+    'message',
+    'edited_message',
+    'callback_query',
+    'inline_query',
+    'chosen_inline_result',
+    'shipping_query',
+    'pre_checkout_query',
+    'my_chat_member',
+    'chat_member',
+    'chat_join_request',
+    'business_message',
+    'edited_business_message',
+    'message_reaction',
+)
+
+
+def extract_user_id(payload: Dict[str, Any]) -> Optional[int]:
+    """
+    Получить ID пользователя из сырого апдейта.
+
+    Если отправителя нет (например, channel_post), используем ID чата.
+    """
+    for update_type in _USER_UPDATE_TYPES:
+        event = payload.get(update_type)
+        if not event:
+            continue
+
+        sender = event.get('from') or event.get('user')
+        if sender and 'id' in sender:
+            return sender['id']
+
+        chat = event.get('chat')
+        if chat and 'id' in chat:
+            return chat['id']
+
+    for event in payload.values():
+        if isinstance(event, dict) and isinstance(event.get('chat'), dict):
+            return event['chat'].get('id')
+
+    return None
+
+
+def extract_user_id_fast(body: bytes) -> Optional[int]:
+    """
+    ID пользователя из сырого апдейта без разбора всего JSON.
+
+    Для апдейтов без поля "from" разбирает JSON целиком (extract_user_id).
+
+    Raises:
+        ValueError: тело не является JSON-объектом
+    """
+    match = _SENDER_ID_RE.search(body)
+    if match:
+        return int(match.group(1))
+
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError("Апдейт должен быть JSON-объектом")
+    return extract_user_id(payload)
+
+
+def shard_for(user_id: Optional[int], shards: int) -> int:
+    """Номер воркера для пользователя"""
+    if user_id is None:
+        return 0
+    return abs(user_id) % shards
+
+
+class ShardRouter:
+    """
+    Фронт-часть шардирования: запускает процессы-воркеры и
+    раскладывает апдейты по их очередям.
+
+    Реализует интерфейс UpdateSink для webhook-сервера.
+    """
+
+    def __init__(
+        self,
+        worker_target: Callable[[int, Any], None],
+        shards: int,
+        queue_size: int = 1000
+    ):
+        """
+        Args:
+            worker_target: Функция процесса-воркера (index, queue) -> None.
+                Должна быть доступна для импорта (spawn).
+            shards: Количество процессов-воркеров
+            queue_size: Размер очереди каждого воркера
+        """
+        if shards <= 0:
+            raise ValueError("shards должен быть больше 0")
+
+        # spawn: воркер не наследует event loop, соединения и сокеты фронта
+        self._ctx = multiprocessing.get_context('spawn')
+        self._worker_target = worker_target
+        self._shards = shards
+        self._queues = [self._ctx.Queue(maxsize=queue_size) for _ in range(shards)]
+        self._processes: List[BaseProcess] = []
+        self._supervisor: Optional[asyncio.Task] = None
+
+        self._routed = [0] * shards
+        self._rejected = 0
+        self._restarts = 0
+
+    def _spawn(self, idx: int) -> BaseProcess:
+        process = self._ctx.Process(
+            target=self._worker_target,
+            args=(idx, self._queues[idx]),
+            name=f"bot-shard-{idx}",
+            daemon=False
+        )
+        process.start()
+        return process
+
+    def start(self) -> None:
+        """Запустить процессы-воркеры и присмотр за ними"""
+        self._processes = [self._spawn(idx) for idx in range(self._shards)]
+        self._supervisor = asyncio.create_task(self._supervise(), name="shard-supervisor")
+
+        logger.info(f"ShardRouter запущен: {self._shards} воркеров")
+
+    async def _supervise(self) -> None:
+        """Перезапускать упавшие воркеры (очередь остается прежней, апдейты не теряются)"""
+        while True:
+            await asyncio.sleep(_SUPERVISE_INTERVAL)
+            for idx, process in enumerate(self._processes):
+                if process.is_alive():
+                    continue
+
+                logger.error(
+                    f"Воркер {process.name} упал (exitcode={process.exitcode}), перезапускаем"
+                )
+                try:
+                    self._processes[idx] = self._spawn(idx)
+                    self._restarts += 1
+                except Exception as e:
+                    logger.error(f"Не удалось перезапустить воркер {idx}: {e}", exc_info=True)
+
+    async def submit(self, body: bytes) -> bool:
+        if not body.lstrip().startswith(b'{'):
+            raise ValueError("Апдейт должен быть JSON-объектом")
+
+        shard = shard_for(extract_user_id_fast(body), self._shards)
+
+        try:
+            self._queues[shard].put_nowait(body)
+        except queue.Full:
+            self._rejected += 1
+            logger.warning(f"Очередь воркера {shard} переполнена, апдейт отклонен")
+            return False
+
+        self._routed[shard] += 1
+        return True
+
+    def notify_fal(self, request_id: str) -> bool:
+        """
+        Webhook о завершении генерации Fal.ai: переслать во все воркеры.
+
+        Какой воркер ждет генерацию, фронт не знает. Если очередь воркера полна,
+        уведомление пропускается — генерацию дождется опрос статуса.
+        """
+        delivered = False
+        for worker_queue in self._queues:
+            try:
+                worker_queue.put_nowait((_FAL_NOTIFY, request_id))
+                delivered = True
+            except queue.Full:
+                pass
+        return delivered
+
+    async def close(self, timeout: float = 30.0) -> None:
+        """Остановить воркеры: отправляем sentinel и ждем завершения"""
+        # Остановленные воркеры не должны перезапускаться
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+            self._supervisor = None
+
+        for worker_queue in self._queues:
+            try:
+                # put с таймаутом блокирует — не на event loop
+                await asyncio.to_thread(worker_queue.put, None, True, 1)
+            except queue.Full:
+                logger.warning("Не удалось отправить sentinel воркеру (очередь полна)")
+
+        for process in self._processes:
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                logger.warning(f"Воркер {process.name} не завершился, принудительная остановка")
+                process.terminate()
+
+        self._processes.clear()
+        logger.info(f"ShardRouter остановлен: {self.stats()}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика маршрутизации"""
+        return {
+            'shards': self._shards,
+            'routed': list(self._routed),
+            'rejected': self._rejected,
+            'restarts': self._restarts,
+            'alive': sum(1 for p in self._processes if p.is_alive())
+        }
+
+
+async def consume_shard_queue(
+    worker_queue: Any,
+    submit: Callable[[bytes], Any],
+    stop: Optional[asyncio.Event] = None
+) -> None:
+    """
+    Цикл воркера: читает сырые апдейты из межпроцессной очереди
+    до получения sentinel (None) или события stop.
+    Уведомления о генерациях Fal.ai передаются в FalQueue этого процесса.
+
+    Args:
+        worker_queue: multiprocessing.Queue воркера
+        submit: Корутина, принимающая сырой апдейт
+        stop: Событие остановки (например, по SIGTERM)
+    """
+    loop = asyncio.get_running_loop()
+    while stop is None or not stop.is_set():
+        # get с таймаутом: поток executor не должен зависнуть в get при остановке
+        try:
+            body = await loop.run_in_executor(None, worker_queue.get, True, _QUEUE_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+        if body is None:
+            break
+        if isinstance(body, tuple) and body[0] == _FAL_NOTIFY:
+            FalQueue.notify(body[1])
+            continue
+
+        try:
+            await submit(body)
+        except ValueError:
+            logger.warning("Воркер получил некорректный апдейт", exc_info=True)
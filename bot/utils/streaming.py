@@ -0,0 +1,122 @@
+"""
+Постепенный вывод потокового ответа LLM в сообщение Telegram.
+
+Правила:
+- Частичный текст выводится редактированием сообщения-заглушки ("⏳ Пишу пост...")
+- Правки идут не чаще min_interval и только когда текст заметно вырос (лимиты Telegram)
+- update() не ждет Telegram: пока одна правка в полете, следующие пропускаются,
+  поэтому чтение потока от LLM не тормозит
+- Частичный текст отправляется без parse_mode (незакрытая разметка ломает Markdown),
+  финальный — с разметкой и клавиатурой, с откатом на обычный текст
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины текста сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+
+class StreamingMessage:
+    """Сообщение, в которое по мере генерации выводится ответ LLM"""
+
+    def __init__(
+        self,
+        message: Message,
+        min_interval: float = 1.5,
+        min_delta: int = 40,
+        cursor: str = " ▌"
+    ):
+        """
+        Args:
+            message: Сообщение-заглушка, которое будем редактировать
+            min_interval: Минимальный интервал между правками (сек)
+            min_delta: Минимальный прирост текста между правками (символов)
+            cursor: Маркер "пишу дальше" в конце частичного текста
+        """
+        self.message = message
+        self._min_interval = min_interval
+        self._min_delta = min_delta
+        self._cursor = cursor
+
+        self._next_edit_at = 0.0
+        self._shown_len = 0
+        self._inflight: Optional[asyncio.Task] = None
+
+    async def update(self, text: str) -> None:
+        """Показать частичный текст (с троттлингом, без ожидания Telegram)"""
+        if not text.strip():
+            return
+        if self._inflight is not None and not self._inflight.done():
+            return
+        if time.monotonic() < self._next_edit_at:
+            return
+        if len(text) - self._shown_len < self._min_delta:
+            return
+
+        self._shown_len = len(text)
+        self._next_edit_at = time.monotonic() + self._min_interval
+
+        partial = text[:MESSAGE_LIMIT - len(self._cursor)] + self._cursor
+        self._inflight = asyncio.create_task(self._edit_partial(partial))
+
+    async def _edit_partial(self, text: str) -> None:
+        try:
+            # Явный None: иначе aiogram подставит parse_mode бота по умолчанию (Markdown)
+            await self.message.edit_text(text, parse_mode=None)
+        except TelegramRetryAfter as e:
+            self._next_edit_at = time.monotonic() + e.retry_after
+            logger.debug(f"Flood control при выводе потока, пауза {e.retry_after}s")
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                logger.debug(f"Не удалось обновить частичный текст: {e}")
+        except Exception as e:
+            logger.debug(f"Не удалось обновить частичный текст: {e}")
+
+    async def finalize(
+        self,
+        text: str,
+        reply_markup: Any = None,
+        parse_mode: Optional[str] = "Markdown"
+    ) -> Message:
+        """
+        Вывести финальный текст с клавиатурой.
+
+        Если разметка не парсится — повторяем без parse_mode.
+        """
+        if self._inflight is not None:
+            await asyncio.gather(self._inflight, return_exceptions=True)
+            self._inflight = None
+
+        for attempt in range(3):
+            try:
+                result = await self.message.edit_text(
+                    text,
+                    reply_markup=reply_markup,
+                    parse_mode=parse_mode
+                )
+                if isinstance(result, Message):
+                    self.message = result
+                return self.message
+            except TelegramRetryAfter as e:
+                if attempt == 2:
+                    raise
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                error = str(e)
+                if "message is not modified" in error:
+                    return self.message
+                if parse_mode and "can't parse entities" in error:
+                    logger.warning("Финальный текст не прошел Markdown, отправляем без разметки")
+                    parse_mode = None
+                    continue
+                raise
+
+        return self.message
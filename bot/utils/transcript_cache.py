@@ -0,0 +1,78 @@
+"""
+Кэш транскрипций голосовых сообщений.
+
+Одно и то же голосовое транскрибируется повторно: пользователь жмет "Готово" еще раз
+после ошибки, handler падает на полпути и т.п. Транскрипт зависит только от самого файла,
+модели и языка, поэтому его можно переиспользовать.
+
+Правила:
+- Ключ — file_unique_id Telegram (одинаков для одного файла у любых ботов и сообщений),
+  модель и язык
+- Два слоя (PersistentCache): TTLCache в памяти и таблица voice_transcripts в Postgres;
+  параллельные запросы одного транскрипта схлопываются в один
+- При попадании не выполняется ни скачивание файла, ни запрос к Whisper
+- Пустые транскрипты не кэшируются
+"""
+
+from typing import Awaitable, Callable, Optional
+
+from bot.database.models import VoiceTranscript
+from bot.utils.cache import transcript_cache
+from bot.utils.persistent_cache import PersistentCache
+
+# Сколько хранить транскрипт в БД (сек)
+TRANSCRIPT_TTL = 30 * 24 * 3600
+
+
+class TranscriptCache(PersistentCache):
+    """Двухуровневый (память + Postgres) кэш транскрипций"""
+
+    def __init__(self, ttl: int = TRANSCRIPT_TTL):
+        """
+        Args:
+            ttl: Время хранения транскрипта в БД (сек)
+        """
+        super().__init__(
+            name="Transcript",
+            table=VoiceTranscript,
+            memory=transcript_cache,
+            key_columns=['file_unique_id', 'model', 'language'],
+            value_column='text',
+            ttl=ttl
+        )
+
+    async def get_or_transcribe(
+        self,
+        file_unique_id: str,
+        model: str,
+        language: Optional[str],
+        transcribe: Callable[[], Awaitable[str]]
+    ) -> str:
+        """
+        Получить транскрипт из кэша или выполнить транскрибацию.
+
+        Args:
+            file_unique_id: Уникальный ID файла в Telegram
+            model: Модель транскрипции
+            language: Язык (None — автоопределение)
+            transcribe: Скачивание + транскрибация при промахе
+        """
+        async def compute() -> Optional[str]:
+            # Пустой транскрипт не кэшируем (None не сохраняется ни в памяти, ни в БД)
+            return await transcribe() or None
+
+        return await self.get_or_load((file_unique_id, model, language or ''), compute) or ""
+
+
+# Singleton инстанс
+_transcript_cache_instance: Optional[TranscriptCache] = None
+
+
+def get_transcript_cache() -> TranscriptCache:
+    """Получить singleton инстанс кэша транскрипций"""
+    global _transcript_cache_instance
+
+    if _transcript_cache_instance is None:
+        _transcript_cache_instance = TranscriptCache()
+
+    return _transcript_cache_instance
@@ -0,0 +1,145 @@
+"""
+Ограниченная очередь апдейтов для webhook-режима.
+
+Правила:
+- Webhook-хендлер только кладет апдейт в очередь и сразу отвечает Telegram
+- Апдейты обрабатывает фиксированное число воркеров (нет бесконтрольного роста задач)
+- При переполнении апдейт либо отклоняется сразу, либо ждет свободное место ограниченное время
+- Отклоненный апдейт получает не-2xx ответ, и Telegram доставит его повторно (ничего не теряется)
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Optional
+
+logger = logging.getLogger(__name__)
+
+OverflowPolicy = Literal['reject', 'wait']
+
+
+class UpdateQueue:
+    """
+    Bounded in-process очередь с пулом воркеров.
+
+    Используется webhook-сервером: `put()` возвращает False, если апдейт
+    не удалось поставить в очередь (очередь полна).
+    """
+
+    def __init__(
+        self,
+        process: Callable[[Any], Awaitable[Any]],
+        maxsize: int = 1000,
+        workers: int = 8,
+        overflow: OverflowPolicy = 'reject',
+        put_timeout: Optional[float] = 5.0
+    ):
+        """
+        Args:
+            process: Корутина обработки одного апдейта (например, dp.feed_update)
+            maxsize: Максимальное количество апдейтов в очереди
+            workers: Количество воркеров, обрабатывающих очередь
+            overflow: 'reject' — сразу отклонять, 'wait' — ждать место до put_timeout
+            put_timeout: Сколько ждать свободное место при overflow='wait' (сек, None — без ограничения)
+        """
+        if maxsize <= 0:
+            raise ValueError("maxsize должен быть больше 0")
+        if workers <= 0:
+            raise ValueError("workers должен быть больше 0")
+
+        self._process = process
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._workers_count = workers
+        self._overflow = overflow
+        self._put_timeout = put_timeout
+        self._workers: List[asyncio.Task] = []
+
+        # Счетчики для мониторинга
+        self._accepted = 0
+        self._rejected = 0
+        self._processed = 0
+        self._failed = 0
+
+    def start(self) -> None:
+        """Запустить воркеры (вызывается внутри работающего event loop)"""
+        if self._workers:
+            return
+
+        for idx in range(self._workers_count):
+            self._workers.append(
+                asyncio.create_task(self._worker(idx), name=f"update-worker-{idx}")
+            )
+
+        logger.info(
+            f"UpdateQueue запущена: workers={self._workers_count}, "
+            f"maxsize={self._queue.maxsize}, overflow={self._overflow}"
+        )
+
+    async def put(self, update: Any) -> bool:
+        """
+        Поставить апдейт в очередь.
+
+        Returns:
+            True если апдейт принят, False если очередь переполнена
+        """
+        try:
+            if self._overflow == 'wait':
+                await asyncio.wait_for(self._queue.put(update), timeout=self._put_timeout)
+            else:
+                self._queue.put_nowait(update)
+        except (asyncio.QueueFull, asyncio.TimeoutError):
+            self._rejected += 1
+            logger.warning(
+                "UpdateQueue переполнена, апдейт отклонен",
+                extra={"queue_size": self._queue.qsize(), "rejected_total": self._rejected}
+            )
+            return False
+
+        self._accepted += 1
+        return True
+
+    async def _worker(self, idx: int) -> None:
+        """Цикл воркера: берет апдейт и обрабатывает его"""
+        while True:
+            update = await self._queue.get()
+            try:
+                await self._process(update)
+                self._processed += 1
+            except Exception:
+                self._failed += 1
+                logger.error(f"Ошибка обработки апдейта в воркере {idx}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def close(self, drain_timeout: Optional[float] = 10.0) -> None:
+        """
+        Остановить воркеры (для graceful shutdown).
+
+        Сначала ждем обработку уже принятых апдейтов (не дольше drain_timeout),
+        затем отменяем воркеры.
+        """
+        if not self._workers:
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"UpdateQueue: не дождались обработки {self._queue.qsize()} апдейтов")
+
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+        logger.info(f"UpdateQueue остановлена: {self.stats()}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика очереди"""
+        return {
+            'queue_size': self._queue.qsize(),
+            'maxsize': self._queue.maxsize,
+            'workers': len(self._workers),
+            'accepted': self._accepted,
+            'rejected': self._rejected,
+            'processed': self._processed,
+            'failed': self._failed
+        }
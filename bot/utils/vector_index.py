@@ -0,0 +1,239 @@
+"""
+In-memory индекс embeddings таблицы documents (база знаний тренажера).
+
+Корпус documents небольшой и меняется редко, а поиск по нему стоит на пути каждого
+голосового в тренажере. Вместо векторного запроса в Postgres держим все embeddings
+в памяти процесса и ищем top-k скалярным произведением.
+
+Правила:
+- Опционально: включается VECTOR_INDEX_ENABLED=1 и только если установлен numpy;
+  пока индекс не загружен (или выключен), поиск идет в БД как раньше
+- Embeddings хранятся одной непрерывной float32-матрицей с нормированными строками:
+  косинусная близость = matrix @ query
+- Обновление инкрементальное: по системной колонке xmin (меняется при каждом UPDATE)
+  из БД дочитываются только новые и измененные строки, удаленные выбрасываются
+- По content строится BM25-индекс (lexical_search) для гибридного поиска
+- Поиск всегда видит согласованный снимок: обновление собирает новый снимок и подменяет его целиком
+- Ошибки обновления логируются, индекс продолжает отвечать по последнему снимку
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import bindparam, text
+
+from bot.database.unit_of_work import read_transaction
+from bot.utils.bm25 import BM25Index
+
+try:
+    import numpy as np
+except ImportError:  # numpy не обязателен: без него поиск идет в БД
+    np = None
+
+logger = logging.getLogger(__name__)
+
+VECTOR_INDEX_ENABLED = os.getenv('VECTOR_INDEX_ENABLED', '0') == '1'
+
+# Как часто сверять индекс с таблицей documents (сек)
+VECTOR_INDEX_REFRESH_INTERVAL = float(os.getenv('VECTOR_INDEX_REFRESH_INTERVAL', '300'))
+
+VERSIONS_SQL = text("SELECT id, xmin::text AS version FROM documents WHERE embedding IS NOT NULL")
+
+ROWS_SQL = text(
+    "SELECT id, xmin::text AS version, content, metadata, embedding FROM documents WHERE id IN :ids"
+).bindparams(bindparam('ids', expanding=True))
+
+# Сколько строк дочитывать одним запросом
+FETCH_BATCH = 500
+
+
+class _Snapshot(NamedTuple):
+    ids: List[Any]
+    versions: Dict[Any, str]
+    payloads: List[Dict[str, Any]]
+    matrix: Any  # np.ndarray (n, dim) float32, строки нормированы
+    bm25: BM25Index
+
+
+def _normalize(vectors: "np.ndarray") -> "np.ndarray":
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(vectors / norms, dtype=np.float32)
+
+
+def _to_array(value: Any) -> "np.ndarray":
+    """embedding из asyncpg (ndarray, pgvector.Vector или список) → float32"""
+    to_numpy = getattr(value, 'to_numpy', None)
+    return np.asarray(to_numpy() if to_numpy else value, dtype=np.float32)
+
+
+class DocumentVectorIndex:
+    """Индекс embeddings documents в памяти процесса"""
+
+    def __init__(self, refresh_interval: float = VECTOR_INDEX_REFRESH_INTERVAL):
+        """
+        Args:
+            refresh_interval: Интервал сверки с таблицей documents (сек)
+        """
+        self._refresh_interval = refresh_interval
+        self._snapshot: Optional[_Snapshot] = None
+        self._refresh_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        # Счетчики для мониторинга
+        self._searches = 0
+        self._refreshes = 0
+        self._mismatches = 0
+
+    @property
+    def ready(self) -> bool:
+        """Индекс загружен и может отвечать на запросы"""
+        return self._snapshot is not None
+
+    def search(self, query_embedding: Sequence[float], limit: int = 5) -> Optional[List[Dict[str, Any]]]:
+        """
+        Top-k документов по косинусной близости.
+
+        Returns:
+            Список {content, metadata, similarity}, как у AITrainerService.search_in_documents;
+            None, если индекс не может ответить (размерность запроса не совпадает
+            с документами, например после смены модели) — тогда поиск идет в БД
+        """
+        snapshot = self._snapshot
+        if snapshot is None or not snapshot.ids or limit <= 0:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if query.shape != (snapshot.matrix.shape[1],):
+            self._mismatches += 1
+            logger.warning(
+                f"Vector index: размерность запроса {query.shape} не совпадает "
+                f"с документами ({snapshot.matrix.shape[1]}), поиск в БД"
+            )
+            return None
+
+        self._searches += 1
+        scores = snapshot.matrix @ _normalize(query)
+
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [
+            {**snapshot.payloads[i], 'similarity': float(scores[i])}
+            for i in top
+        ]
+
+    def lexical_search(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Top-k документов по BM25, от лучшего к худшему"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+        return [snapshot.payloads[i] for i, _ in snapshot.bm25.search(query, limit)]
+
+    async def refresh(self) -> None:
+        """Сверить индекс с таблицей documents и дочитать изменения"""
+        async with self._refresh_lock:
+            async with read_transaction() as session:
+                rows = (await session.execute(VERSIONS_SQL)).all()
+                versions = {row.id: row.version for row in rows}
+
+                current = self._snapshot
+                known = current.versions if current is not None else {}
+                changed = [doc_id for doc_id, version in versions.items() if known.get(doc_id) != version]
+
+                if current is not None and not changed and len(versions) == len(known):
+                    return
+
+                fetched = []
+                for start in range(0, len(changed), FETCH_BATCH):
+                    result = await session.execute(ROWS_SQL, {'ids': changed[start:start + FETCH_BATCH]})
+                    fetched.extend(result.all())
+
+            self._snapshot = await asyncio.to_thread(self._build, current, versions, fetched)
+            self._refreshes += 1
+            logger.info(
+                f"Vector index обновлен: {len(self._snapshot.ids)} документов "
+                f"(дочитано {len(fetched)}, удалено {len(set(known) - set(versions))})"
+            )
+
+    @staticmethod
+    def _build(current: Optional[_Snapshot], versions: Dict[Any, str], fetched: List[Any]) -> _Snapshot:
+        """Собрать новый снимок: старые строки без изменений + дочитанные"""
+        fresh = {row.id: row for row in fetched}
+
+        ids, payloads, parts = [], [], []
+        if current is not None:
+            keep = [
+                i for i, doc_id in enumerate(current.ids)
+                if doc_id in versions and doc_id not in fresh
+            ]
+            ids.extend(current.ids[i] for i in keep)
+            payloads.extend(current.payloads[i] for i in keep)
+            if keep:
+                parts.append(current.matrix[keep])
+
+        if fresh:
+            ids.extend(fresh)
+            payloads.extend({'content': row.content, 'metadata': row.metadata} for row in fresh.values())
+            parts.append(_normalize(np.stack([_to_array(row.embedding) for row in fresh.values()])))
+
+        matrix = np.ascontiguousarray(np.concatenate(parts)) if parts else np.empty((0, 0), dtype=np.float32)
+        # Версия строки — та, с которой ее дочитали (могла измениться между двумя запросами)
+        snapshot_versions = {doc_id: versions[doc_id] for doc_id in ids if doc_id not in fresh}
+        snapshot_versions.update({doc_id: row.version for doc_id, row in fresh.items()})
+        bm25 = BM25Index([payload['content'] or '' for payload in payloads])
+        return _Snapshot(ids, snapshot_versions, payloads, matrix, bm25)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Не удалось обновить vector index: {e}", exc_info=True)
+            await asyncio.sleep(self._refresh_interval)
+
+    def start(self) -> None:
+        """Загрузить индекс и периодически сверять его с БД (в фоне)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop(), name="vector-index-refresh")
+            logger.info(f"Vector index запущен (интервал обновления: {self._refresh_interval}s)")
+
+    async def stop(self) -> None:
+        """Остановить фоновое обновление (для graceful shutdown)"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            logger.info(f"Vector index остановлен: {self.stats()}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика индекса"""
+        snapshot = self._snapshot
+        return {
+            'ready': snapshot is not None,
+            'documents': len(snapshot.ids) if snapshot is not None else 0,
+            'bytes': snapshot.matrix.nbytes if snapshot is not None else 0,
+            'searches': self._searches,
+            'mismatches': self._mismatches,
+            'refreshes': self._refreshes
+        }
+
+
+# Singleton инстанс
+_vector_index_instance: Optional[DocumentVectorIndex] = None
+
+
+def get_document_index() -> Optional[DocumentVectorIndex]:
+    """Получить singleton индекса documents (None, если индекс выключен или нет numpy)"""
+    global _vector_index_instance
+
+    if not VECTOR_INDEX_ENABLED or np is None:
+        return None
+
+    if _vector_index_instance is None:
+        _vector_index_instance = DocumentVectorIndex()
+
+    return _vector_index_instance
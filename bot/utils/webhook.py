@@ -0,0 +1,128 @@
+"""
+Webhook-сервер на aiohttp.
+
+Принимает апдейты от Telegram, валидирует секрет и передает сырое тело
+запроса в приемник апдейтов (локальная очередь или роутер по воркерам).
+Обработка апдейтов происходит в воркерах, а не в HTTP-хендлере.
+"""
+
+import logging
+import secrets
+from typing import Any, Dict, Optional, Protocol
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.types import Update
+
+from bot.utils.fal_queue import FalQueue
+from bot.utils.update_queue import UpdateQueue
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class UpdateSink(Protocol):
+    """Приемник апдейтов для webhook-сервера"""
+
+    async def submit(self, body: bytes) -> bool:
+        """
+        Принять сырой апдейт.
+
+        Returns:
+            True если принят, False если нет места (перегрузка)
+
+        Raises:
+            ValueError: если апдейт некорректный
+        """
+        ...
+
+    def notify_fal(self, request_id: str) -> bool:
+        """
+        Webhook о завершении генерации Fal.ai: разбудить ее ожидание.
+
+        Returns:
+            True если уведомление доставлено туда, где ждут генерации
+        """
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        ...
+
+
+class LocalUpdateSink:
+    """Приемник, который разбирает апдейт и ставит его в локальную UpdateQueue"""
+
+    def __init__(self, bot: Bot, queue: UpdateQueue):
+        self._bot = bot
+        self.queue = queue
+
+    async def submit(self, body: bytes) -> bool:
+        update = Update.model_validate_json(body, context={"bot": self._bot})
+        return await self.queue.put(update)
+
+    def notify_fal(self, request_id: str) -> bool:
+        return FalQueue.notify(request_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.queue.stats()
+
+
+def create_webhook_app(
+    sink: UpdateSink,
+    path: str,
+    secret_token: Optional[str] = None,
+    fal_webhook_path: Optional[str] = None
+) -> web.Application:
+    """
+    Создать aiohttp приложение с webhook-эндпоинтом.
+
+    Args:
+        sink: Приемник апдейтов
+        path: Путь webhook (например, /webhook)
+        secret_token: Секрет, который Telegram присылает в заголовке
+        fal_webhook_path: Путь webhook о завершении генераций Fal.ai (опционально)
+    """
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret_token and not secrets.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), secret_token
+        ):
+            return web.Response(status=401)
+
+        body = await request.read()
+
+        try:
+            accepted = await sink.submit(body)
+        except ValueError:
+            logger.warning("Получен некорректный апдейт", exc_info=True)
+            # 200, чтобы Telegram не повторял заведомо битый апдейт
+            return web.Response(status=200)
+
+        if not accepted:
+            # Не-2xx ответ: Telegram доставит апдейт повторно позже
+            return web.Response(status=503, headers={"Retry-After": "1"})
+
+        return web.Response(status=200)
+
+    async def handle_health(request: web.Request) -> web.Response:
+        return web.json_response(sink.stats())
+
+    async def handle_fal_webhook(request: web.Request) -> web.Response:
+        try:
+            payload = await request.json()
+            request_id = payload["request_id"]
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+
+        # Webhook только будит ожидание, результат FalQueue забирает сам
+        if not sink.notify_fal(request_id):
+            logger.debug(f"Webhook Fal.ai для неизвестной генерации {request_id}")
+        return web.Response(status=200)
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.router.add_get("/health", handle_health)
+    if fal_webhook_path:
+        app.router.add_post(fal_webhook_path, handle_fal_webhook)
+    return app
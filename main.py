@@ -2,17 +2,29 @@ import asyncio
 import logging
 import signal
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiohttp import web
 from dotenv import load_dotenv
+from typing import Optional
 import os
 
 from bot.handlers import admin_handler, start_handler, tourist_handler, partner_handler, pro_handler, ai_designer_handler, ai_trainer_handler, content_maker_handler
 from bot.middlewares.database import DatabaseMiddleware
 from bot.middlewares.performance import PerformanceMiddleware
+from bot.middlewares.user_lane import UserLaneMiddleware
 from bot.database.database import init_db, engine
 from bot.utils.http_client import HTTPClientManager
+from bot.services.radar_event_writer import get_radar_event_writer
+from bot.utils.fsm_storage import create_fsm_storage
+from bot.utils.background_jobs import close_background_jobs
+from bot.utils.cache import start_cache_janitor, stop_cache_janitor
+from bot.utils.update_queue import UpdateQueue
+from bot.utils.vector_index import get_document_index
+from bot.utils.webhook import create_webhook_app, LocalUpdateSink
+from bot.utils.sharding import ShardRouter, consume_shard_queue
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -31,13 +43,29 @@ logger = logging.getLogger(__name__)
 logging.getLogger('aiogram').setLevel(logging.WARNING)
 logging.getLogger('aiohttp').setLevel(logging.WARNING)
 
-async def shutdown(bot: Bot):
+async def shutdown(bot: Bot, dp: Dispatcher):
     """
     Graceful shutdown - корректное закрытие всех ресурсов.
     """
     logger.info("Начинаем graceful shutdown...")
     
     try:
+        # Сохраняем FSM (до закрытия database engine)
+        await dp.storage.close()
+        logger.info("FSM storage закрыт")
+        
+        # Дожидаемся фоновых задач (им еще нужны HTTP clients и БД)
+        await close_background_jobs()
+        logger.info("Фоновые задачи остановлены")
+        
+        # Останавливаем очистку кэшей (логирует их статистику)
+        await stop_cache_janitor()
+        
+        # Останавливаем обновление in-memory vector index
+        document_index = get_document_index()
+        if document_index is not None:
+            await document_index.stop()
+        
         # Закрываем HTTP clients
         await HTTPClientManager.close_all()
         logger.info("HTTP clients закрыты")
@@ -46,7 +74,12 @@ async def shutdown(bot: Bot):
         await bot.session.close()
         logger.info("Bot session закрыт")
         
+        # Дописываем буфер событий радара (до закрытия database engine)
+        await get_radar_event_writer().close()
+        logger.info("Radar event writer закрыт")
+        
         # Закрываем database engine
+        logger.info(f"Статистика сессий БД: {DatabaseMiddleware.stats()}")
         await engine.dispose()
         logger.info("Database engine закрыт")
         
@@ -56,31 +89,48 @@ async def shutdown(bot: Bot):
     logger.info("Graceful shutdown завершен")
 
 
-async def main():
+def start_document_index() -> None:
+    """Запустить загрузку in-memory индекса documents (если он включен)"""
+    document_index = get_document_index()
+    if document_index is not None:
+        document_index.start()
+
+
+def create_bot() -> Bot:
     """
-    Главная функция запуска бота с поддержкой graceful shutdown.
+    Создать экземпляр бота.
     """
-    
     # Получаем токен бота
     bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
     if not bot_token:
         raise ValueError("TELEGRAM_BOT_TOKEN не найден в .env файле")
     
-    # Инициализация бота и диспетчера
-    bot = Bot(
+    return Bot(
         token=bot_token,
         default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN)
     )
+
+
+def create_dispatcher(storage: Optional[BaseStorage] = None) -> Dispatcher:
+    """
+    Создать диспетчер с middleware и роутерами.
     
-    # Создаем хранилище для FSM
-    storage = MemoryStorage()
+    Args:
+        storage: FSM хранилище (по умолчанию — персистентное, см. FSM_STORAGE)
+    """
+    if storage is None:
+        storage = create_fsm_storage()
     dp = Dispatcher(storage=storage)
     
     # Подключаем middleware в правильном порядке через update.outer_middleware:
     # 1. Performance (измеряет всё)
-    # 2. Database (управляет транзакциями)
+    # 2. UserLane (апдейты одного пользователя по очереди, до получения сессии БД)
+    # 3. Database (управляет транзакциями)
     # Используем outer_middleware чтобы избежать дублирования обработки
     dp.update.outer_middleware(PerformanceMiddleware())
+    dp.update.outer_middleware(UserLaneMiddleware(
+        cancel_superseded=os.getenv('USER_LANE_CANCEL_SUPERSEDED', '0') == '1'
+    ))
     dp.update.outer_middleware(DatabaseMiddleware())
     
     # Регистрируем роутеры
@@ -93,24 +143,206 @@ async def main():
     dp.include_router(ai_trainer_handler.router)
     dp.include_router(content_maker_handler.router)
     
-    # Инициализация БД
+    return dp
+
+
+async def run_polling(bot: Bot, dp: Dispatcher):
+    """
+    Запуск в режиме long polling (по умолчанию).
+    """
+    # Убираем webhook, если он остался от webhook-режима
+    await bot.delete_webhook(drop_pending_updates=False)
+    
+    await dp.start_polling(
+        bot,
+        allowed_updates=dp.resolve_used_update_types(),
+        handle_signals=False  # Обрабатываем сигналы сами
+    )
+
+
+def create_update_queue(bot: Bot, dp: Dispatcher, **overrides) -> UpdateQueue:
+    """
+    Создать очередь апдейтов с настройками из .env.
+    """
+    options = {
+        'maxsize': int(os.getenv('UPDATE_QUEUE_SIZE', '1000')),
+        'workers': int(os.getenv('UPDATE_WORKERS', '8')),
+        'overflow': os.getenv('UPDATE_QUEUE_OVERFLOW', 'reject'),
+        'put_timeout': float(os.getenv('UPDATE_QUEUE_PUT_TIMEOUT', '5'))
+    }
+    options.update(overrides)
+    
+    return UpdateQueue(
+        process=lambda update: dp.feed_update(bot, update),
+        **options
+    )
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """
+    Запуск в режиме webhook с ограниченной очередью апдейтов.
+    
+    Настройки (.env):
+    - WEBHOOK_URL: публичный адрес бота (https://example.com)
+    - WEBHOOK_PATH: путь webhook (по умолчанию /webhook)
+    - WEBHOOK_HOST / WEBHOOK_PORT: адрес локального HTTP-сервера
+    - WEBHOOK_SECRET: секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+    - UPDATE_QUEUE_SIZE: размер очереди апдейтов (в шардированном режиме — на воркер)
+    - UPDATE_WORKERS: количество воркеров очереди (в каждом процессе)
+    - UPDATE_QUEUE_OVERFLOW: reject (сразу 503) или wait (ждать место)
+    - UPDATE_QUEUE_PUT_TIMEOUT: сколько ждать место в режиме wait (сек)
+    - WORKER_PROCESSES: количество процессов-воркеров (>1 включает шардирование по from_user.id)
+    - FAL_WEBHOOK_PATH: путь webhook о завершении генераций Fal.ai (публичный адрес — FAL_WEBHOOK_URL)
+    """
+    webhook_url = os.getenv('WEBHOOK_URL')
+    if not webhook_url:
+        raise ValueError("WEBHOOK_URL не найден в .env файле")
+    
+    webhook_path = os.getenv('WEBHOOK_PATH', '/webhook')
+    webhook_host = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+    webhook_port = int(os.getenv('WEBHOOK_PORT', '8080'))
+    webhook_secret = os.getenv('WEBHOOK_SECRET')
+    worker_processes = int(os.getenv('WORKER_PROCESSES', '1'))
+    
+    if worker_processes > 1:
+        # Фронт только маршрутизирует апдейты, обработка — в процессах-воркерах
+        sink = ShardRouter(
+            worker_target=run_shard_worker,
+            shards=worker_processes,
+            queue_size=int(os.getenv('UPDATE_QUEUE_SIZE', '1000'))
+        )
+    else:
+        sink = LocalUpdateSink(bot, create_update_queue(bot, dp))
+    
+    app = create_webhook_app(
+        sink,
+        webhook_path,
+        webhook_secret,
+        fal_webhook_path=os.getenv('FAL_WEBHOOK_PATH', '/fal/webhook')
+    )
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, webhook_host, webhook_port)
+    
+    # Останавливаемся по SIGINT/SIGTERM
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass  # Windows
+    
+    if isinstance(sink, ShardRouter):
+        sink.start()
+    else:
+        sink.queue.start()
+    
+    await site.start()
+    await bot.set_webhook(
+        url=f"{webhook_url.rstrip('/')}{webhook_path}",
+        secret_token=webhook_secret,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    
+    logger.info(f"🌐 Webhook сервер запущен на {webhook_host}:{webhook_port}{webhook_path}")
+    
+    try:
+        await stop_event.wait()
+    finally:
+        # Сначала перестаем принимать апдейты, затем дообрабатываем очередь
+        await runner.cleanup()
+        if isinstance(sink, ShardRouter):
+            await sink.close()
+        else:
+            await sink.queue.close()
+
+
+async def shard_worker_main(index: int, worker_queue):
+    """
+    Основной цикл процесса-воркера: свой Bot, Dispatcher, пулы БД и HTTP.
+    """
+    bot = create_bot()
+    dp = create_dispatcher()
     await init_db()
+    start_cache_janitor()
+    start_document_index()
+    
+    # Ограничение размера — на межпроцессной очереди, здесь ждем место без таймаута
+    queue = create_update_queue(bot, dp, overflow='wait', put_timeout=None)
+    sink = LocalUpdateSink(bot, queue)
+    queue.start()
+    
+    logger.info(f"🧩 Воркер {index} запущен")
+    
+    # SIGTERM (kill, systemd) — та же остановка, что по sentinel: дообработка и shutdown()
+    stop_event = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop_event.set)
+    except NotImplementedError:
+        pass  # Windows
     
-    logger.info("🚀 Бот запущен и готов к работе!")
+    try:
+        await consume_shard_queue(worker_queue, sink.submit, stop=stop_event)
+    finally:
+        await queue.close()
+        await shutdown(bot, dp)
+        logger.info(f"🧩 Воркер {index} остановлен")
+
+
+def run_shard_worker(index: int, worker_queue):
+    """
+    Точка входа процесса-воркера (запускается через multiprocessing spawn).
+    """
+    # Ctrl+C получает вся группа процессов — воркер останавливает фронт через sentinel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    
+    try:
+        asyncio.run(shard_worker_main(index, worker_queue))
+    except Exception as e:
+        logger.error(f"Критическая ошибка в воркере {index}: {e}", exc_info=True)
+
+
+async def main():
+    """
+    Главная функция запуска бота с поддержкой graceful shutdown.
+    
+    Режим выбирается через BOT_MODE: polling (по умолчанию) или webhook.
+    """
+    
+    bot_mode = os.getenv('BOT_MODE', 'polling')
+    
+    # В шардированном режиме фронт только маршрутизирует апдейты:
+    # БД, кэши, индексы и FSM хранилище нужны лишь процессам-воркерам
+    routing_only = bot_mode == 'webhook' and int(os.getenv('WORKER_PROCESSES', '1')) > 1
+    
+    # Инициализация бота и диспетчера (фронту диспетчер нужен только для allowed_updates)
+    bot = create_bot()
+    dp = create_dispatcher(storage=MemoryStorage() if routing_only else None)
+    
+    if not routing_only:
+        # Инициализация БД
+        await init_db()
+        
+        # Фоновая очистка истекших записей кэшей
+        start_cache_janitor()
+        
+        # In-memory индекс базы знаний тренажера (если включен)
+        start_document_index()
+    
+    logger.info(f"🚀 Бот запущен и готов к работе! (режим: {bot_mode})")
     logger.info(f"📊 Performance monitoring активирован (порог: 500ms)")
     logger.info(f"💾 Database connection pool настроен (size: 10, max_overflow: 20)")
     
-    # Запуск polling
     try:
-        await dp.start_polling(
-            bot,
-            allowed_updates=dp.resolve_used_update_types(),
-            handle_signals=False  # Обрабатываем сигналы сами
-        )
+        if bot_mode == 'webhook':
+            await run_webhook(bot, dp)
+        else:
+            await run_polling(bot, dp)
     except (KeyboardInterrupt, SystemExit):
         logger.info("Получен сигнал остановки")
     finally:
-        await shutdown(bot)
+        await shutdown(bot, dp)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,131 @@
+"""
+Webhook-режим под всплеском апдейтов: локальный фейковый отправитель Telegram.
+
+Отправитель ведет себя как Telegram: шлет апдейты POST-запросами с секретом
+и повторяет апдейт, получив не-2xx ответ. Проверяем, что очередь не растет
+больше maxsize, лишнее отклоняется 503, и в итоге каждый апдейт обработан ровно один раз.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from bot.utils.update_queue import UpdateQueue
+
+
+def test_queue_rejects_when_full():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def process(update):
+            await release.wait()
+
+        queue = UpdateQueue(process, maxsize=2, workers=1, overflow='reject')
+        queue.start()
+
+        # Один апдейт в работе у воркера, два в очереди, четвертый не помещается
+        assert await queue.put(1)
+        await asyncio.sleep(0)
+        assert await queue.put(2)
+        assert await queue.put(3)
+        assert not await queue.put(4)
+
+        release.set()
+        await queue.close()
+        return queue.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats['accepted'] == 3
+    assert stats['rejected'] == 1
+    assert stats['processed'] == 3
+
+
+def test_queue_wait_policy_times_out():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def process(update):
+            await release.wait()
+
+        queue = UpdateQueue(process, maxsize=1, workers=1, overflow='wait', put_timeout=0.05)
+        queue.start()
+
+        assert await queue.put(1)
+        await asyncio.sleep(0)
+        assert await queue.put(2)
+        accepted = await queue.put(3)
+
+        release.set()
+        await queue.close()
+        return accepted
+
+    assert asyncio.run(scenario()) is False
+
+
+def test_fake_telegram_burst_is_processed_once():
+    pytest.importorskip("aiogram")
+    test_utils = pytest.importorskip("aiohttp.test_utils")
+
+    from bot.utils.webhook import SECRET_HEADER, create_webhook_app
+
+    class RecordingSink:
+        """Приемник как LocalUpdateSink, но без разбора апдейта в aiogram"""
+
+        def __init__(self, queue: UpdateQueue):
+            self.queue = queue
+
+        async def submit(self, body: bytes) -> bool:
+            return await self.queue.put(json.loads(body))
+
+        def notify_fal(self, request_id: str) -> bool:
+            return False
+
+        def stats(self):
+            return self.queue.stats()
+
+    async def scenario():
+        processed = []
+        max_seen = 0
+
+        async def process(update):
+            nonlocal max_seen
+            max_seen = max(max_seen, queue.stats()['queue_size'])
+            await asyncio.sleep(0.01)
+            processed.append(update['update_id'])
+
+        queue = UpdateQueue(process, maxsize=5, workers=2, overflow='reject')
+        sink = RecordingSink(queue)
+        app = create_webhook_app(sink, '/webhook', secret_token='secret')
+
+        async with test_utils.TestClient(test_utils.TestServer(app)) as client:
+            queue.start()
+
+            unauthorized = await client.post('/webhook', data=b'{}')
+            assert unauthorized.status == 401
+
+            async def send(update_id: int) -> int:
+                """Фейковый Telegram: повторяет апдейт, пока не получит 2xx"""
+                body = json.dumps({'update_id': update_id, 'message': {'from': {'id': update_id}}})
+                attempts = 0
+                while True:
+                    attempts += 1
+                    response = await client.post(
+                        '/webhook', data=body, headers={SECRET_HEADER: 'secret'}
+                    )
+                    if response.status == 200:
+                        return attempts
+                    assert response.status == 503
+                    await asyncio.sleep(0.01)
+
+            attempts = await asyncio.gather(*(send(i) for i in range(50)))
+            await queue.close()
+
+        return processed, max_seen, attempts, queue.stats()
+
+    processed, max_seen, attempts, stats = asyncio.run(scenario())
+
+    assert sorted(processed) == list(range(50))
+    assert max_seen <= 5
+    assert stats['rejected'] > 0
+    assert sum(attempts) == 50 + stats['rejected']